@@ -1,17 +1,38 @@
-try:
-    from win32com.client import Dispatch
-except Exception:
-    Dispatch = None
+from __future__ import annotations
+
+from time import monotonic, perf_counter, sleep
+_IMPORT_STARTED = perf_counter()
+
 from datetime import datetime
-import speech_recognition as sr
-import wikipedia
 import webbrowser as wb
 import os
 import random
-from PIL import ImageGrab
-import psutil
 import platform
-import numpy as np
+import json
+import threading
+import re
+import subprocess
+import shlex
+import sys
+import queue
+import wave
+import hashlib
+import tempfile
+import heapq
+import itertools
+from array import array
+import importlib
+import importlib.util
+from abc import ABC, abstractmethod
+import argparse
+import gc
+from contextlib import contextmanager, redirect_stdout
+import io
+import tracemalloc
+from math import gcd, isnan
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 JOKES = [
@@ -25,43 +46,349 @@ JOKES = [
     "Debugging: Being the detective in a crime movie where you are also the murderer.",
 ]
 
-tts = None
-pyttsx3_engine = None
-if Dispatch:
+STARTUP_TIMINGS = []
+STARTUP_REPORT = os.environ.get("VISERYS_STARTUP_REPORT", "") not in ("", "0")
+
+
+@contextmanager
+def startup_timer(component: str):
+    """Records how long a startup component took in STARTUP_TIMINGS."""
+    started = perf_counter()
     try:
-        tts = Dispatch("SAPI.SpVoice")
-    except Exception:
-        tts = None
+        yield
+    finally:
+        STARTUP_TIMINGS.append((component, perf_counter() - started))
+
+
+def mark_startup(event: str) -> bool:
+    """Records the time since the module started importing, once per event.
+
+    Returns True the first time an event is recorded.
+    """
+    if any(name == event for name, _ in STARTUP_TIMINGS):
+        return False
+    STARTUP_TIMINGS.append((event, perf_counter() - _IMPORT_STARTED))
+    return True
+
+
+def startup_report() -> str:
+    """Formats the recorded startup timings, one component per line."""
+    return "\n".join(f"{name:<32}{seconds * 1000:9.1f} ms" for name, seconds in STARTUP_TIMINGS)
+
+
+TRACE_BUFFER_SIZE = 20000
+TRACE_FILE = os.environ.get("VISERYS_TRACE", "")
+
+
+class Tracer:
+    """Records timed spans for each command turn in a bounded in-memory buffer.
+
+    Spans keep perf_counter() start times relative to module import, the
+    thread that ran them and the turn they belong to, so one turn can be
+    followed from capture to the last speak() across worker threads. The
+    current turn is per thread; code handing work to another thread passes
+    the turn along explicitly.
+    """
+
+    def __init__(self, capacity: int = TRACE_BUFFER_SIZE):
+        self.spans = deque(maxlen=capacity)
+        self.local = threading.local()
+        self.last_turn = 0
+        self.lock = threading.Lock()
+
+    def new_turn(self) -> int:
+        with self.lock:
+            self.last_turn += 1
+            return self.last_turn
+
+    def current_turn(self) -> Optional[int]:
+        return getattr(self.local, "turn", None)
+
+    @contextmanager
+    def turn(self, turn_id: Optional[int] = None):
+        """Makes spans recorded on this thread belong to `turn_id` (a new turn if None)."""
+        previous = self.current_turn()
+        self.local.turn = turn_id if turn_id is not None else self.new_turn()
+        try:
+            yield self.local.turn
+        finally:
+            self.local.turn = previous
+
+    @contextmanager
+    def span(self, name: str, turn: Optional[int] = None, **args):
+        """Records how long the body of the with block took as span `name`."""
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, perf_counter() - started, turn, args)
+
+    def record(self, name: str, started: float, duration: float, turn: Optional[int] = None,
+               args: Optional[dict] = None) -> None:
+        self.spans.append({
+            "name": name,
+            "turn": turn if turn is not None else self.current_turn(),
+            "start": started - _IMPORT_STARTED,
+            "duration": duration,
+            "thread": threading.current_thread().name,
+            "args": args or {},
+        })
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+    def export_jsonl(self, path: str) -> None:
+        """Writes one JSON object per span."""
+        with open(path, "w", encoding="utf-8") as f:
+            for span in list(self.spans):
+                f.write(json.dumps(span, separators=(",", ":")) + "\n")
+
+    def export_chrome(self, path: str) -> None:
+        """Writes the spans in Chrome trace format (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for span in list(self.spans):
+            tid = threads.setdefault(span["thread"], len(threads) + 1)
+            events.append({"name": span["name"], "cat": "viserys", "ph": "X", "pid": pid, "tid": tid,
+                           "ts": span["start"] * 1e6, "dur": span["duration"] * 1e6,
+                           "args": {**span["args"], "turn": span["turn"]}})
+        for name, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, separators=(",", ":"))
+
+    def export(self, path: str) -> None:
+        """Exports to `path`: Chrome trace format for .json files, JSON lines otherwise."""
+        if path.lower().endswith(".json"):
+            self.export_chrome(path)
+        else:
+            self.export_jsonl(path)
 
-if not tts:
+    def summary(self) -> dict:
+        """Returns {stage: {count, mean, p50, p95, max}} over the buffered spans."""
+        spans = list(self.spans)
+        stats = StageStats(window=max(len(spans), 1))
+        for span in spans:
+            stats.record(span["name"], span["duration"])
+        return stats.summary()
+
+    def profile_report(self) -> str:
+        """Formats p50 / p95 latency per stage, slowest p95 first."""
+        rows = sorted(self.summary().items(), key=lambda item: item[1]["p95"], reverse=True)
+        lines = [f"{'stage':<32}{'count':>6}{'p50':>12}{'p95':>12}"]
+        for stage, row in rows:
+            lines.append(f"{stage:<32}{row['count']:>6}{row['p50'] * 1000:9.1f} ms{row['p95'] * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+
+TRACER = Tracer()
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    Import time is recorded in STARTUP_TIMINGS, so heavy dependencies show up
+    in the startup report wherever they end up being loaded.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Imports the module if needed and returns it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with startup_timer(f"import {self._name}"):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+def module_available(name: str) -> bool:
+    """Returns True if a module is installed, without importing it."""
     try:
-        import pyttsx3
-        pyttsx3_engine = pyttsx3.init()
-        voices = pyttsx3_engine.getProperty('voices')
-        if len(voices) > 1:
-            pyttsx3_engine.setProperty('voice', voices[1].id)
-        pyttsx3_engine.setProperty('rate', 150)
-        pyttsx3_engine.setProperty('volume', 1)
-    except Exception:
-        pyttsx3_engine = None
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+sr = LazyModule("speech_recognition")
+wikipedia = LazyModule("wikipedia")
+ImageGrab = LazyModule("PIL.ImageGrab")
+Image = LazyModule("PIL.Image")
+psutil = LazyModule("psutil")
+np = LazyModule("numpy")
+pyaudio = LazyModule("pyaudio")
+sd = LazyModule("sounddevice")
+mutagen = LazyModule("mutagen")
+vosk = LazyModule("vosk")
+
+tts = None
+pyttsx3_engine = None
+
+
+def init_tts_engines() -> None:
+    """Creates the SAPI voice, or a pyttsx3 engine when SAPI is unavailable.
+
+    Runs on the speech worker thread, which also owns the engines afterwards.
+    """
+    global tts, pyttsx3_engine
+    with startup_timer("tts engine"):
+        try:
+            import pythoncom
+            from win32com.client import Dispatch
+            pythoncom.CoInitialize()
+            tts = Dispatch("SAPI.SpVoice")
+        except Exception:
+            tts = None
 
-VOICE_INPUT_AVAILABLE = True
-try:
-    import pyaudio
-except Exception:
-    VOICE_INPUT_AVAILABLE = False
+        if not tts:
+            try:
+                import pyttsx3
+                pyttsx3_engine = pyttsx3.init()
+                voices = pyttsx3_engine.getProperty('voices')
+                if len(voices) > 1:
+                    pyttsx3_engine.setProperty('voice', voices[1].id)
+                pyttsx3_engine.setProperty('rate', 150)
+                pyttsx3_engine.setProperty('volume', 1)
+            except Exception:
+                pyttsx3_engine = None
+
+
+VOICE_INPUT_AVAILABLE = module_available("pyaudio")
+SD_AVAILABLE = module_available("sounddevice")
+MUTAGEN_AVAILABLE = module_available("mutagen")
+
+
+def check_audio_backends() -> None:
+    """Imports the audio input modules and disables the ones that fail to load."""
+    global VOICE_INPUT_AVAILABLE, SD_AVAILABLE
+    if VOICE_INPUT_AVAILABLE:
+        try:
+            pyaudio.load()
+        except Exception:
+            VOICE_INPUT_AVAILABLE = False
+    if SD_AVAILABLE:
+        try:
+            sd.load()
+        except Exception:
+            SD_AVAILABLE = False
 
-SD_AVAILABLE = False
-try:
-    import sounddevice as sd
-    SD_AVAILABLE = True
-except Exception:
-    SD_AVAILABLE = False
 
 INPUT_GAIN = 1.8
 DEFAULT_RECORD_SECONDS = 4
 SELECTED_DEVICE_INDEX = None
 
+SD_STREAMING_CAPTURE = True
+VAD_FRAME_MS = 30
+VAD_ENERGY_THRESHOLD = 300.0
+VAD_MAX_ZCR = 0.35
+VAD_TRAILING_SILENCE = 0.6
+VAD_PRE_ROLL = 0.3
+VAD_MAX_SECONDS = 15
+VAD_STALL_SECONDS = 1.0
+
+AUDIO_PREPROCESS = True
+RECOGNITION_SAMPLERATE = 16000
+RESAMPLER_TAPS = 32
+RESAMPLER_CUTOFF = 0.9
+AGC_TARGET_RMS = 3000.0
+AGC_MIN_GAIN = 0.5
+AGC_MAX_GAIN = 12.0
+NOISE_FFT_SIZE = 512
+NOISE_OVERSUBTRACTION = 2.0
+NOISE_SPECTRAL_FLOOR = 0.05
+
+RECOGNIZER_BACKEND = os.environ.get("VISERYS_RECOGNIZER", "google")
+RECOGNIZER_LANGUAGE = "en-in"
+OFFLINE_RECOGNIZER_ENGINE = os.environ.get("VISERYS_OFFLINE_ENGINE", "sphinx")
+STREAMING_RECOGNITION = os.environ.get("VISERYS_STREAMING", "") not in ("", "0")
+VOSK_MODEL_PATH = os.environ.get("VISERYS_VOSK_MODEL", "vosk-model")
+STUB_STREAM_CHARS_PER_SECOND = 14.0
+STUB_STREAM_LAG = 0.2
+RECOGNITION_CACHE = os.environ.get("VISERYS_RECOGNITION_CACHE", "") not in ("", "0")
+RECOGNITION_CACHE_SIZE = 256
+RECOGNITION_CACHE_MAX_DISTANCE = 17.0
+RECOGNITION_CACHE_WINDOW = 8
+FINGERPRINT_POOL = 2
+FINGERPRINT_DYNAMIC_RANGE = 10.0
+
+MIC_CALIBRATION_SECONDS = 0.5
+MIC_DRIFT_RATIO = 2.0
+MIC_RECALIBRATE_AFTER_TIMEOUTS = 3
+MIC_PHRASE_TIME_LIMIT = 15
+MIC_PHRASE_MAX_AGE = 10
+MIC_QUEUE_SIZE = 4
+
+SPEECH_ACTIVE = threading.Event()
+
+
+class DialogGate:
+    """Set while at least one handler is waiting for a spoken answer.
+
+    Handlers running at the same time can each ask a follow-up question;
+    every hold() counts, and the gate only clears when the last one ends.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+    @contextmanager
+    def hold(self):
+        with self.lock:
+            self.count += 1
+            self.event.set()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.count -= 1
+                if not self.count:
+                    self.event.clear()
+
+    def is_set(self) -> bool:
+        return self.event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.event.wait(timeout)
+
+
+DIALOG_ACTIVE = DialogGate()
+BACKGROUND_THROTTLED = threading.Event()
+SPEECH_SERIAL = 0
+SPEECH_COALESCE_CHARS = 80
+SPEECH_COALESCE_MAX_CHARS = 240
+SPEECH_BARGE_IN = False
+SVSF_ASYNC = 1
+SVSF_PURGE_BEFORE_SPEAK = 2
+
+TTS_COMMAND = os.environ.get("VISERYS_TTS_COMMAND", "")
+TTS_STUB_WORD_SECONDS = 0.0
+TTS_ACK_SECONDS = 5.0
+TTS_ACK_SECONDS_PER_CHAR = 0.15
+POWERSHELL_TTS_SCRIPT = (
+    "Add-Type -AssemblyName System.Speech;"
+    "[Console]::InputEncoding = [Text.Encoding]::UTF8;"
+    "$s = New-Object System.Speech.Synthesis.SpeechSynthesizer;"
+    "[Console]::Out.WriteLine('ready');"
+    "while (($line = [Console]::In.ReadLine()) -ne $null) {"
+    " $s.Speak($line); [Console]::Out.WriteLine('done') }"
+)
+STUB_TTS_SCRIPT = (
+    "import sys, time\n"
+    "for line in sys.stdin:\n"
+    "    time.sleep(len(line.split()) * float(sys.argv[1]) if len(sys.argv) > 1 else 0)\n"
+    "    print('done', flush=True)\n"
+)
+
 
 def choose_input_device() -> Optional[int]:
     """Interactively choose an input device. Returns device index or None."""
@@ -107,553 +434,5181 @@ def list_input_devices() -> list:
     return devices
 
 
-def speak(audio) -> None:
-    """Speak the given text using SAPI, pyttsx3, or fallback to printing.
-
-    Guarantees an audio attempt at each step; falls back to printing when TTS is unavailable.
-    """
+def pick_input_device(devices: Optional[list] = None) -> Optional[tuple]:
+    """Returns (index, name, default samplerate) of the selected input device, or None."""
+    devices = devices if devices is not None else list_input_devices()
+    if not devices:
+        return None
+    dev_index, dev_name = devices[0]
+    for d, name in devices:
+        if d == SELECTED_DEVICE_INDEX:
+            dev_index, dev_name = d, name
     try:
-        if tts:
-            tts.Speak(str(audio))
-        elif pyttsx3_engine:
-            pyttsx3_engine.say(str(audio))
-            pyttsx3_engine.runAndWait()
-        else:
-            if platform.system() == "Windows":
-                try:
-                    escaped = str(audio).replace('"', '\\"')
-                    cmd = f"Add-Type –AssemblyName System.Speech; (New-Object System.Speech.Synthesis.SpeechSynthesizer).Speak(\"{escaped}\")"
-                    os.system(f"powershell -Command \"{cmd}\"")
-                except Exception:
-                    print(str(audio))
-            else:
-                print(str(audio))
+        samplerate = int(sd.query_devices(dev_index).get('default_samplerate', 16000))
     except Exception:
-        try:
-            print(str(audio))
-        except Exception:
-            pass
+        samplerate = 16000
+    return dev_index, dev_name, samplerate
 
 
-def time() -> None:
-    """Tells the current time."""
-    current_time = datetime.now().strftime("%I:%M:%S %p")
-    speak("The current time is")
-    speak(current_time)
-    print("The current time is", current_time)
+def vad_frames(frames: np.ndarray, energy_threshold: float = VAD_ENERGY_THRESHOLD,
+               max_zcr: float = VAD_MAX_ZCR) -> np.ndarray:
+    """Classifies a (n_frames, frame_len) block of int16-scaled samples as speech or silence.
 
+    A frame counts as speech when its RMS energy is above `energy_threshold`
+    and its zero-crossing rate is low enough to rule out hiss.
+    """
+    samples = frames.astype(np.float32)
+    rms = np.sqrt(np.mean(samples * samples, axis=1))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / max(frames.shape[1] - 1, 1)
+    return (rms >= energy_threshold) & (zcr <= max_zcr)
 
-def date() -> None:
-    """Tells the current date."""
-    now = datetime.now()
-    speak("The current date is")
-    speak(f"{now.day} {now.strftime('%B')} {now.year}")
-    print(f"The current date is {now.day}/{now.month}/{now.year}")
 
+class AudioRingBuffer:
+    """Fixed-capacity mono sample buffer written by an audio callback.
 
-def wishme() -> None:
-    """Greets the user based on the time of day."""
-    speak("Welcome back")
-    print("Welcome back")
+    Positions are absolute sample counts since the stream started, so readers
+    can keep their place while the writer wraps around.
+    """
 
-    hour = datetime.now().hour
-    if 4 <= hour < 12:
-        speak("Good morning!")
-        print("Good morning!")
-    elif 12 <= hour < 16:
-        speak("Good afternoon!")
-        print("Good afternoon!")
-    elif 16 <= hour < 24:
-        speak("Good evening!")
-        print("Good evening!")
-    else:
-        speak("Good night, see you tomorrow.")
+    def __init__(self, capacity: int):
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.written = 0
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
 
-    assistant_name = load_name()
-    speak(f"{assistant_name} at your service. Please tell me how may I assist you.")
-    print(f"{assistant_name} at your service. Please tell me how may I assist you.")
+    def write(self, samples: np.ndarray) -> None:
+        """Appends samples, overwriting the oldest ones when full."""
+        samples = samples[-self.capacity:]
+        with self.lock:
+            start = self.written % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self.data[start:start + first] = samples[:first]
+            self.data[:len(samples) - first] = samples[first:]
+            self.written += len(samples)
+        self.ready.set()
 
+    def read(self, start: int, end: int) -> np.ndarray:
+        """Returns a copy of samples [start, end), clamped to what is still buffered."""
+        with self.lock:
+            end = min(end, self.written)
+            start = max(start, end - self.capacity, 0)
+            idx = np.arange(start, end) % self.capacity
+            return self.data[idx]
 
-def screenshot() -> None:
-    """Takes a screenshot and saves it."""
-    try:
-        img = ImageGrab.grab()
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        screenshots_dir = os.path.join(script_dir, "screenshots")
-        os.makedirs(screenshots_dir, exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        img_path = os.path.join(screenshots_dir, f"screenshot_{timestamp}.png")
-        img.save(img_path)
-        speak(f"Screenshot saved as {img_path}.")
-        print(f"Screenshot saved as {img_path}.")
-    except Exception as e:
-        speak("Failed to take screenshot.")
-        print(f"Screenshot error: {e}")
 
-def takecommand(prompt: Optional[str] = None, timeout: int = 6) -> Optional[str]:
-    """Takes microphone input from the user and returns it as lowercase text.
+class WavInputStream:
+    """Stand-in for sd.InputStream that plays a WAV file into the callback.
 
-    If `prompt` is provided, it will be spoken before listening.
+    Accepts the same keyword arguments capture_utterance() passes to
+    sd.InputStream. With `realtime=False` blocks are delivered as fast as the
+    consumer can take them, which keeps tests quick. Instead of a file,
+    int16 `samples` at the stream's `samplerate` can be passed directly.
     """
-    if prompt:
-        speak(prompt)
-    if VOICE_INPUT_AVAILABLE:
-        r = sr.Recognizer()
-        try:
-            r.dynamic_energy_threshold = True
-            r.energy_threshold = 300
-        except Exception:
-            pass
-        try:
-            with sr.Microphone() as source:
-                try:
-                    r.adjust_for_ambient_noise(source, duration=0.5)
-                except Exception:
-                    pass
-                speak("Listening now.")
-                r.pause_threshold = 1
 
-                try:
-                    audio = r.listen(source, timeout=timeout)
-                except sr.WaitTimeoutError:
-                    speak("Timeout occurred. Please try again.")
-                    return None
+    def __init__(self, path: Optional[str] = None, realtime: bool = True, blocksize: int = 0, callback=None,
+                 samples: Optional[np.ndarray] = None, **kwargs):
+        if samples is not None:
+            self.samplerate = kwargs.get("samplerate", WAKE_WORD_SAMPLERATE)
+            self.samples = np.asarray(samples, dtype=np.int16).reshape(-1, 1)
+        else:
+            with wave.open(path, "rb") as wav:
+                self.samplerate = wav.getframerate()
+                channels = wav.getnchannels()
+                frames = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+            self.samples = frames.reshape(-1, channels)[:, :1]
+        self.realtime = realtime
+        self.blocksize = blocksize or 1024
+        self.callback = callback
+        self.stopped = threading.Event()
+        self.worker = None
 
-        except Exception as e:
-            print(f"Microphone error: {e}")
-            audio = None
+    def _run(self) -> None:
+        for start in range(0, len(self.samples), self.blocksize):
+            if self.stopped.is_set():
+                return
+            block = self.samples[start:start + self.blocksize]
+            self.callback(block, len(block), None, None)
+            sleep(len(block) / self.samplerate if self.realtime else 0.0005)
 
-        if audio:
-            try:
-                speak("Recognizing.")
-                query = r.recognize_google(audio, language="en-in")
-                print(f"Heard: {query}")
-                return query.lower()
-            except sr.UnknownValueError:
-                speak("Sorry, I did not understand that.")
-                return None
-            except sr.RequestError:
-                speak("Speech recognition service is unavailable.")
-                return None
-            except Exception as e:
-                speak(f"An error occurred while recognizing speech: {e}")
-                print(f"Error: {e}")
+    @property
+    def active(self) -> bool:
+        """False once every block has been delivered, like a finished sd.InputStream."""
+        return self.worker is not None and self.worker.is_alive()
 
-    if SD_AVAILABLE:
-        try:
-            devices = list_input_devices()
-            if not devices:
-                speak("No input audio devices detected. Please connect a microphone and ensure it's enabled in Windows settings.")
-            else:
-                dev_index, dev_name = devices[0]
-                try:
-                    dev_info = sd.query_devices(dev_index)
-                    samplerate = int(dev_info.get('default_samplerate', 16000))
-                except Exception:
-                    samplerate = 16000
+    def __enter__(self):
+        self.worker = threading.Thread(target=self._run, name="wav-stream", daemon=True)
+        self.worker.start()
+        return self
 
-                duration = max(DEFAULT_RECORD_SECONDS, timeout)
-                speak(f"Recording from {dev_name} for {duration} seconds.")
-                try:
-                    recording = sd.rec(int(duration * samplerate), samplerate=samplerate, channels=1, dtype='int16', device=dev_index)
-                    sd.wait()
-                    try:
-                        arr = recording.astype('float32')
-                        arr *= INPUT_GAIN
-                        arr = np.clip(arr, -32768, 32767)
-                        int16_arr = arr.astype('int16')
-                        data = int16_arr.tobytes()
-                    except Exception:
-                        data = recording.tobytes()
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.worker.join(timeout=1)
 
-                    audio_data = sr.AudioData(data, samplerate, 2)
-                    speak("Recognizing.")
-                    query = sr.Recognizer().recognize_google(audio_data, language="en-in")
-                    print(f"Heard: {query}")
-                    return query.lower()
-                except Exception as e:
-                    print(f"sounddevice capture failed: {e}")
-                    speak("I couldn't capture audio with sounddevice. Please check microphone permissions, select the correct input device, or try restarting the program.")
-        except Exception as e:
-            print(f"sounddevice recording failed: {e}")
 
-    speak("Voice input is not available. Please type your response.")
-    try:
-        typed = input((prompt + "\n> ") if prompt else "> ")
-        return typed.lower().strip() if typed else None
-    except Exception:
-        return None
+class FakeSoundDevice:
+    """Stand-in for the sounddevice module that plays queued utterances.
 
-    r = sr.Recognizer()
-    with sr.Microphone() as source:
-        try:
-            r.adjust_for_ambient_noise(source, duration=0.5)
-        except Exception:
-            pass
-        speak("Listening now.")
-        r.pause_threshold = 1
+    Provides the parts takecommand() uses: query_devices(), InputStream, rec()
+    and wait(). Each queued utterance (int16 samples at `samplerate`) is
+    followed by enough quiet noise for capture_utterance() to end the phrase.
+    With `realtime` the input streams play at the speed of speech.
+    """
 
-        try:
-            audio = r.listen(source, timeout=timeout)
-        except sr.WaitTimeoutError:
-            speak("Timeout occurred. Please try again.")
-            return None
+    def __init__(self, samplerate: int = 16000, noise_level: float = 30.0, seed: int = 0, realtime: bool = False):
+        self.samplerate = samplerate
+        self.realtime = realtime
+        self.noise_level = noise_level
+        self.rng = np.random.default_rng(seed)
+        self.pending = deque()
 
-    try:
-        speak("Recognizing.")
-        query = r.recognize_google(audio, language="en-in")
-        print(f"Heard: {query}")
-        return query.lower()
-    except sr.UnknownValueError:
-        speak("Sorry, I did not understand that.")
-        return None
-    except sr.RequestError:
-        speak("Speech recognition service is unavailable.")
-        return None
-    except Exception as e:
-        speak(f"An error occurred while recognizing speech: {e}")
-        print(f"Error: {e}")
-        return None
+    def queue_audio(self, samples: np.ndarray) -> None:
+        self.pending.append(np.asarray(samples, dtype=np.float32))
 
-def open_notepad() -> None:
-    """Opens Windows Notepad."""
-    try:
-        os.system("notepad")
-        speak("Opening Notepad")
-    except Exception as e:
-        speak("Sorry, I couldn't open Notepad")
-        print(f"Error: {e}")
+    def _noise(self, n: int) -> np.ndarray:
+        return self.rng.normal(0.0, self.noise_level, n).astype(np.float32)
 
-def scan_installed_apps() -> dict:
-    """Scans common directories for installed applications."""
-    installed_apps = {}
-    search_locations = [
-        os.path.expandvars(r"%ProgramFiles%"),
-        os.path.expandvars(r"%ProgramFiles(x86)%"),
-        os.path.expandvars(r"%LocalAppData%"),
-        os.path.expandvars(r"%AppData%"),
-        r"C:\Windows\System32",
-        os.path.expandvars(r"%LocalAppData%\WhatsApp"),
-        os.path.expandvars(r"%LocalAppData%\Microsoft\WindowsApps"),
-        os.path.expandvars(r"%LocalAppData%\Programs")
-    ]
+    def _next_utterance(self) -> np.ndarray:
+        lead = self._noise(int(0.1 * self.samplerate))
+        tail = self._noise(int((VAD_TRAILING_SILENCE + 0.5) * self.samplerate))
+        speech = self.pending.popleft() if self.pending else np.zeros(0, dtype=np.float32)
+        speech = speech + self._noise(len(speech))
+        return np.clip(np.concatenate([lead, speech, tail]), -32768, 32767).astype(np.int16)
 
-    extensions = ['.exe']
+    def query_devices(self, device: Optional[int] = None):
+        info = {"name": "Scripted input", "max_input_channels": 1, "default_samplerate": self.samplerate}
+        return info if device is not None else [info]
 
-    for location in search_locations:
-        if os.path.exists(location):
-            for root, _, files in os.walk(location):
-                for file in files:
-                    if any(file.lower().endswith(ext) for ext in extensions):
-                        app_name = os.path.splitext(file)[0].lower()
-                        installed_apps[app_name] = os.path.join(root, file)
+    def InputStream(self, **kwargs) -> WavInputStream:
+        return WavInputStream(samples=self._next_utterance(), realtime=self.realtime, **kwargs)
 
-    return installed_apps
+    def rec(self, frames: int, samplerate: int = 16000, channels: int = 1, dtype: str = 'int16', device=None):
+        samples = self._next_utterance()[:frames]
+        return np.pad(samples, (0, frames - len(samples))).reshape(-1, 1)
 
-INSTALLED_APPS = scan_installed_apps()
+    def wait(self) -> None:
+        pass
 
-def open_app(app_name: str) -> None:
-    """Opens a Windows application by name."""
-    common_apps = {
-        "chrome": "start chrome",
-        "edge": "start msedge",
-        "word": "start winword",
-        "excel": "start excel",
-        "powerpoint": "start powerpnt",
-        "calculator": "calc",
-        "paint": "mspaint",
-        "cmd": "start cmd",
-        "control panel": "control",
-        "task manager": "taskmgr",
-        "explorer": "explorer",
-        "notepad": "notepad",
-        "whatsapp": os.path.expandvars(r"%LocalAppData%\WhatsApp\WhatsApp.exe"),
-    }
 
-    try:
-        app_name_lower = app_name.lower()
+def capture_utterance(samplerate: int, timeout: float = 6, device: Optional[int] = None,
+                      stream_factory=None, on_block=None) -> Optional[sr.AudioData]:
+    """Streams audio until the speaker stops and returns it prepared for recognition.
 
-        if app_name_lower in ("whatsapp", "whatsapp desktop", "whatsapp messenger"):
-            matches = [(n, p) for n, p in INSTALLED_APPS.items() if 'whatsapp' in n]
-            if matches:
-                try:
-                    os.startfile(matches[0][1])
-                    speak(f"Opening {matches[0][0]}")
-                    print(f"Opening application: {matches[0][1]}")
-                    return
-                except Exception:
-                    pass
+    Frames are classified by vad_frames() as they arrive; capture ends after
+    VAD_TRAILING_SILENCE seconds of silence following speech. Returns None if
+    no speech starts within `timeout` seconds. `on_block(samples, speaking)`
+    is called with each block as it is classified.
 
+    A stream that stops delivering audio ends the capture: when it is no
+    longer active or has been silent for VAD_STALL_SECONDS, what was heard so
+    far is returned, and a wall-clock deadline bounds the whole capture.
+    """
+    if stream_factory is None:
+        stream_factory = sd.InputStream
+    frame_len = max(int(samplerate * VAD_FRAME_MS / 1000), 1)
+    ring = AudioRingBuffer(int(samplerate * (VAD_MAX_SECONDS + VAD_PRE_ROLL + 1)))
+    silence_frames_needed = max(int(VAD_TRAILING_SILENCE * 1000 / VAD_FRAME_MS), 1)
+    max_samples = int(VAD_MAX_SECONDS * samplerate)
+
+    def callback(indata, frames, time_info, status):
+        ring.write(indata[:, 0])
+
+    processed = 0
+    speech_start = None
+    speech_end = None
+    silent_run = 0
+    started = monotonic()
+    last_block = None
+    deadline = started + timeout + VAD_MAX_SECONDS + VAD_TRAILING_SILENCE + VAD_STALL_SECONDS
+    with stream_factory(samplerate=samplerate, channels=1, dtype='int16', device=device,
+                        blocksize=frame_len, callback=callback) as stream:
+        while True:
+            ring.ready.wait(0.1)
+            ring.ready.clear()
+            active = getattr(stream, "active", True)
+            available = (ring.written - processed) // frame_len
+            now = monotonic()
+            if not available:
+                stalled = last_block is not None and now - last_block > VAD_STALL_SECONDS
+                ended = stalled or not active
+                if ended or now > deadline:
+                    if speech_start is None:
+                        return None
+                    break
+            else:
+                last_block = now
+                block = ring.read(processed, processed + available * frame_len)
+                voiced = vad_frames(block.reshape(available, frame_len))
+                if on_block is not None:
+                    on_block(block, speech_start is not None or bool(voiced.any()))
+                for i, is_speech in enumerate(voiced):
+                    frame_end = processed + (i + 1) * frame_len
+                    if is_speech:
+                        if speech_start is None:
+                            speech_start = frame_end - frame_len
+                        speech_end = frame_end
+                        silent_run = 0
+                    elif speech_start is not None:
+                        silent_run += 1
+                        if silent_run >= silence_frames_needed:
+                            break
+                processed += available * frame_len
+                if speech_start is not None and silent_run >= silence_frames_needed:
+                    break
+                if speech_start is not None and processed - speech_start >= max_samples:
+                    break
+            if speech_start is None and monotonic() - started > timeout:
+                return None
+
+    start = max(speech_start - int(VAD_PRE_ROLL * samplerate), 0)
+    segment = ring.read(start, speech_end + int(VAD_TRAILING_SILENCE * samplerate))
+    return prepare_audio(segment, samplerate)
+
+
+class PolyphaseResampler:
+    """Streaming rational-ratio resampler using a polyphase windowed-sinc filter.
+
+    Input is processed in fixed blocks whose length is a multiple of the
+    decimation factor, so the gather indices and filter coefficients for a
+    block are computed once and every block reuses preallocated buffers.
+
+    By default each output sample is computed from RESAMPLER_TAPS input
+    samples per unit of decimation, with the cutoff at 90% of the lower
+    Nyquist rate, which keeps aliases below -60 dB. The filter delay is
+    removed from the output and flush() returns the tail, so a whole
+    recording comes out exactly `out_rate / in_rate` times as long.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, taps_per_phase: Optional[int] = None, block_ms: int = 10):
+        g = gcd(in_rate, out_rate)
+        self.up, self.down = out_rate // g, in_rate // g
+        self.passthrough = self.up == self.down
+        taps = taps_per_phase or RESAMPLER_TAPS * -(-self.down // self.up)
+        self.history = taps - 1
+        self.block = self.down * max(-(-in_rate * block_ms // 1000) // self.down, 1)
+        self.out_per_block = self.block * self.up // self.down
+        self.consumed = 0
+        self.emitted = 0
+
+        length = taps * self.up
+        self.skip = round((length - 1) / 2 / self.down)
+        n = np.arange(length) - (length - 1) / 2
+        cutoff = RESAMPLER_CUTOFF * 0.5 / max(self.up, self.down)
+        prototype = (2 * cutoff * self.up * np.sinc(2 * cutoff * n) * np.blackman(length)).astype(np.float32)
+
+        positions = np.arange(self.out_per_block) * self.down
+        phase, base = positions % self.up, positions // self.up
+        j = np.arange(taps)
+        self.indices = (self.history + base[:, None] - j[None, :]).astype(np.intp)
+        self.coefficients = prototype[phase[:, None] + j[None, :] * self.up]
+
+        self.buffer = np.zeros(self.history + self.block, dtype=np.float32)
+        self.fill = 0
+        self.gather = np.empty_like(self.coefficients)
+        self.out = np.empty(self.out_per_block * 8, dtype=np.float32)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Resamples a chunk; returns a view of the output produced so far.
+
+        The view is only valid until the next call.
+        """
+        if self.passthrough:
+            return samples
+        needed = (self.fill + len(samples)) // self.block * self.out_per_block
+        if needed > len(self.out):
+            self.out = np.empty(needed * 2, dtype=np.float32)
+        self.consumed += len(samples)
+        produced = 0
+        offset = 0
+        while offset < len(samples):
+            take = min(self.block - self.fill, len(samples) - offset)
+            start = self.history + self.fill
+            self.buffer[start:start + take] = samples[offset:offset + take]
+            self.fill += take
+            offset += take
+            if self.fill == self.block:
+                np.take(self.buffer, self.indices, out=self.gather)
+                np.multiply(self.gather, self.coefficients, out=self.gather)
+                np.sum(self.gather, axis=1, out=self.out[produced:produced + self.out_per_block])
+                produced += self.out_per_block
+                self.buffer[:self.history] = self.buffer[-self.history:] if self.history else 0
+                self.fill = 0
+        drop = min(self.skip, produced)
+        self.skip -= drop
+        self.emitted += produced - drop
+        return self.out[drop:produced]
+
+    def flush(self) -> np.ndarray:
+        """Returns the output still held back by the filter; no more input may follow."""
+        if self.passthrough:
+            return np.zeros(0, dtype=np.float32)
+        expected = self.consumed * self.up // self.down
+        parts = []
+        while self.emitted < expected:
+            parts.append(self.process(np.zeros(self.block, dtype=np.float32)).copy())
+        tail = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+        return tail[:len(tail) - (self.emitted - expected)]
+
+
+class SpectralSubtractor:
+    """Streaming spectral-subtraction noise suppressor.
+
+    Uses 50% overlapped sqrt-Hann frames. The noise spectrum is learned from
+    the first frames and then tracked during quiet frames; each frame keeps
+    at least NOISE_SPECTRAL_FLOOR of its power to avoid musical noise.
+    """
+
+    def __init__(self, n_fft: int = NOISE_FFT_SIZE, oversubtraction: float = NOISE_OVERSUBTRACTION,
+                 floor: float = NOISE_SPECTRAL_FLOOR, learn_frames: int = 6):
+        self.n_fft = n_fft
+        self.hop = n_fft // 2
+        self.window = np.sqrt(np.hanning(n_fft + 1)[:-1]).astype(np.float32)
+        self.oversubtraction = oversubtraction
+        self.floor = floor
+        self.learn_frames = learn_frames
+        self.frames_seen = 0
+        self.noise = np.zeros(n_fft // 2 + 1, dtype=np.float64)
+        self.frame = np.zeros(n_fft, dtype=np.float32)
+        self.windowed = np.empty(n_fft, dtype=np.float32)
+        self.overlap = np.zeros(n_fft, dtype=np.float32)
+        self.fill = 0
+        self.out = np.empty(self.hop * 8, dtype=np.float32)
+
+    def _suppress(self) -> None:
+        np.multiply(self.frame, self.window, out=self.windowed)
+        spectrum = np.fft.rfft(self.windowed)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        if self.frames_seen < self.learn_frames:
+            self.noise += (power - self.noise) / (self.frames_seen + 1)
+        elif power.sum() < 2.0 * self.noise.sum():
+            self.noise = 0.95 * self.noise + 0.05 * power
+        self.frames_seen += 1
+        clean = np.maximum(power - self.oversubtraction * self.noise, self.floor * power)
+        spectrum *= np.sqrt(clean / np.maximum(power, 1e-12))
+        self.overlap += np.fft.irfft(spectrum, self.n_fft).astype(np.float32) * self.window
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Denoises a chunk; returns a view of the output produced so far (delayed by one hop)."""
+        needed = (self.fill + len(samples)) // self.hop * self.hop
+        if needed > len(self.out):
+            self.out = np.empty(needed * 2, dtype=np.float32)
+        produced = 0
+        offset = 0
+        while offset < len(samples):
+            take = min(self.hop - self.fill, len(samples) - offset)
+            start = self.hop + self.fill
+            self.frame[start:start + take] = samples[offset:offset + take]
+            self.fill += take
+            offset += take
+            if self.fill == self.hop:
+                self._suppress()
+                self.out[produced:produced + self.hop] = self.overlap[:self.hop]
+                produced += self.hop
+                self.overlap[:self.hop] = self.overlap[self.hop:]
+                self.overlap[self.hop:] = 0
+                self.frame[:self.hop] = self.frame[self.hop:]
+                self.fill = 0
+        return self.out[:produced]
+
+
+class AutomaticGainControl:
+    """Scales audio in place toward a target RMS level.
+
+    Gain drops quickly when the signal gets louder and rises slowly when it
+    gets quieter; near-silent chunks keep the current gain so background
+    noise is not amplified.
+    """
+
+    def __init__(self, target_rms: float = AGC_TARGET_RMS, min_gain: float = AGC_MIN_GAIN,
+                 max_gain: float = AGC_MAX_GAIN, attack: float = 0.5, release: float = 0.05,
+                 gate_rms: float = 100.0):
+        self.target_rms = target_rms
+        self.min_gain = min_gain
+        self.max_gain = max_gain
+        self.attack = attack
+        self.release = release
+        self.gate_rms = gate_rms
+        self.gain = 1.0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Applies gain to `samples` in place, clipping to the int16 range."""
+        if len(samples):
+            rms = float(np.sqrt(np.dot(samples, samples) / len(samples)))
+            if rms > self.gate_rms:
+                desired = min(max(self.target_rms / rms, self.min_gain), self.max_gain)
+                rate = self.attack if desired < self.gain else self.release
+                self.gain += (desired - self.gain) * rate
+            np.multiply(samples, self.gain, out=samples)
+            np.clip(samples, -32768, 32767, out=samples)
+        return samples
+
+
+class AudioPreprocessor:
+    """Chunk-wise preprocessing of captured audio for recognition.
+
+    Downmixes to mono, resamples to RECOGNITION_SAMPLERATE with a polyphase
+    filter, suppresses stationary noise and applies automatic gain control.
+    Samples are float32 on the int16 scale throughout.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int = RECOGNITION_SAMPLERATE, noise_suppression: bool = True,
+                 agc: bool = True):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.resampler = PolyphaseResampler(in_rate, out_rate)
+        self.denoiser = SpectralSubtractor() if noise_suppression else None
+        self.agc = AutomaticGainControl() if agc else None
+        self.mono = np.empty(0, dtype=np.float32)
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        """Processes one chunk of (frames,) or (frames, channels) samples.
+
+        Returns a view of the output that is valid until the next call.
+        """
+        if chunk.ndim == 2:
+            if len(self.mono) < len(chunk):
+                self.mono = np.empty(len(chunk) * 2, dtype=np.float32)
+            mono = self.mono[:len(chunk)]
+            np.mean(chunk, axis=1, out=mono)
+        else:
+            mono = chunk if chunk.dtype == np.float32 else chunk.astype(np.float32)
+        out = self.resampler.process(mono)
+        if self.denoiser is not None:
+            out = self.denoiser.process(out)
+        if self.agc is not None and len(out):
+            if out is chunk:
+                out = out.copy()
+            self.agc.process(out)
+        return out
+
+    def flush(self) -> np.ndarray:
+        """Pushes out samples still held back by the resampler and denoiser; no more input may follow."""
+        out = self.resampler.flush()
+        if self.denoiser is not None:
+            out = self.denoiser.process(np.concatenate([out, np.zeros(self.denoiser.n_fft, dtype=np.float32)]))
+        out = out.copy()
+        if self.agc is not None and len(out):
+            self.agc.process(out)
+        return out
+
+
+def preprocess_samples(samples: np.ndarray, samplerate: int, chunk_ms: int = 30) -> np.ndarray:
+    """Runs a whole recording through AudioPreprocessor in chunks and returns 16 kHz samples."""
+    pre = AudioPreprocessor(samplerate)
+    chunk = max(samplerate * chunk_ms // 1000, 1)
+    parts = [pre.process(samples[i:i + chunk]).copy() for i in range(0, len(samples), chunk)]
+    parts.append(pre.flush())
+    out = np.concatenate(parts)
+    delay = pre.denoiser.hop if pre.denoiser else 0
+    return out[delay:delay + len(samples) * RECOGNITION_SAMPLERATE // samplerate]
+
+
+def prepare_audio(samples: np.ndarray, samplerate: int) -> sr.AudioData:
+    """Turns captured float32 samples (int16 scale) into AudioData for recognition.
+
+    With AUDIO_PREPROCESS the audio is gain-controlled, denoised and sent at
+    16 kHz; otherwise the fixed INPUT_GAIN is applied in place.
+    """
+    if AUDIO_PREPROCESS:
+        out = preprocess_samples(samples, samplerate)
+        return sr.AudioData(out.astype(np.int16).tobytes(), RECOGNITION_SAMPLERATE, 2)
+    samples = samples.reshape(-1)
+    np.multiply(samples, INPUT_GAIN, out=samples)
+    np.clip(samples, -32768, 32767, out=samples)
+    return sr.AudioData(samples.astype(np.int16).tobytes(), samplerate, 2)
+
+
+def benchmark_preprocessing(seconds: float = 10.0, in_rate: int = 48000, chunk_ms: int = 10) -> dict:
+    """Measures preprocessing throughput in input samples per second."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * in_rate)) / in_rate
+    signal = (3000 * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 200, len(t))).astype(np.float32)
+    pre = AudioPreprocessor(in_rate)
+    chunk = in_rate * chunk_ms // 1000
+    started = perf_counter()
+    produced = 0
+    for i in range(0, len(signal), chunk):
+        produced += len(pre.process(signal[i:i + chunk]))
+    elapsed = perf_counter() - started
+    return {"input_rate": in_rate, "samples": len(signal), "output_samples": produced,
+            "samples_per_sec": len(signal) / elapsed, "realtime_factor": seconds / elapsed}
+
+
+class TTSProcess:
+    """A long-lived speech synthesizer process fed one utterance per line.
+
+    The process reads UTF-8 lines on stdin, speaks each one and then prints
+    "done" on stdout. It is started once, so each utterance only costs the
+    synthesis itself; it is restarted if it exits or is interrupted.
+
+    Plain synthesizers such as espeak never print "done". If a process has
+    not acknowledged anything by the deadline for the first line, it is
+    stopped and later utterances spawn the command once each, writing the
+    line and closing stdin, and wait for it to exit.
+    """
+
+    def __init__(self, argv: list):
+        self.argv = argv
+        self.proc = None
+        self.acks = None
+        self.line_protocol = True
+        self.acknowledged = False
+
+    def start(self) -> None:
+        """Starts the synthesizer process if it is not running."""
+        if self.proc is not None and self.proc.poll() is None:
+            return
+        self.acks = queue.Queue()
+        self.proc = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, text=True, encoding="utf-8", bufsize=1)
+        threading.Thread(target=self._read_acks, args=(self.proc.stdout, self.acks),
+                         name="tts-process", daemon=True).start()
+
+    @staticmethod
+    def _read_acks(stdout, acks: queue.Queue) -> None:
+        for line in stdout:
+            acks.put(line.strip())
+        acks.put(None)
+
+    def speak(self, text: str, interrupted=None) -> bool:
+        """Speaks one line and waits for the acknowledgement.
+
+        `interrupted` is polled while waiting; if it returns True the process
+        is stopped. Returns True when the utterance completed.
+        """
+        line = " ".join(text.split())
+        if not line:
+            return True
+        deadline = monotonic() + TTS_ACK_SECONDS + TTS_ACK_SECONDS_PER_CHAR * len(line)
+        if not self.line_protocol:
+            return self._speak_once(line, interrupted, deadline)
+        self.start()
+        acks = self.acks
+        try:
+            self.proc.stdin.write(line + "\n")
+            self.proc.stdin.flush()
+        except OSError:
+            self.close()
+            return False
+        while True:
+            try:
+                ack = acks.get(timeout=0.05)
+            except queue.Empty:
+                if interrupted is not None and interrupted():
+                    self.close()
+                    return False
+                if monotonic() > deadline:
+                    if not self.acknowledged:
+                        print(f"{self.argv[0]} does not acknowledge lines; starting it once per utterance.")
+                        self.line_protocol = False
+                    self.close()
+                    return False
+                continue
+            if ack is None:
+                self.close()
+                return False
+            if ack == "done":
+                self.acknowledged = True
+                return True
+
+    def _speak_once(self, line: str, interrupted, deadline: float) -> bool:
+        """Runs the command for one line, ending its input with EOF, and waits for it to exit."""
+        try:
+            proc = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+            proc.stdin.write(line + "\n")
+            proc.stdin.close()
+        except OSError:
+            return False
+        while proc.poll() is None:
+            if (interrupted is not None and interrupted()) or monotonic() > deadline:
+                proc.kill()
+                return False
+            sleep(0.05)
+        return proc.returncode == 0
+
+    def close(self) -> None:
+        """Stops the synthesizer process."""
+        proc, self.proc = self.proc, None
+        if proc is not None and proc.poll() is None:
+            try:
+                proc.stdin.close()
+                proc.terminate()
+                proc.wait(timeout=2)
+            except Exception:
+                proc.kill()
+
+
+def stub_tts_argv(word_seconds: float = TTS_STUB_WORD_SECONDS) -> list:
+    """Returns the command line of a stub synthesizer that speaks nothing."""
+    return [sys.executable, "-c", STUB_TTS_SCRIPT, str(word_seconds)]
+
+
+def make_tts_process() -> Optional[TTSProcess]:
+    """Returns the fallback synthesizer process for this platform, if any.
+
+    VISERYS_TTS_COMMAND may name any command implementing the line protocol
+    (or "stub"); otherwise Windows uses a warm PowerShell SpeechSynthesizer.
+    """
+    if TTS_COMMAND == "stub":
+        return TTSProcess(stub_tts_argv())
+    if TTS_COMMAND:
+        return TTSProcess(shlex.split(TTS_COMMAND))
+    if platform.system() == "Windows":
+        return TTSProcess(["powershell", "-NoProfile", "-NonInteractive", "-Command", POWERSHELL_TTS_SCRIPT])
+    return None
+
+
+def benchmark_tts_process(argv: Optional[list] = None, utterances: int = 20) -> dict:
+    """Compares per-utterance latency of a warm TTS process and one spawned per line."""
+    if argv is None:
+        argv = stub_tts_argv()
+    text = "The current time is ten thirty"
+
+    warm = TTSProcess(argv)
+    warm.start()
+    started = perf_counter()
+    for _ in range(utterances):
+        warm.speak(text)
+    warm_latency = (perf_counter() - started) / utterances
+    warm.close()
+
+    started = perf_counter()
+    for _ in range(utterances):
+        subprocess.run(argv, input=text + "\n", text=True, stdout=subprocess.DEVNULL, check=False)
+    spawn_latency = (perf_counter() - started) / utterances
+
+    return {"utterances": utterances, "warm_seconds": warm_latency, "spawn_seconds": spawn_latency}
+
+
+TTS_CACHE = os.environ.get("VISERYS_TTS_CACHE", "1") not in ("", "0")
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_BYTES = 32 * 1024 * 1024
+TTS_CACHE_MAX_ENTRIES = 256
+TTS_CACHE_SAVE_INTERVAL = 60.0
+SAFT22KHZ16BITMONO = 22
+SSFM_CREATE_FOR_WRITE = 3
+TTS_PROMPTS = [
+    "Welcome back",
+    "Good morning!",
+    "Good afternoon!",
+    "Good evening!",
+    "Good night, see you tomorrow.",
+    "Listening for your command.",
+    "Listening now.",
+    "Recognizing.",
+    "Timeout occurred. Please try again.",
+    "Sorry, I did not understand that.",
+    "Speech recognition service is unavailable.",
+    "Voice input is not available. Please type your response.",
+    "The current time is",
+    "Going offline. Have a good day!",
+] + JOKES
+
+
+def register_prompt(text: str) -> None:
+    """Marks `text` as a fixed phrase worth pre-rendering into the TTS cache."""
+    if text not in TTS_PROMPTS:
+        TTS_PROMPTS.append(text)
+
+
+def voice_signature() -> Optional[list]:
+    """Returns [engine, voice, rate, volume] for the active TTS engine, or None.
+
+    Must run on the speech worker thread, which owns the engines.
+    """
+    try:
+        if tts:
+            return ["sapi", str(tts.Voice.Id), str(tts.Rate), str(tts.Volume)]
+        if pyttsx3_engine:
+            return ["pyttsx3"] + [str(pyttsx3_engine.getProperty(name)) for name in ("voice", "rate", "volume")]
+    except Exception:
+        pass
+    return None
+
+
+def render_speech(text: str, path: str, stop=None) -> bool:
+    """Synthesizes `text` into a WAV file with SAPI or pyttsx3. Runs on the speech worker.
+
+    A SAPI render is abandoned as soon as `stop()` returns True, so newly
+    queued speech does not wait for it; pyttsx3 renders run to completion.
+    """
+    try:
+        if tts:
+            from win32com.client import Dispatch
+            stream = Dispatch("SAPI.SpFileStream")
+            stream.Format.Type = SAFT22KHZ16BITMONO
+            stream.Open(path, SSFM_CREATE_FOR_WRITE, False)
+            output = tts.AudioOutputStream
+            try:
+                tts.AudioOutputStream = stream
+                tts.Speak(text, SVSF_ASYNC)
+                while not tts.WaitUntilDone(50):
+                    if stop is not None and stop():
+                        tts.Speak("", SVSF_ASYNC | SVSF_PURGE_BEFORE_SPEAK)
+                        return False
+            finally:
+                stream.Close()
+                tts.AudioOutputStream = output
+        elif pyttsx3_engine:
+            pyttsx3_engine.save_to_file(text, path)
+            pyttsx3_engine.runAndWait()
+        else:
+            return False
+        with wave.open(path, "rb") as wav:
+            return wav.getsampwidth() == 2 and wav.getnframes() > 0
+    except Exception as e:
+        print(f"Could not render speech for the cache: {e}")
+        return False
+
+
+def play_clip(samples: np.ndarray, samplerate: int, path: str, interrupted) -> bool:
+    """Plays cached PCM through sounddevice, or the WAV file with winsound on Windows.
+
+    Stops early when `interrupted()` returns True. Returns False if there is
+    no low-latency output, so the caller can synthesize instead.
+    """
+    deadline = monotonic() + len(samples) / samplerate + 0.1
+    if SD_AVAILABLE:
+        try:
+            sd.play(samples, samplerate)
+            while monotonic() < deadline:
+                if interrupted():
+                    sd.stop()
+                    break
+                sleep(0.02)
+            return True
+        except Exception as e:
+            print(f"Cached speech playback failed: {e}")
+    if platform.system() == "Windows":
+        try:
+            import winsound
+            winsound.PlaySound(path, winsound.SND_FILENAME | winsound.SND_ASYNC)
+            while monotonic() < deadline:
+                if interrupted():
+                    winsound.PlaySound(None, 0)
+                    break
+                sleep(0.02)
+            return True
+        except Exception as e:
+            print(f"Cached speech playback failed: {e}")
+    return False
+
+
+class TTSCache:
+    """On-disk cache of synthesized speech for fixed prompts.
+
+    Clips are WAV files keyed by the text and the voice signature (engine,
+    voice, rate, volume); switching to a different signature empties the
+    cache. A manifest keeps each clip's size and last use so the least
+    recently used clips are evicted beyond `max_bytes` or `max_entries`.
+    Decoded clips stay in memory once played.
+
+    Registered prompts are pre-rendered until the cache is full. After that,
+    only prompts that were actually spoken without a clip (want()) are
+    rendered, evicting the least recently used clips to make room, so
+    pre-rendering can never churn the cache on its own.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES,
+                 max_entries: int = TTS_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.signature = None
+        self.entries = {}
+        self.clips = {}
+        self.failed = set()
+        self.wanted = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.saved_at = monotonic()
+        self.stored_signature = None
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.stored_signature = data.get("signature")
+            self.entries = data.get("entries", {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self) -> None:
+        path = os.path.join(self.directory, self.MANIFEST)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"signature": self.signature, "entries": self.entries}, f, separators=(',', ':'))
+            os.replace(path + ".tmp", path)
+            self.dirty = False
+            self.saved_at = monotonic()
+        except OSError as e:
+            print(f"Could not save the speech cache: {e}")
+
+    def save_if_dirty(self, min_interval: float = TTS_CACHE_SAVE_INTERVAL) -> None:
+        """Saves last-use times changed by hits, at most once per `min_interval` seconds."""
+        if self.dirty and monotonic() - self.saved_at >= min_interval:
+            self.save()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(json.dumps([text, self.signature]).encode("utf-8")).hexdigest()[:20]
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".wav")
+
+    def set_signature(self, signature: list) -> None:
+        """Uses clips rendered with `signature`, dropping everything rendered with another voice."""
+        with self.lock:
+            if self.entries and signature != self.stored_signature:
+                self._clear()
+            self.signature = self.stored_signature = signature
+            self._evict()
+
+    def _clear(self) -> None:
+        for key in self.entries:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+        self.entries = {}
+        self.clips = {}
+        self.save()
+
+    def contains(self, text: str) -> bool:
+        return self.signature is not None and self.key(text) in self.entries
+
+    def get(self, text: str) -> Optional[tuple]:
+        """Returns (samples, samplerate, path) for a cached phrase, or None."""
+        if self.signature is None:
+            return None
+        key = self.key(text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["used"] = datetime.now().timestamp()
+            self.dirty = True
+            clip = self.clips.get(key)
+        if clip is None:
+            try:
+                with wave.open(self.path(key), "rb") as wav:
+                    samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+                    clip = (samples.reshape(-1, wav.getnchannels()), wav.getframerate(), self.path(key))
+            except (OSError, wave.Error, EOFError):
+                with self.lock:
+                    self.entries.pop(key, None)
+                    self.misses += 1
+                return None
+            with self.lock:
+                self.clips[key] = clip
+        with self.lock:
+            self.hits += 1
+        return clip
+
+    def want(self, text: str) -> None:
+        """Asks for a registered prompt that was spoken without a clip to be rendered next."""
+        if self.signature is not None and text not in self.wanted and self.key(text) not in self.entries:
+            self.wanted.append(text)
+
+    def render_missing(self, render, stop) -> int:
+        """Renders wanted prompts, then other uncached prompts while there is room, until `stop()` returns True.
+
+        `render(text, path, stop)` writes a WAV file and returns False if it
+        failed or was stopped. Returns how many clips were added. If the cache
+        directory cannot be created the cache turns itself off; other file
+        errors mark the text as failed.
+        """
+        if self.signature is None:
+            return 0
+        added = 0
+        for text in self.wanted + TTS_PROMPTS:
+            if stop():
+                break
+            wanted = text in self.wanted
+            key = self.key(text)
+            if key in self.entries or text in self.failed or (not wanted and self.full()):
+                continue
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"Speech cache disabled: {e}")
+                self.signature = None
+                break
+            tmp_path = os.path.join(self.directory, key + ".tmp.wav")
+            try:
+                if not render(text, tmp_path, stop):
+                    if stop():
+                        break
+                    self.failed.add(text)
+                else:
+                    os.replace(tmp_path, self.path(key))
+                    size = os.path.getsize(self.path(key))
+                    with self.lock:
+                        self.entries[key] = {"text": text, "bytes": size, "used": datetime.now().timestamp()}
+                        self._evict()
+                    added += 1
+            except OSError as e:
+                print(f"Could not cache speech for {text!r}: {e}")
+                self.failed.add(text)
+            if wanted:
+                self.wanted.remove(text)
+        if added:
+            self.save()
+        return added
+
+    def full(self) -> bool:
+        return (len(self.entries) >= self.max_entries
+                or sum(entry["bytes"] for entry in self.entries.values()) >= self.max_bytes)
+
+    def _evict(self) -> None:
+        total = sum(entry["bytes"] for entry in self.entries.values())
+        while self.entries and (total > self.max_bytes or len(self.entries) > self.max_entries):
+            key = min(self.entries, key=lambda k: self.entries[k]["used"])
+            total -= self.entries.pop(key)["bytes"]
+            self.clips.pop(key, None)
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def release_clips(self) -> int:
+        """Forgets the decoded clips; they are read from disk again when next played."""
+        with self.lock:
+            released = len(self.clips)
+            self.clips = {}
+        return released
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "bytes": sum(entry["bytes"] for entry in self.entries.values()),
+                "hits": self.hits, "misses": self.misses}
+
+
+class SpeechQueue:
+    """Speaks queued text on a dedicated worker thread.
+
+    say() returns immediately with an Event that is set once the text has been
+    spoken (or dropped by cancel()). Short messages queued back to back are
+    joined into one utterance. With SPEECH_BARGE_IN enabled, speech stops as
+    soon as the microphone session hears the user start a phrase.
+
+    A `sink` callable replaces the TTS engines entirely; it is given each
+    utterance instead of speaking it (the benchmark uses a null sink).
+
+    Fixed prompts are rendered into a TTSCache while the queue is idle and
+    then played back from memory; cached phrases are never coalesced with
+    other text so they can be found again.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.cache = None
+        self.held = None
+        self.items = queue.Queue()
+        self.pending = 0
+        self.idle = threading.Condition()
+        self.cancelled = threading.Event()
+        self.tts_process = None
+        self.worker = threading.Thread(target=self._run, name="speech", daemon=True)
+        self.worker.start()
+
+    def say(self, text: str) -> threading.Event:
+        """Queues `text` and returns an Event set when it has been spoken."""
+        done = threading.Event()
+        with self.idle:
+            self.pending += 1
+        self.items.put((text, done, TRACER.current_turn()))
+        return done
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until everything queued so far has been spoken. Returns False on timeout."""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.pending == 0, timeout)
+
+    def cancel(self) -> None:
+        """Drops queued speech and interrupts the current utterance."""
+        self.cancelled.set()
+        with self.idle:
+            held, self.held = self.held, None
+        if held is not None:
+            self._finish([held[1]])
+        while True:
+            try:
+                _, done, _ = self.items.get_nowait()
+            except queue.Empty:
+                break
+            self._finish([done])
+        if pyttsx3_engine:
             try:
+                pyttsx3_engine.stop()
+            except Exception:
+                pass
+
+    def busy(self) -> bool:
+        with self.idle:
+            return self.pending > 0
+
+    def _finish(self, handles: list) -> None:
+        for done in handles:
+            done.set()
+        with self.idle:
+            self.pending -= len(handles)
+            if self.pending == 0:
+                self.idle.notify_all()
+
+    def _cached(self, text: str) -> bool:
+        return self.cache is not None and self.cache.contains(text)
+
+    def _next_utterance(self) -> tuple:
+        with self.idle:
+            item, self.held = self.held, None
+        text, done, turn = item or self.items.get()
+        texts, handles = [text], [done]
+        total = len(text)
+        if self._cached(text):
+            return text, handles, turn
+        while len(texts[-1]) < SPEECH_COALESCE_CHARS:
+            try:
+                item = self.items.get_nowait()
+            except queue.Empty:
+                break
+            text, done, _ = item
+            if self._cached(text):
+                with self.idle:
+                    self.held = item
+                break
+            texts.append(text)
+            handles.append(done)
+            total += len(text)
+            if len(text) >= SPEECH_COALESCE_CHARS or total >= SPEECH_COALESCE_MAX_CHARS:
+                break
+        return " ".join(texts), handles, turn
+
+    def _interrupted(self) -> bool:
+        if self.cancelled.is_set():
+            return True
+        if SPEECH_BARGE_IN and _microphone_session is not None and _microphone_session.phrase_in_progress():
+            self.cancelled.set()
+            return True
+        return False
+
+    def _run(self) -> None:
+        if self.sink is None:
+            self._start_engines()
+        while True:
+            if self.cache is not None and self.held is None and self.items.empty():
                 try:
-                    os.startfile("whatsapp://")
-                    speak("Opening WhatsApp")
-                    print("Opening WhatsApp via URI protocol")
-                    return
-                except Exception:
-                    os.system('start "" "whatsapp://"')
-                    speak("Opening WhatsApp")
-                    print("Opening WhatsApp via start command")
-                    return
+                    self.cache.save_if_dirty()
+                    self.cache.render_missing(render_speech,
+                                              lambda: not self.items.empty() or BACKGROUND_THROTTLED.is_set())
+                except Exception as e:
+                    print(f"Speech cache disabled: {e}")
+                    self.cache = None
+            text, handles, turn = self._next_utterance()
+            self.cancelled.clear()
+            try:
+                with TRACER.span("speak", turn=turn, chars=len(text)):
+                    if self.sink is not None:
+                        self.sink(text)
+                    elif not self._play_cached(text):
+                        self._speak_now(text)
+            except Exception as e:
+                print(f"Speech sink failed: {e}")
+            finally:
+                self._finish(handles)
+
+    def _start_engines(self) -> None:
+        init_tts_engines()
+        if not tts and not pyttsx3_engine:
+            self.tts_process = make_tts_process()
+            if self.tts_process:
+                try:
+                    self.tts_process.start()
+                except OSError as e:
+                    print(f"Could not start speech process: {e}")
+                    self.tts_process = None
+        signature = voice_signature() if TTS_CACHE else None
+        if signature is not None and (SD_AVAILABLE or platform.system() == "Windows"):
+            self.cache = TTSCache()
+            self.cache.set_signature(signature)
+
+    def _play_cached(self, text: str) -> bool:
+        """Plays `text` from the TTS cache. Returns False if it has to be synthesized."""
+        clip = self.cache.get(text) if self._cached(text) else None
+        if clip is None:
+            if self.cache is not None and text in TTS_PROMPTS:
+                self.cache.want(text)
+            return False
+        global SPEECH_SERIAL
+        SPEECH_SERIAL += 1
+        SPEECH_ACTIVE.set()
+        try:
+            return play_clip(*clip, self._interrupted)
+        finally:
+            SPEECH_ACTIVE.clear()
+
+    def _speak_now(self, text: str) -> None:
+        """Speaks one utterance with SAPI, pyttsx3, a synthesizer process or print."""
+        global SPEECH_SERIAL
+        SPEECH_SERIAL += 1
+        SPEECH_ACTIVE.set()
+        try:
+            if tts:
+                tts.Speak(text, SVSF_ASYNC)
+                while not tts.WaitUntilDone(50):
+                    if self._interrupted():
+                        tts.Speak("", SVSF_ASYNC | SVSF_PURGE_BEFORE_SPEAK)
+                        break
+            elif pyttsx3_engine:
+                pyttsx3_engine.say(text)
+                pyttsx3_engine.runAndWait()
+            elif self.tts_process:
+                if not self.tts_process.speak(text, self._interrupted) and not self.cancelled.is_set():
+                    print(text)
+            else:
+                print(text)
+        except Exception:
+            try:
+                print(text)
+            except Exception:
+                pass
+        finally:
+            SPEECH_ACTIVE.clear()
+
+
+_speech_queue = None
+_speech_queue_lock = threading.Lock()
+
+
+def get_speech_queue() -> SpeechQueue:
+    """Returns the shared speech queue, starting its worker on first use."""
+    global _speech_queue
+    with _speech_queue_lock:
+        if _speech_queue is None:
+            _speech_queue = SpeechQueue()
+        return _speech_queue
+
+
+def set_speech_sink(sink) -> None:
+    """Sends all further speech to `sink(text)` instead of the TTS engines."""
+    global _speech_queue
+    with _speech_queue_lock:
+        _speech_queue = SpeechQueue(sink=sink)
+
+
+_speech_local = threading.local()
+
+
+@contextmanager
+def collect_speech():
+    """Holds back speak() calls made on this thread and yields the list of their texts.
+
+    Lets concurrently running handlers have their speech replayed in order
+    afterwards. Collected calls return an Event that is already set.
+    """
+    previous = getattr(_speech_local, "collected", None)
+    _speech_local.collected = []
+    try:
+        yield _speech_local.collected
+    finally:
+        _speech_local.collected = previous
+
+
+def speak(audio, wait: bool = False) -> threading.Event:
+    """Speak the given text using SAPI, pyttsx3, or fallback to printing.
+
+    Speech is queued and played on a background thread, so this returns
+    immediately unless `wait` is True. The returned Event is set once the
+    text has been spoken.
+    """
+    collected = getattr(_speech_local, "collected", None)
+    if collected is not None:
+        collected.append(str(audio))
+        done = threading.Event()
+        done.set()
+        return done
+    done = get_speech_queue().say(str(audio))
+    if wait:
+        done.wait()
+    return done
+
+
+def flush_speech(timeout: Optional[float] = None) -> bool:
+    """Waits until all queued speech has been spoken."""
+    return get_speech_queue().flush(timeout)
+
+
+def cancel_speech() -> None:
+    """Stops the current utterance and drops anything still queued."""
+    get_speech_queue().cancel()
+
+
+def time() -> None:
+    """Tells the current time."""
+    current_time = datetime.now().strftime("%I:%M:%S %p")
+    speak("The current time is")
+    speak(current_time)
+    print("The current time is", current_time)
+
+
+def date() -> None:
+    """Tells the current date."""
+    now = datetime.now()
+    speak("The current date is")
+    speak(f"{now.day} {now.strftime('%B')} {now.year}")
+    print(f"The current date is {now.day}/{now.month}/{now.year}")
+
+
+def wishme() -> None:
+    """Greets the user based on the time of day."""
+    speak("Welcome back")
+    print("Welcome back")
+
+    hour = datetime.now().hour
+    if 4 <= hour < 12:
+        speak("Good morning!")
+        print("Good morning!")
+    elif 12 <= hour < 16:
+        speak("Good afternoon!")
+        print("Good afternoon!")
+    elif 16 <= hour < 24:
+        speak("Good evening!")
+        print("Good evening!")
+    else:
+        speak("Good night, see you tomorrow.")
+
+    assistant_name = load_name()
+    register_prompt(f"{assistant_name} at your service. Please tell me how may I assist you.")
+    speak(f"{assistant_name} at your service. Please tell me how may I assist you.")
+    print(f"{assistant_name} at your service. Please tell me how may I assist you.")
+
+
+SCREENSHOT_FORMAT = os.environ.get("VISERYS_SCREENSHOT_FORMAT", "png").lower()
+SCREENSHOT_PNG_LEVEL = 6
+SCREENSHOT_QUALITY = 85
+SCREENSHOT_EXTENSIONS = {"png": "png", "jpeg": "jpg", "jpg": "jpg", "webp": "webp"}
+SCREENSHOT_BURST_MAX = 20
+SCREENSHOT_BURST_MAX_INTERVAL = 10.0
+
+
+def screenshots_directory() -> str:
+    """Returns the folder screenshots are saved in, next to this script."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, "screenshots")
+
+
+def save_image(img, path: str, fmt: str = SCREENSHOT_FORMAT, png_level: int = SCREENSHOT_PNG_LEVEL,
+               quality: int = SCREENSHOT_QUALITY) -> None:
+    """Encodes an image as PNG (zlib level), JPEG or WebP (quality) and writes it."""
+    if fmt == "png":
+        img.save(path, "PNG", compress_level=png_level)
+    elif fmt in ("jpeg", "jpg"):
+        img.convert("RGB").save(path, "JPEG", quality=quality)
+    elif fmt == "webp":
+        img.save(path, "WEBP", quality=quality)
+    else:
+        raise ValueError(f"Unsupported screenshot format: {fmt}")
+
+
+class ScreenshotWriter:
+    """Captures screenshots into memory and encodes them on a background thread.
+
+    capture() returns as soon as the screen has been grabbed; encoding and
+    writing happen on a single worker so files come out in order. `source`
+    returns a PIL image and defaults to ImageGrab.grab.
+    """
+
+    def __init__(self, directory: Optional[str] = None, fmt: str = SCREENSHOT_FORMAT,
+                 png_level: int = SCREENSHOT_PNG_LEVEL, quality: int = SCREENSHOT_QUALITY, source=None):
+        if fmt not in SCREENSHOT_EXTENSIONS:
+            raise ValueError(f"Unsupported screenshot format: {fmt}")
+        self.directory = directory or screenshots_directory()
+        self.fmt = fmt
+        self.png_level = png_level
+        self.quality = quality
+        self.source = source or ImageGrab.grab
+        self.encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot")
+        self.encode_times = deque(maxlen=100)
+
+    def next_path(self, suffix: str = "") -> str:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return os.path.join(self.directory, f"screenshot_{timestamp}{suffix}.{SCREENSHOT_EXTENSIONS[self.fmt]}")
+
+    def _encode(self, img, path: str) -> str:
+        started = perf_counter()
+        save_image(img, path, self.fmt, self.png_level, self.quality)
+        self.encode_times.append(perf_counter() - started)
+        return path
+
+    def capture(self, suffix: str = ""):
+        """Grabs the screen and queues it for saving. Returns (path, future)."""
+        img = self.source()
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.next_path(suffix)
+        return path, self.encoder.submit(self._encode, img, path)
+
+    def burst(self, count: int, interval: float) -> list:
+        """Takes `count` screenshots `interval` seconds apart. Returns [(path, future)].
+
+        `count` is capped at SCREENSHOT_BURST_MAX and `interval` at
+        SCREENSHOT_BURST_MAX_INTERVAL, so a burst blocks for at most a few minutes.
+        """
+        count = min(max(count, 0), SCREENSHOT_BURST_MAX)
+        interval = min(max(interval, 0.0), SCREENSHOT_BURST_MAX_INTERVAL)
+        shots = []
+        next_shot = monotonic()
+        for n in range(count):
+            sleep(max(next_shot - monotonic(), 0))
+            shots.append(self.capture(f"_{n + 1}"))
+            next_shot += interval
+        return shots
+
+
+_screenshot_writer = None
+
+
+def get_screenshot_writer() -> ScreenshotWriter:
+    global _screenshot_writer
+    if _screenshot_writer is None:
+        _screenshot_writer = ScreenshotWriter()
+    return _screenshot_writer
+
+
+def _report_saved(future) -> None:
+    error = future.exception()
+    if error:
+        speak("Failed to save screenshot.")
+        print(f"Screenshot error: {error}")
+    else:
+        print(f"Screenshot saved as {future.result()}.")
+
+
+def screenshot(count: int = 1, interval: float = 1.0) -> None:
+    """Takes a screenshot (or a burst of them) and saves it in the background."""
+    try:
+        writer = get_screenshot_writer()
+        if count > 1:
+            shots = writer.burst(count, interval)
+            speak(f"Took {len(shots)} screenshots. They are being saved in {writer.directory}.")
+        else:
+            shots = [writer.capture()]
+            speak(f"Screenshot taken. Saving it as {shots[0][0]}.")
+        for _, future in shots:
+            future.add_done_callback(_report_saved)
+    except Exception as e:
+        speak("Failed to take screenshot.")
+        print(f"Screenshot error: {e}")
+
+
+def fake_screen(size: tuple = (1920, 1080)):
+    """Returns a synthetic screen-like image for headless benchmarks."""
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (gradient, gradient.rotate(90).resize(size), Image.new("L", size, 200)))
+
+
+def benchmark_screenshots(shots: int = 5, size: tuple = (1920, 1080), settings: Optional[list] = None) -> list:
+    """Compares capture-to-ack latency with encode time for several formats.
+
+    Uses fake_screen() as the source and writes to a temporary folder, so it
+    runs without a display.
+    """
+    settings = settings or [("png", 1, 0), ("png", 6, 0), ("jpeg", 0, 85), ("webp", 0, 80)]
+    frame = fake_screen(size)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt, level, quality in settings:
+            writer = ScreenshotWriter(directory, fmt, png_level=level, quality=quality, source=frame.copy)
+            acks = []
+            futures = []
+            for n in range(shots):
+                started = perf_counter()
+                path, future = writer.capture(f"_{fmt}{level}{quality}_{n}")
+                acks.append(perf_counter() - started)
+                futures.append(future)
+            for future in futures:
+                future.result()
+            writer.encoder.shutdown()
+            results.append({
+                "format": fmt, "png_level": level, "quality": quality,
+                "ack_ms": sum(acks) / len(acks) * 1000,
+                "encode_ms": sum(writer.encode_times) / len(writer.encode_times) * 1000,
+                "bytes": os.path.getsize(path),
+            })
+    return results
+
+
+class RecognizerBackend(ABC):
+    """Base class for the speech recognition engines used by takecommand().
+
+    Subclasses implement _recognize(); recognize() wraps it with latency
+    bookkeeping and raises sr.UnknownValueError / sr.RequestError like
+    speech_recognition does. start_stream() returns an object whose
+    feed(samples) returns the current partial hypothesis (or None) and whose
+    finish() returns the final transcript. Backends with `streaming` set
+    produce partial hypotheses; the default stream only buffers the audio
+    and recognizes it as a whole in finish().
+    """
+
+    name = "base"
+    streaming = False
+
+    def __init__(self):
+        self.calls = 0
+        self.total_latency = 0.0
+        self.last_latency = None
+
+    def recognize(self, audio: sr.AudioData) -> str:
+        """Returns the transcript of `audio`, recording how long it took."""
+        started = perf_counter()
+        try:
+            with TRACER.span(f"recognition:{self.name}"):
+                return self._recognize(audio)
+        finally:
+            self.last_latency = perf_counter() - started
+            self.calls += 1
+            self.total_latency += self.last_latency
+
+    @abstractmethod
+    def _recognize(self, audio: sr.AudioData) -> str:
+        ...
+
+    def start_stream(self, samplerate: int) -> "BufferedRecognitionStream":
+        return BufferedRecognitionStream(self, samplerate)
+
+    def stats(self) -> dict:
+        """Returns call count and mean / last latency in seconds."""
+        mean = self.total_latency / self.calls if self.calls else 0.0
+        return {"backend": self.name, "calls": self.calls, "mean_latency": mean, "last_latency": self.last_latency}
+
+
+class GoogleRecognizerBackend(RecognizerBackend):
+    """Recognizes speech with Google's web speech API (needs network)."""
+
+    name = "google"
+
+    def __init__(self, language: str = RECOGNIZER_LANGUAGE):
+        super().__init__()
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def _recognize(self, audio: sr.AudioData) -> str:
+        return self.recognizer.recognize_google(audio, language=self.language)
+
+
+class OfflineRecognizerBackend(RecognizerBackend):
+    """Recognizes speech locally with one of speech_recognition's offline engines.
+
+    `engine` names a recognize_<engine> method, e.g. "sphinx" (pocketsphinx),
+    "vosk" or "whisper"; the engine's own package must be installed.
+    """
+
+    name = "offline"
+
+    def __init__(self, engine: str = OFFLINE_RECOGNIZER_ENGINE):
+        super().__init__()
+        self.engine = engine
+        self.recognizer = sr.Recognizer()
+        self.method = getattr(self.recognizer, f"recognize_{engine}", None)
+        if self.method is None:
+            raise ValueError(f"Unknown offline recognition engine: {engine}")
+
+    def _recognize(self, audio: sr.AudioData) -> str:
+        text = self.method(audio)
+        if self.engine == "vosk":
+            text = json.loads(text).get("text", "")
+        if not text or not text.strip():
+            raise sr.UnknownValueError()
+        return text.strip()
+
+
+class BufferedRecognitionStream:
+    """Collects an utterance for a backend without partial results and recognizes it in finish()."""
+
+    def __init__(self, backend: RecognizerBackend, samplerate: int):
+        self.backend = backend
+        self.samplerate = samplerate
+        self.blocks = []
+
+    def feed(self, samples: np.ndarray) -> Optional[str]:
+        self.blocks.append(np.clip(samples, -32768, 32767).astype(np.int16))
+        return None
+
+    def finish(self) -> str:
+        samples = np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=np.int16)
+        return self.backend.recognize(sr.AudioData(samples.tobytes(), self.samplerate, 2))
+
+
+class VoskRecognitionStream:
+    """One utterance streamed into a Vosk recognizer."""
+
+    def __init__(self, model, samplerate: int):
+        self.recognizer = vosk.KaldiRecognizer(model, samplerate)
+        self.results = []
+
+    def feed(self, samples: np.ndarray) -> Optional[str]:
+        data = np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+        if self.recognizer.AcceptWaveform(data):
+            text = json.loads(self.recognizer.Result()).get("text", "")
+            if text:
+                self.results.append(text)
+            partial = ""
+        else:
+            partial = json.loads(self.recognizer.PartialResult()).get("partial", "")
+        return " ".join(self.results + [partial]).strip() or None
+
+    def finish(self) -> str:
+        text = " ".join(self.results + [json.loads(self.recognizer.FinalResult()).get("text", "")]).strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+class VoskRecognizerBackend(RecognizerBackend):
+    """Recognizes speech locally with Vosk, streaming partial hypotheses.
+
+    VISERYS_VOSK_MODEL points at an unpacked Vosk model directory.
+    """
+
+    name = "vosk"
+    streaming = True
+
+    def __init__(self, model_path: str = VOSK_MODEL_PATH):
+        super().__init__()
+        vosk.SetLogLevel(-1)
+        self.model = vosk.Model(model_path)
+
+    def start_stream(self, samplerate: int) -> VoskRecognitionStream:
+        return VoskRecognitionStream(self.model, samplerate)
+
+    def _recognize(self, audio: sr.AudioData) -> str:
+        stream = self.start_stream(audio.sample_rate)
+        stream.feed(np.frombuffer(audio.get_raw_data(convert_width=2), dtype=np.int16))
+        return stream.finish()
+
+
+def audio_from_wav(path: str) -> sr.AudioData:
+    """Loads a 16-bit WAV file as sr.AudioData."""
+    with wave.open(path, "rb") as wav:
+        return sr.AudioData(wav.readframes(wav.getnframes()), wav.getframerate(), wav.getsampwidth())
+
+
+class StubRecognizerBackend(RecognizerBackend):
+    """Deterministic recognizer for tests that maps known audio to fixed text.
+
+    `fixtures` maps WAV paths to transcripts; audio is matched by a hash of
+    its raw PCM bytes. Unknown audio returns the next transcript queued with
+    expect(), then `default`, or raises sr.UnknownValueError when neither is
+    available.
+    """
+
+    name = "stub"
+    streaming = True
+
+    def __init__(self, fixtures: Optional[dict] = None, default: Optional[str] = None):
+        super().__init__()
+        self.transcripts = {}
+        self.expected = deque()
+        self.default = default
+        for path, text in (fixtures or {}).items():
+            self.add(audio_from_wav(path), text)
+
+    @staticmethod
+    def fingerprint(audio: sr.AudioData) -> str:
+        return hashlib.sha1(audio.get_raw_data()).hexdigest()
+
+    def add(self, audio: sr.AudioData, text: str) -> None:
+        """Registers the transcript for a piece of audio."""
+        self.transcripts[self.fingerprint(audio)] = text
+
+    def expect(self, text: str) -> None:
+        """Queues the transcript for the next piece of unknown audio."""
+        self.expected.append(text)
+
+    def _recognize(self, audio: sr.AudioData) -> str:
+        text = self.transcripts.get(self.fingerprint(audio))
+        if text is None:
+            text = self.expected.popleft() if self.expected else self.default
+        if text is None:
+            raise sr.UnknownValueError()
+        return text
+
+    def start_stream(self, samplerate: int) -> "StubRecognitionStream":
+        """Streams the next expected transcript (or `default`) as partial hypotheses."""
+        text = self.expected.popleft() if self.expected else self.default
+        return StubRecognitionStream(text, samplerate)
+
+
+class StubRecognitionStream:
+    """Reveals a transcript as speech arrives, like a streaming engine would.
+
+    Once speech starts, the partial hypothesis grows at `chars_per_second`
+    after a fixed recognizer `lag`, so a prefix such as "what is the ti"
+    shows up while the speaker is still talking.
+    """
+
+    def __init__(self, text: Optional[str], samplerate: int,
+                 chars_per_second: float = STUB_STREAM_CHARS_PER_SECOND, lag: float = STUB_STREAM_LAG):
+        self.text = text
+        self.samplerate = samplerate
+        self.chars_per_second = chars_per_second
+        self.lag = lag
+        self.frame = int(samplerate * VAD_FRAME_MS / 1000)
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.heard = None
+
+    def feed(self, samples: np.ndarray) -> Optional[str]:
+        if not self.text:
+            return None
+        if self.heard is None:
+            self.pending = np.concatenate([self.pending, samples])
+            usable = len(self.pending) // self.frame * self.frame
+            voiced = np.flatnonzero(vad_frames(self.pending[:usable].reshape(-1, self.frame))) if usable else []
+            if not len(voiced):
+                self.pending = self.pending[usable:]
+                return None
+            self.heard = len(self.pending) - voiced[0] * self.frame
+            self.pending = None
+        else:
+            self.heard += len(samples)
+        chars = int((self.heard / self.samplerate - self.lag) * self.chars_per_second)
+        return self.text[:max(chars, 0)].strip() or None
+
+    def finish(self) -> str:
+        if not self.text:
+            raise sr.UnknownValueError()
+        return self.text
+
+
+def audio_fingerprint(audio: sr.AudioData) -> Optional[tuple]:
+    """Returns (features, voiced_seconds) for an utterance, or None if it is silent.
+
+    The features are MFCCs of the voiced part with the per-utterance mean
+    removed, which cancels the microphone and room response, averaged over
+    FINGERPRINT_POOL frames. Only energies more than FINGERPRINT_DYNAMIC_RANGE
+    nats (about 43 dB) below the loudest are floored, where background noise
+    would otherwise decide their value. They keep their time axis so lookups can align
+    two utterances instead of comparing fixed slices.
+    """
+    samples = audio_samples(audio).astype(np.float32)
+    frame = int(WAKE_WORD_SAMPLERATE * VAD_FRAME_MS / 1000)
+    usable = len(samples) // frame * frame
+    if not usable:
+        return None
+    voiced = np.flatnonzero(vad_frames(samples[:usable].reshape(-1, frame)))
+    if not len(voiced):
+        return None
+    speech = samples[voiced[0] * frame:(voiced[-1] + 1) * frame]
+    features = mfcc(speech, dynamic_range=FINGERPRINT_DYNAMIC_RANGE)
+    features -= features.mean(axis=0)
+    pooled = len(features) // FINGERPRINT_POOL
+    if pooled < RECOGNITION_CACHE_WINDOW:
+        return None
+    features = features[:pooled * FINGERPRINT_POOL].reshape(pooled, FINGERPRINT_POOL, -1).mean(axis=1)
+    return features.astype(np.float32), len(speech) / WAKE_WORD_SAMPLERATE
+
+
+def alignment_costs(reference: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Returns the per-frame costs along the best DTW path from `reference` to `query`.
+
+    Both ends are pinned. Each reference frame advances the query by 0, 1 or
+    2 frames, so the path has one cost per reference frame; it is all
+    infinite when the query is more than twice as long.
+    """
+    cost = np.sqrt(((reference[:, None, :] - query[None, :, :]) ** 2).sum(axis=2))
+    moves = np.zeros(cost.shape, dtype=np.int8)
+    acc = np.full(cost.shape[1], np.inf)
+    acc[0] = cost[0, 0]
+    for i in range(1, len(reference)):
+        steps = np.full((3, len(acc)), np.inf)
+        steps[0] = acc
+        steps[1, 1:] = acc[:-1]
+        steps[2, 2:] = acc[:-2]
+        moves[i] = steps.argmin(axis=0)
+        acc = cost[i] + steps[moves[i], np.arange(len(acc))]
+    if not np.isfinite(acc[-1]):
+        return np.full(len(reference), np.inf)
+    path = np.empty(len(reference))
+    j = cost.shape[1] - 1
+    for i in range(len(reference) - 1, -1, -1):
+        path[i] = cost[i, j]
+        j -= moves[i, j]
+    return path
+
+
+def utterance_distance(a: np.ndarray, b: np.ndarray, window: int = RECOGNITION_CACHE_WINDOW,
+                       limit: float = np.inf) -> float:
+    """Returns the worst mean alignment cost over any `window` frames, in either direction.
+
+    Averaging over the whole utterance would let one differing word ("time"
+    against "date") disappear into the matching rest, so the score is the
+    cost of the worst-aligned stretch instead. Returns early once a
+    direction exceeds `limit`.
+    """
+    worst = 0.0
+    for reference, query in ((a, b), (b, a)):
+        path = alignment_costs(reference, query)
+        size = min(window, len(path))
+        worst = max(worst, float(np.convolve(path, np.ones(size) / size, "valid").max()))
+        if worst > limit:
+            break
+    return worst
+
+
+class RecognitionCache:
+    """Bounded LRU cache from utterance features to recognized text.
+
+    A lookup returns the stored utterance with the smallest
+    utterance_distance() if it is at most `max_distance` and the voiced
+    durations are within 25%.
+    """
+
+    def __init__(self, max_entries: int = RECOGNITION_CACHE_SIZE,
+                 max_distance: float = RECOGNITION_CACHE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, features: np.ndarray, duration: float) -> Optional[tuple]:
+        """Returns (text, distance) for the best match, or None."""
+        best = None
+        best_distance = self.max_distance
+        with self.lock:
+            for key, (stored, stored_duration, text) in self.entries.items():
+                if abs(stored_duration - duration) > 0.25 * max(stored_duration, duration):
+                    continue
+                distance = utterance_distance(stored, features, limit=best_distance)
+                if distance <= best_distance:
+                    best, best_distance = key, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best)
+            return self.entries[best][2], best_distance
+
+    def store(self, features: np.ndarray, duration: float, text: str) -> None:
+        with self.lock:
+            self.entries[self.next_key] = (features, duration, text)
+            self.next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class CachingRecognizerBackend(RecognizerBackend):
+    """Wraps another backend and answers repeated utterances from a RecognitionCache.
+
+    Fingerprints only match approximately, so transcripts containing an
+    exclusive command (shutdown, restart, renaming, ...) are never stored:
+    a false hit must not be able to run one of those.
+    """
+
+    def __init__(self, inner: RecognizerBackend, cache: Optional[RecognitionCache] = None):
+        super().__init__()
+        self.inner = inner
+        self.cache = cache or RecognitionCache()
+        self.name = f"{inner.name}+cache"
+        self.last_hit = False
+
+    def _recognize(self, audio: sr.AudioData) -> str:
+        fingerprint = audio_fingerprint(audio)
+        if fingerprint is not None:
+            hit = self.cache.lookup(*fingerprint)
+            if hit is not None:
+                self.last_hit = True
+                return hit[0]
+        self.last_hit = False
+        text = self.inner.recognize(audio)
+        if fingerprint is not None and self.cacheable(text):
+            self.cache.store(fingerprint[0], fingerprint[1], text)
+        return text
+
+    @staticmethod
+    def cacheable(text: str) -> bool:
+        """Returns False when any command in `text` is exclusive."""
+        return not has_exclusive_command(text)
+
+    @property
+    def streaming(self) -> bool:
+        return self.inner.streaming
+
+    def start_stream(self, samplerate: int):
+        return self.inner.start_stream(samplerate)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "cache": self.cache.stats()}
+
+
+RECOGNIZER_BACKENDS = {
+    "google": GoogleRecognizerBackend,
+    "offline": OfflineRecognizerBackend,
+    "stub": StubRecognizerBackend,
+    "vosk": VoskRecognizerBackend,
+}
+_recognizer_backend = None
+
+
+def get_recognizer_backend() -> RecognizerBackend:
+    """Returns the configured recognizer backend, creating it on first use."""
+    global _recognizer_backend
+    if _recognizer_backend is None:
+        backend_cls = RECOGNIZER_BACKENDS.get(RECOGNIZER_BACKEND)
+        if backend_cls is None:
+            print(f"Unknown recognizer backend {RECOGNIZER_BACKEND!r}, using google.")
+            backend_cls = GoogleRecognizerBackend
+        try:
+            _recognizer_backend = backend_cls()
+        except Exception as e:
+            if backend_cls is GoogleRecognizerBackend:
+                raise
+            print(f"Could not start the {RECOGNIZER_BACKEND} recognizer ({e}), using google.")
+            _recognizer_backend = GoogleRecognizerBackend()
+        if RECOGNITION_CACHE:
+            _recognizer_backend = CachingRecognizerBackend(_recognizer_backend)
+    return _recognizer_backend
+
+
+def set_recognizer_backend(backend: RecognizerBackend) -> None:
+    """Replaces the recognizer backend used by takecommand()."""
+    global _recognizer_backend
+    _recognizer_backend = backend
+
+
+def recognize_audio(audio: sr.AudioData) -> str:
+    """Recognizes audio with the configured backend and logs the latency."""
+    backend = get_recognizer_backend()
+    query = backend.recognize(audio)
+    print(f"Heard: {query} ({backend.name}, {backend.last_latency * 1000:.0f} ms)")
+    return query
+
+
+class MicrophoneSession:
+    """Keeps one microphone open and calibrated across commands.
+
+    A capture thread listens continuously and queues each phrase, so speech
+    that starts before takecommand() asks for it is not lost. Ambient noise
+    calibration runs once on open and again only when the dynamic energy
+    threshold drifts or listening keeps timing out. Phrases overlapping our
+    own speech output are dropped so the assistant does not hear itself.
+    """
+
+    def __init__(self, device_index: Optional[int] = None, microphone_factory=None):
+        self.device_index = device_index
+        self.recognizer = sr.Recognizer()
+        self.recognizer.dynamic_energy_threshold = True
+        self.recognizer.energy_threshold = 300
+        self.recognizer.pause_threshold = 1
+        self.microphone = (microphone_factory or sr.Microphone)(device_index=device_index)
+        self.source = None
+        self.phrases = queue.Queue(maxsize=MIC_QUEUE_SIZE)
+        self.calibrated_threshold = None
+        self.needs_calibration = True
+        self.missed_listens = 0
+        self.listen_started = None
+        self.running = threading.Event()
+        self.worker = None
+        self.error = None
+
+    def open(self) -> None:
+        """Opens the device and starts the capture thread if not already running."""
+        if self.worker is not None:
+            return
+        self.source = self.microphone.__enter__()
+        self.calibrate()
+        self.running.set()
+        self.worker = threading.Thread(target=self._capture_loop, name="microphone", daemon=True)
+        self.worker.start()
+
+    def close(self) -> None:
+        """Stops the capture thread and releases the device."""
+        self.running.clear()
+        if self.worker is not None:
+            self.worker.join(timeout=MIC_PHRASE_TIME_LIMIT)
+            self.worker = None
+        if self.source is not None:
+            try:
+                self.microphone.__exit__(None, None, None)
+            except Exception:
+                pass
+            self.source = None
+
+    def calibrate(self) -> None:
+        """Measures ambient noise and remembers the resulting energy threshold."""
+        try:
+            with TRACER.span("calibration"):
+                self.recognizer.adjust_for_ambient_noise(self.source, duration=MIC_CALIBRATION_SECONDS)
+        except Exception:
+            pass
+        self.calibrated_threshold = self.recognizer.energy_threshold
+        self.needs_calibration = False
+        self.missed_listens = 0
+
+    def drifted(self) -> bool:
+        """Returns True when the dynamic threshold has moved far from the calibrated one."""
+        if self.calibrated_threshold is None:
+            return True
+        ratio = self.recognizer.energy_threshold / max(self.calibrated_threshold, 1)
+        return ratio > MIC_DRIFT_RATIO or ratio < 1 / MIC_DRIFT_RATIO
+
+    def phrase_in_progress(self) -> bool:
+        """Returns True while the capture thread is recording a phrase.
+
+        The capture thread listens with a 1 second start timeout, so a listen
+        call that has run for longer than that has heard a phrase start.
+        """
+        started = self.listen_started
+        return started is not None and monotonic() - started > 1.2
+
+    def _capture_loop(self) -> None:
+        while self.running.is_set():
+            if (self.needs_calibration or self.drifted()) and not SPEECH_ACTIVE.is_set():
+                self.calibrate()
+            serial = SPEECH_SERIAL
+            self.listen_started = monotonic()
+            try:
+                audio = self.recognizer.listen(self.source, timeout=1, phrase_time_limit=MIC_PHRASE_TIME_LIMIT)
+            except sr.WaitTimeoutError:
+                continue
+            except Exception as e:
+                self.error = e
+                self.running.clear()
+                print(f"Microphone error: {e}")
+                break
+            finally:
+                self.listen_started = None
+            if (SPEECH_ACTIVE.is_set() or serial != SPEECH_SERIAL) and not SPEECH_BARGE_IN:
+                continue
+            if self.phrases.full():
+                try:
+                    self.phrases.get_nowait()
+                except queue.Empty:
+                    pass
+            self.phrases.put((monotonic(), audio))
+
+    def unread(self, audio: sr.AudioData, captured_at: Optional[float] = None) -> None:
+        """Puts a phrase back at the front of the queue for the next listen()."""
+        with self.phrases.mutex:
+            self.phrases.queue.appendleft((captured_at or monotonic(), audio))
+            self.phrases.unfinished_tasks += 1
+            self.phrases.not_empty.notify()
+
+    def listen(self, timeout: float, count_timeout: bool = False) -> sr.AudioData:
+        """Returns the next phrase, raising sr.WaitTimeoutError if none starts in time.
+
+        With `count_timeout`, the timeout counts towards recalibration. Only
+        prompts that expect an answer set it; idle polls for the wake word or
+        the pipeline time out all the time in a quiet room.
+        """
+        self.open()
+        deadline = monotonic() + timeout
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0 and self.phrase_in_progress():
+                remaining = 0.1
+            try:
+                captured_at, audio = self.phrases.get(timeout=max(remaining, 0.01))
+            except queue.Empty:
+                if not self.running.is_set():
+                    raise self.error or OSError("microphone session is closed")
+                if monotonic() < deadline or self.phrase_in_progress():
+                    continue
+                if count_timeout:
+                    self.missed_listens += 1
+                    if self.missed_listens >= MIC_RECALIBRATE_AFTER_TIMEOUTS:
+                        self.needs_calibration = True
+                raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+            if monotonic() - captured_at <= MIC_PHRASE_MAX_AGE:
+                self.missed_listens = 0
+                return audio
+
+
+class ScriptedMicrophone:
+    """Stand-in for sr.Microphone that plays queued utterances into a MicrophoneSession.
+
+    Between utterances the stream returns quiet noise at real-time pace, so
+    the session's capture thread idles as it would on a real device. With a
+    `gate` Event, a queued utterance is only released once the gate is set
+    (the benchmark uses DIALOG_ACTIVE, i.e. once takecommand() is listening).
+    """
+
+    SAMPLE_RATE = 16000
+    SAMPLE_WIDTH = 2
+    CHUNK = 1024
+
+    def __init__(self, device_index: Optional[int] = None, noise_level: float = 30.0, gate=None, seed: int = 0):
+        self.noise_level = noise_level
+        self.gate = gate
+        self.rng = np.random.default_rng(seed)
+        self.pending = queue.Queue()
+        self.buffer = b""
+        self.stream = None
+
+    def queue_audio(self, samples: np.ndarray) -> None:
+        """Queues int16-scaled samples at SAMPLE_RATE to be heard once."""
+        speech = np.asarray(samples, dtype=np.float32)
+        tail = np.zeros(int(1.5 * self.SAMPLE_RATE), dtype=np.float32)
+        self.pending.put(np.concatenate([speech, tail]))
+
+    def _noise(self, samples: np.ndarray) -> bytes:
+        noisy = samples + self.rng.normal(0.0, self.noise_level, len(samples))
+        return np.clip(noisy, -32768, 32767).astype(np.int16).tobytes()
+
+    def read(self, frames: int) -> bytes:
+        if not self.buffer:
+            seconds = frames / self.SAMPLE_RATE
+            samples = None
+            if self.gate is None or self.gate.wait(seconds):
+                try:
+                    samples = self.pending.get(timeout=seconds)
+                except queue.Empty:
+                    pass
+            self.buffer = self._noise(samples if samples is not None else np.zeros(frames, dtype=np.float32))
+        chunk, self.buffer = self.buffer[:frames * self.SAMPLE_WIDTH], self.buffer[frames * self.SAMPLE_WIDTH:]
+        return chunk
+
+    def __enter__(self):
+        # sr.Recognizer only accepts sr.AudioSource instances, whose constructor is abstract.
+        source = object.__new__(sr.AudioSource)
+        source.stream = self
+        source.SAMPLE_RATE, source.SAMPLE_WIDTH, source.CHUNK = self.SAMPLE_RATE, self.SAMPLE_WIDTH, self.CHUNK
+        return source
+
+    def __exit__(self, *exc):
+        pass
+
+
+_microphone_session = None
+
+
+def get_microphone_session() -> MicrophoneSession:
+    """Returns the shared microphone session for SELECTED_DEVICE_INDEX."""
+    global _microphone_session
+    if _microphone_session is None:
+        _microphone_session = MicrophoneSession(device_index=SELECTED_DEVICE_INDEX)
+    return _microphone_session
+
+
+def close_microphone_session() -> None:
+    """Closes the shared microphone session; the next command reopens it."""
+    global _microphone_session
+    if _microphone_session is not None:
+        _microphone_session.close()
+        _microphone_session = None
+
+
+def use_input_device(device_index: Optional[int]) -> None:
+    """Switches voice input to another device and reopens the microphone."""
+    global SELECTED_DEVICE_INDEX
+    SELECTED_DEVICE_INDEX = device_index
+    close_microphone_session()
+
+
+def takecommand(prompt: Optional[str] = None, timeout: int = 6) -> Optional[str]:
+    """Takes microphone input from the user and returns it as lowercase text.
+
+    If `prompt` is provided, it will be spoken before listening.
+    """
+    if prompt:
+        speak(prompt)
+    if VOICE_INPUT_AVAILABLE:
+        audio = None
+        try:
+            session = get_microphone_session()
+            session.open()
+            speak("Listening now.")
+            flush_speech()
+            if mark_startup("first listening") and STARTUP_REPORT:
+                print(startup_report())
+            try:
+                with DIALOG_ACTIVE.hold(), TRACER.span("capture"):
+                    audio = session.listen(timeout, count_timeout=True)
+            except sr.WaitTimeoutError:
+                speak("Timeout occurred. Please try again.")
+                return None
+
+        except Exception as e:
+            print(f"Microphone error: {e}")
+            close_microphone_session()
+            audio = None
+
+        if audio:
+            try:
+                speak("Recognizing.")
+                query = recognize_audio(audio)
+                return query.lower()
+            except sr.UnknownValueError:
+                speak("Sorry, I did not understand that.")
+                return None
+            except sr.RequestError:
+                speak("Speech recognition service is unavailable.")
+                return None
+            except Exception as e:
+                speak(f"An error occurred while recognizing speech: {e}")
+                print(f"Error: {e}")
+
+    if SD_AVAILABLE:
+        try:
+            devices = list_input_devices()
+            if not devices:
+                speak("No input audio devices detected. Please connect a microphone and ensure it's enabled in Windows settings.")
+            else:
+                dev_index, dev_name, samplerate = pick_input_device(devices)
+
+                try:
+                    if SD_STREAMING_CAPTURE:
+                        speak(f"Listening on {dev_name}.")
+                        flush_speech()
+                        if mark_startup("first listening") and STARTUP_REPORT:
+                            print(startup_report())
+                        with TRACER.span("capture"):
+                            audio_data = capture_utterance(samplerate, timeout=timeout, device=dev_index)
+                        if audio_data is None:
+                            speak("Timeout occurred. Please try again.")
+                            return None
+                    else:
+                        duration = max(DEFAULT_RECORD_SECONDS, timeout)
+                        speak(f"Recording from {dev_name} for {duration} seconds.")
+                        flush_speech()
+                        with TRACER.span("capture"):
+                            recording = sd.rec(int(duration * samplerate), samplerate=samplerate, channels=1, dtype='int16', device=dev_index)
+                            sd.wait()
+                        audio_data = prepare_audio(recording.astype(np.float32).reshape(-1), samplerate)
+
+                    speak("Recognizing.")
+                    query = recognize_audio(audio_data)
+                    return query.lower()
+                except Exception as e:
+                    print(f"sounddevice capture failed: {e}")
+                    speak("I couldn't capture audio with sounddevice. Please check microphone permissions, select the correct input device, or try restarting the program.")
+        except Exception as e:
+            print(f"sounddevice recording failed: {e}")
+
+    speak("Voice input is not available. Please type your response.")
+    try:
+        flush_speech()
+        with TRACER.span("capture", source="keyboard"):
+            typed = input((prompt + "\n> ") if prompt else "> ")
+        return typed.lower().strip() if typed else None
+    except Exception:
+        return None
+
+def open_notepad() -> None:
+    """Opens Windows Notepad."""
+    try:
+        os.system("notepad")
+        speak("Opening Notepad")
+    except Exception as e:
+        speak("Sorry, I couldn't open Notepad")
+        print(f"Error: {e}")
+
+APP_INDEX_FILE = "app_index.json"
+APP_INDEX_VERSION = 1
+APP_EXTENSIONS = ('.exe',)
+
+
+def app_search_locations() -> list:
+    """Returns the directories that are searched for installed applications."""
+    return [
+        os.path.expandvars(r"%ProgramFiles%"),
+        os.path.expandvars(r"%ProgramFiles(x86)%"),
+        os.path.expandvars(r"%LocalAppData%"),
+        os.path.expandvars(r"%AppData%"),
+        r"C:\Windows\System32",
+        os.path.expandvars(r"%LocalAppData%\WhatsApp"),
+        os.path.expandvars(r"%LocalAppData%\Microsoft\WindowsApps"),
+        os.path.expandvars(r"%LocalAppData%\Programs")
+    ]
+
+
+def load_app_index() -> dict:
+    """Loads the cached app index from disk, or returns an empty index.
+
+    The index maps each scanned directory to [mtime, subdirectories, executables].
+    """
+    try:
+        with open(APP_INDEX_FILE, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if data.get("version") == APP_INDEX_VERSION:
+            return data.get("dirs", {})
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {}
+
+
+def save_app_index(index: dict) -> None:
+    """Writes the app index to disk atomically in a compact form."""
+    tmp_path = APP_INDEX_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"version": APP_INDEX_VERSION, "dirs": index}, file, separators=(',', ':'))
+        os.replace(tmp_path, APP_INDEX_FILE)
+    except OSError as e:
+        print(f"Could not save app index: {e}")
+
+
+CRAWL_WORKERS = 8
+CRAWL_PRUNE = frozenset({
+    ".git", ".svn", "__pycache__", "node_modules", "winsxs", "$recycle.bin",
+    "cache", "caches", "code cache", "gpucache", "temp", "tmp", "crashpad", "crashdumps",
+})
+APP_CRAWL_DEPTH = 6
+
+
+def _list_dir(path: str, extensions: tuple, cached: Optional[list], scandir=None) -> Optional[list]:
+    """Returns [mtime, subdirectories, matching files] for one directory, or None if unreadable.
+
+    A cached entry with the same mtime is reused without listing the directory.
+    The listing uses `scandir` (default os.scandir).
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    if cached and cached[0] == mtime:
+        return cached
+    subdirs, files = [], []
+    try:
+        with (scandir or os.scandir)(path) as it:
+            for item in it:
+                try:
+                    if item.is_dir(follow_symlinks=False):
+                        subdirs.append(item.name)
+                    elif item.name.lower().endswith(extensions):
+                        files.append(item.name)
+                except OSError:
+                    pass
+    except OSError:
+        return None
+    return [mtime, subdirs, files]
+
+
+def _crawl_inline(roots: list, extensions: tuple, cached: dict, prune, max_depth: Optional[int], scandir=None):
+    seen = set()
+    for root_index, root in enumerate(roots):
+        if not os.path.isdir(root):
+            continue
+        stack = [(root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            if path in seen:
+                continue
+            seen.add(path)
+            entry = _list_dir(path, extensions, cached.get(path), scandir)
+            if entry is None:
+                continue
+            if max_depth is None or depth < max_depth:
+                stack.extend((os.path.join(path, name), depth + 1) for name in reversed(entry[1])
+                             if name.lower() not in prune)
+            yield root_index, path, entry
+
+
+def crawl(roots: list, extensions: tuple, cached: Optional[dict] = None, prune=CRAWL_PRUNE,
+          max_depth: Optional[int] = None, workers: int = CRAWL_WORKERS, scandir=None):
+    """Walks directory trees on a thread pool, yielding (root_index, path, [mtime, subdirs, files]).
+
+    Directories are listed with os.scandir(), using the DirEntry type
+    information instead of a stat per file, and every directory found is
+    handed to the pool as soon as its parent is listed. Subdirectories whose
+    lowercased name is in `prune` are not entered, nor is anything deeper
+    than `max_depth` below a root. Entries of `cached` (path -> the same
+    list) are reused for directories whose mtime has not changed. Results
+    stream out in completion order; each directory is visited once even
+    when roots overlap. With a single worker the walk runs inline.
+    `scandir` replaces os.scandir() for the listings.
+    """
+    cached = cached or {}
+    if workers <= 1:
+        yield from _crawl_inline(roots, extensions, cached, prune, max_depth, scandir)
+        return
+    seen = set()
+    pending = {}
+    finished = queue.Queue()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crawl")
+
+    def submit(root_index, path, depth):
+        if path in seen:
+            return
+        seen.add(path)
+        future = executor.submit(_list_dir, path, extensions, cached.get(path), scandir)
+        pending[future] = (root_index, path, depth)
+        future.add_done_callback(finished.put)
+
+    try:
+        for root_index, root in enumerate(roots):
+            if os.path.isdir(root):
+                submit(root_index, root, 0)
+        while pending:
+            future = finished.get()
+            root_index, path, depth = pending.pop(future)
+            entry = future.result()
+            if entry is None:
+                continue
+            if max_depth is None or depth < max_depth:
+                for name in entry[1]:
+                    if name.lower() not in prune:
+                        submit(root_index, os.path.join(path, name), depth + 1)
+            yield root_index, path, entry
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def refresh_dir_index(cached: dict, locations: list, extensions: tuple, max_depth: Optional[int] = None,
+                      scandir=None) -> dict:
+    """Revalidates a directory index, only listing directories whose mtime changed.
+
+    The index maps each directory to [mtime, subdirectories, matching files].
+    Unchanged directories reuse their cached entries, so a warm refresh costs
+    one stat() per directory instead of a full listing. The walk runs on
+    crawl()'s thread pool; the result is ordered by location, then path, so
+    it does not depend on which directory finished listing first.
+    """
+    found = sorted(crawl(locations, extensions, cached, max_depth=max_depth, scandir=scandir),
+                   key=lambda item: (item[0], item[1]))
+    return {path: entry for _, path, entry in found}
+
+
+def make_directory_tree(root: str, depth: int = 4, fanout: int = 5, files_per_dir: int = 20) -> tuple:
+    """Fills `root` with a synthetic tree of nested folders and files. Returns (folders, files)."""
+    extensions = (".exe", ".dll", ".txt", ".json")
+    count = 1
+    files = 0
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for folder in level:
+            for n in range(files_per_dir):
+                open(os.path.join(folder, f"file{n}{extensions[n % len(extensions)]}"), "w").close()
+            files += files_per_dir
+            for n in range(fanout):
+                child = os.path.join(folder, f"dir{n}")
+                os.mkdir(child)
+                next_level.append(child)
+        count += len(next_level)
+        level = next_level
+    return count, files
+
+
+def _slow_scandir(seconds: float):
+    """Returns an os.scandir() that waits `seconds` first, standing in for a cold disk or a network share."""
+    if not seconds:
+        return os.scandir
+
+    def slow_scandir(path="."):
+        sleep(seconds)
+        return os.scandir(path)
+
+    return slow_scandir
+
+
+def benchmark_crawler(depth: int = 4, fanout: int = 6, files_per_dir: int = 30, workers: tuple = (1, 4, 8),
+                      latency: float = 0.0, repeat: int = 3) -> dict:
+    """Compares the old os.walk() scan with crawl() on a synthetic tree, best of `repeat` runs.
+
+    The tree is freshly written and sits in the OS cache, so by default the
+    numbers show CPU cost only; `latency` adds a delay to each directory
+    listing to show how the thread pool hides I/O waits.
+    """
+    def best(fn):
+        times = []
+        for _ in range(repeat):
+            started = perf_counter()
+            fn()
+            times.append(perf_counter() - started)
+        return min(times)
+
+    with tempfile.TemporaryDirectory() as root:
+        dirs, files = make_directory_tree(root, depth, fanout, files_per_dir)
+
+        scandir = _slow_scandir(latency)
+
+        def walk_scan():
+            apps = {}
+            for dirpath, _, files in os.walk(root):
+                if latency:
+                    sleep(latency)
+                for file in files:
+                    if any(file.lower().endswith(ext) for ext in APP_EXTENSIONS):
+                        apps[os.path.splitext(file)[0].lower()] = os.path.join(dirpath, file)
+            return apps
+
+        results = {"dirs": dirs, "files": files, "latency": latency}
+        results["os_walk"] = best(walk_scan)
+        for n in workers:
+            results[f"crawl_{n}_workers"] = best(lambda: list(crawl([root], APP_EXTENSIONS, prune=(), workers=n,
+                                                                     scandir=scandir)))
+        index = refresh_dir_index({}, [root], APP_EXTENSIONS, scandir=scandir)
+        results["warm_refresh"] = best(lambda: refresh_dir_index(index, [root], APP_EXTENSIONS, scandir=scandir))
+    return results
+
+
+def refresh_app_index(cached: dict, locations: Optional[list] = None) -> dict:
+    """Revalidates the app index against the app search locations."""
+    if locations is None:
+        locations = app_search_locations()
+    return refresh_dir_index(cached, locations, APP_EXTENSIONS, max_depth=APP_CRAWL_DEPTH)
+
+
+class AppPaths(Mapping):
+    """Read-only app name -> executable path mapping that stores paths compactly.
+
+    Each folder path is interned and kept once; an app only refers to its
+    folder by number and the full path is joined on lookup. Every app in a
+    folder shares that folder's number and file tuple, so thousands of
+    executables under a few install roots cost little more than their names.
+    When two folders have an app with the same name, the later folder wins.
+    """
+
+    def __init__(self, index: Optional[dict] = None):
+        self.dirs = []
+        self.files = []
+        self.apps = {}
+        for root, (_, _, files) in (index or {}).items():
+            if not files:
+                continue
+            dir_id = len(self.dirs)
+            self.dirs.append(sys.intern(root))
+            self.files.append(tuple(files))
+            for file in files:
+                self.apps[sys.intern(os.path.splitext(file)[0].lower())] = dir_id
+
+    def __getitem__(self, name: str) -> str:
+        dir_id = self.apps[name]
+        for file in reversed(self.files[dir_id]):
+            if os.path.splitext(file)[0].lower() == name:
+                return os.path.join(self.dirs[dir_id], file)
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.apps)
+
+    def __len__(self) -> int:
+        return len(self.apps)
+
+
+def apps_from_index(index: dict) -> AppPaths:
+    """Builds the app name -> executable path mapping from an app index."""
+    return AppPaths(index)
+
+
+def scan_installed_apps() -> AppPaths:
+    """Scans common directories for installed applications, reusing the on-disk index."""
+    index = refresh_app_index(load_app_index())
+    save_app_index(index)
+    return apps_from_index(index)
+
+
+APP_INDEX_READY = threading.Event()
+INSTALLED_APPS = AppPaths()
+_app_index_started = False
+_app_index_lock = threading.Lock()
+
+
+def _refresh_installed_apps() -> None:
+    """Background worker that revalidates the app index and swaps in the result."""
+    global INSTALLED_APPS
+    try:
+        apps = scan_installed_apps()
+        get_app_matcher(apps)
+        INSTALLED_APPS = apps
+    except Exception as e:
+        print(f"App index refresh failed: {e}")
+    finally:
+        APP_INDEX_READY.set()
+
+
+def start_app_index_refresh() -> threading.Thread:
+    """Starts revalidating the app index on a background thread."""
+    worker = threading.Thread(target=_refresh_installed_apps, name="app-index", daemon=True)
+    worker.start()
+    return worker
+
+
+def ensure_app_index() -> None:
+    """Loads the cached app index and starts its background refresh, once."""
+    global INSTALLED_APPS, _app_index_started
+    with _app_index_lock:
+        if _app_index_started:
+            return
+        _app_index_started = True
+        with startup_timer("load app index"):
+            INSTALLED_APPS = apps_from_index(load_app_index())
+        if INSTALLED_APPS:
+            APP_INDEX_READY.set()
+        start_app_index_refresh()
+
+
+def normalize_name(name: str) -> str:
+    """Normalizes an application or track name for matching."""
+    return ''.join(ch for ch in name.lower() if ch.isalnum())
+
+
+def name_trigrams(key: str) -> list:
+    """Returns the boundary-padded character trigrams of a normalized name."""
+    padded = f"^{key}$"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class FuzzyMatcher:
+    """Ranks names (installed apps, music tracks) against a spoken query using a trigram index.
+
+    Names are normalized once at build time; a search only touches the posting
+    lists of the query's trigrams, so it stays fast on very large name lists.
+    `apps` maps each name to the value returned with it, such as a path, or
+    is a list of (name, value) pairs when several values share a name.
+    """
+
+    def __init__(self, apps):
+        self.apps = apps
+        if isinstance(apps, Mapping):
+            self.names, self.values = list(apps), None
+        else:
+            self.names = [name for name, _ in apps]
+            self.values = [value for _, value in apps]
+        self.keys = [normalize_name(name) for name in self.names]
+        self.index = {}
+        for i, key in enumerate(self.keys):
+            for gram in set(name_trigrams(key)):
+                self.index.setdefault(gram, []).append(i)
+
+    def search(self, query: str, limit: int = 8, min_score: float = 0.4) -> list:
+        """Returns up to `limit` (name, path, score) tuples, best match first.
+
+        Scores are the Dice similarity of trigram sets, raised for names that
+        contain the query, and 1.0 for an exact normalized match.
+        """
+        key = normalize_name(query)
+        if not key:
+            return []
+        grams = set(name_trigrams(key))
+        counts = Counter()
+        for gram in grams:
+            postings = self.index.get(gram)
+            if postings:
+                counts.update(postings)
+
+        results = []
+        for i, shared in counts.items():
+            candidate = self.keys[i]
+            if candidate == key:
+                score = 1.0
+            else:
+                score = 2.0 * shared / (len(grams) + len(candidate))
+                if key in candidate:
+                    score = max(score, 0.6 + 0.35 * len(key) / len(candidate))
+            if score >= min_score:
+                results.append((score, i))
+
+        results.sort(key=lambda item: (-item[0], len(self.keys[item[1]])))
+        return [(self.names[i], self.apps[self.names[i]] if self.values is None else self.values[i], round(score, 3))
+                for score, i in results[:limit]]
+
+
+APP_MATCHER = None
+
+
+def get_app_matcher(apps: Optional[dict] = None) -> FuzzyMatcher:
+    """Returns the matcher for the current app list, rebuilding it when the list changes."""
+    global APP_MATCHER
+    if apps is None:
+        apps = INSTALLED_APPS
+    if APP_MATCHER is None or APP_MATCHER.apps is not apps:
+        APP_MATCHER = FuzzyMatcher(apps)
+    return APP_MATCHER
+
+
+def open_app(app_name: str) -> None:
+    """Opens a Windows application by name."""
+    common_apps = {
+        "chrome": "start chrome",
+        "edge": "start msedge",
+        "word": "start winword",
+        "excel": "start excel",
+        "powerpoint": "start powerpnt",
+        "calculator": "calc",
+        "paint": "mspaint",
+        "cmd": "start cmd",
+        "control panel": "control",
+        "task manager": "taskmgr",
+        "explorer": "explorer",
+        "notepad": "notepad",
+        "whatsapp": os.path.expandvars(r"%LocalAppData%\WhatsApp\WhatsApp.exe"),
+    }
+
+    ensure_app_index()
+    if not INSTALLED_APPS:
+        APP_INDEX_READY.wait(timeout=30)
+
+    try:
+        app_name_lower = app_name.lower()
+
+        if app_name_lower in ("whatsapp", "whatsapp desktop", "whatsapp messenger"):
+            matches = [(n, p) for n, p in INSTALLED_APPS.items() if 'whatsapp' in n]
+            if matches:
+                try:
+                    os.startfile(matches[0][1])
+                    speak(f"Opening {matches[0][0]}")
+                    print(f"Opening application: {matches[0][1]}")
+                    return
+                except Exception:
+                    pass
+
+            try:
+                try:
+                    os.startfile("whatsapp://")
+                    speak("Opening WhatsApp")
+                    print("Opening WhatsApp via URI protocol")
+                    return
+                except Exception:
+                    os.system('start "" "whatsapp://"')
+                    speak("Opening WhatsApp")
+                    print("Opening WhatsApp via start command")
+                    return
+            except Exception as e:
+                speak("Couldn't open WhatsApp automatically. Please open it from the Start menu or provide the path.")
+                print(f"WhatsApp open error: {e}")
+                return
+
+        if app_name_lower in common_apps:
+            command = common_apps[app_name_lower]
+            if command.endswith('.exe'):
+                os.startfile(command)
+            else:
+                os.system(command)
+            speak(f"Opening {app_name}")
+            print(f"Opening {app_name}")
+            return
+
+        possible_matches = [(name, path) for name, path, _ in get_app_matcher().search(app_name_lower)]
+        if possible_matches and normalize_name(possible_matches[0][0]) == normalize_name(app_name_lower):
+            possible_matches = possible_matches[:1]
+
+        if len(possible_matches) == 1:
+            app_path = f'"{possible_matches[0][1]}"'
+            os.startfile(possible_matches[0][1])
+            speak(f"Opening {possible_matches[0][0]}")
+            print(f"Opening application: {app_path}")
+
+        elif len(possible_matches) > 1:
+            speak("I found multiple possible matches. Please choose one of the following options.")
+            print("Multiple matches found:")
+            for i, (app, _) in enumerate(possible_matches, 1):
+                print(f"{i}. {app}")
+                speak(f"Option {i}: {app}")
+
+            choice = takecommand("Please say the number or name of the application you want to open.")
+            if choice:
+                digits = ''.join(filter(str.isdigit, choice))
+                if digits:
+                    idx = int(digits) - 1
+                    if 0 <= idx < len(possible_matches):
+                        os.startfile(possible_matches[idx][1])
+                        speak(f"Opening {possible_matches[idx][0]}")
+                        print(f"Opening application: {possible_matches[idx][1]}")
+                        return
+
+                choice_name = choice.replace(' ', '').lower()
+                for app, path in possible_matches:
+                    if choice_name in app.replace(' ', '').lower():
+                        os.startfile(path)
+                        speak(f"Opening {app}")
+                        print(f"Opening application: {path}")
+                        return
+
+            speak("Couldn't understand your choice. Aborting open request.")
+
+        else:
+            command = f"start {app_name_lower}"
+            os.system(command)
+            speak(f"Attempting to open {app_name}")
+            print(f"Executing command: {command}")
+
+    except Exception as e:
+        speak(f"Sorry, I couldn't open {app_name}")
+        print(f"Error: {e}")
+        print("Try using the exact application name or provide more specific keywords.")
+
+TELEMETRY_INTERVAL = 10.0
+TELEMETRY_CAPACITY = 360
+TELEMETRY_FIELDS = ("ram", "disk", "cpu", "battery", "plugged")
+TELEMETRY_NAMES = {"ram": "Memory usage", "disk": "Disk usage", "cpu": "CPU load", "battery": "Battery level"}
+
+
+class TelemetrySampler:
+    """Caches static system facts and samples dynamic metrics into a ring buffer.
+
+    Static facts (OS, CPU model, core counts) are read once. RAM, disk, CPU
+    and battery readings are taken every `interval` seconds on a background
+    thread into fixed-size arrays, so spoken answers read the latest sample
+    and trend questions read the history. Missing readings are stored as NaN,
+    including the CPU load of the first sample, which psutil always reports
+    as 0.0 because it has nothing to compare against yet.
+    """
+
+    def __init__(self, interval: float = TELEMETRY_INTERVAL, capacity: int = TELEMETRY_CAPACITY):
+        self.interval = interval
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0] * capacity)
+        self.values = {field: array('d', [float("nan")] * capacity) for field in TELEMETRY_FIELDS}
+        self.count = 0
+        self.static = None
+        self.disk_path = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def static_info(self) -> dict:
+        """Returns OS, processor and core counts, reading them only once."""
+        if self.static is None:
+            self.static = {
+                "system": platform.system(),
+                "processor": platform.processor() or platform.machine(),
+                "physical_cores": psutil.cpu_count(logical=False),
+                "logical_cores": psutil.cpu_count(logical=True),
+            }
+        return self.static
+
+    def _disk_percent(self) -> float:
+        for path in ([self.disk_path] if self.disk_path else [os.path.abspath(os.sep), 'C:\\']):
+            try:
+                percent = psutil.disk_usage(path).percent
+                self.disk_path = path
+                return percent
+            except Exception:
+                continue
+        return float("nan")
+
+    def sample(self) -> dict:
+        """Reads the dynamic metrics once and appends them to the ring buffer."""
+        reading = {
+            "ram": psutil.virtual_memory().percent,
+            "disk": self._disk_percent(),
+            "cpu": psutil.cpu_percent(interval=None) if self.count else float("nan"),
+            "battery": float("nan"),
+            "plugged": float("nan"),
+        }
+        try:
+            battery = psutil.sensors_battery()
+        except Exception:
+            battery = None
+        if battery:
+            reading["battery"] = battery.percent
+            reading["plugged"] = 1.0 if battery.power_plugged else 0.0
+        with self.lock:
+            slot = self.count % self.capacity
+            self.timestamps[slot] = monotonic()
+            for field in TELEMETRY_FIELDS:
+                self.values[field][slot] = reading[field]
+            self.count += 1
+        return reading
+
+    def start(self) -> None:
+        """Starts background sampling."""
+        if self.worker is not None:
+            return
+        self.stopped.clear()
+        self.worker = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self.worker.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.worker = None
+
+    def _run(self) -> None:
+        try:
+            self.static_info()
+        except Exception as e:
+            print(f"Could not read system information: {e}")
+        while not self.stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Telemetry sampling failed: {e}")
+            self.stopped.wait(self.interval)
+
+    def latest(self, max_age: Optional[float] = None) -> dict:
+        """Returns the newest reading, sampling now if it is older than `max_age`."""
+        max_age = 2 * self.interval if max_age is None else max_age
+        with self.lock:
+            if self.count:
+                slot = (self.count - 1) % self.capacity
+                if monotonic() - self.timestamps[slot] <= max_age:
+                    return {field: self.values[field][slot] for field in TELEMETRY_FIELDS}
+        return self.sample()
+
+    def history(self, field: str, seconds: float) -> list:
+        """Returns [(age_seconds, value)] for readings of `field` in the last `seconds`, oldest first."""
+        now = monotonic()
+        with self.lock:
+            n = min(self.count, self.capacity)
+            slots = [(self.count - n + i) % self.capacity for i in range(n)]
+            return [(now - self.timestamps[slot], self.values[field][slot]) for slot in slots
+                    if now - self.timestamps[slot] <= seconds and not isnan(self.values[field][slot])]
+
+    def trend(self, field: str, seconds: float) -> Optional[dict]:
+        """Summarizes `field` over the last `seconds`, or None without readings."""
+        points = self.history(field, seconds)
+        if not points:
+            return None
+        values = [value for _, value in points]
+        return {
+            "span": points[0][0],
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "min": min(values),
+            "max": max(values),
+            "first": values[0],
+            "last": values[-1],
+        }
+
+
+_telemetry = None
+
+
+def get_telemetry() -> TelemetrySampler:
+    """Returns the shared telemetry sampler, starting it on first use."""
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = TelemetrySampler()
+        _telemetry.start()
+    return _telemetry
+
+
+def get_system_info() -> None:
+    """Gets and speaks system information."""
+    telemetry = get_telemetry()
+    static = telemetry.static_info()
+    reading = telemetry.latest()
+
+    info = f"Operating System: {static['system']}\n"
+    info += f"Processor: {static['processor']}\n"
+    info += f"RAM Usage: {reading['ram']}%\n"
+    info += f"Disk Usage: {reading['disk']}%" if not isnan(reading['disk']) else "Disk Usage: N/A"
+
+    speak("Here's your system information:")
+    print(info)
+    speak(info)
+
+def get_battery_status() -> None:
+    """Gets and speaks battery information."""
+    reading = get_telemetry().latest()
+    if not isnan(reading["battery"]):
+        status = "plugged in" if reading["plugged"] else "not plugged in"
+        info = f"Battery percentage is {reading['battery']:g}% and power is {status}"
+    else:
+        info = "Battery information not available"
+
+    speak(info)
+    print(info)
+
+
+def report_trend(field: str, seconds: float) -> None:
+    """Speaks how a metric has changed over the last `seconds`."""
+    name = TELEMETRY_NAMES.get(field, field)
+    trend = get_telemetry().trend(field, seconds)
+    if trend is None:
+        info = f"I don't have any {name.lower()} readings for that period yet."
+    else:
+        minutes = max(round(trend["span"] / 60), 1)
+        period = "minute" if minutes == 1 else f"{minutes} minutes"
+        info = (f"{name} over the last {period} averaged {trend['mean']:.0f}%, "
+                f"ranging from {trend['min']:.0f} to {trend['max']:.0f}%, and is now {trend['last']:.0f}%.")
+    speak(info)
+    print(info)
+
+
+PROCESS_SAMPLE_INTERVAL = 5.0
+PROCESS_HISTORY_SECONDS = 600
+
+
+class ProcessSnapshot:
+    """All processes at one point in time, stored column-wise in arrays."""
+
+    def __init__(self, timestamp: float):
+        self.timestamp = timestamp
+        self.pids = array('l')
+        self.names = []
+        self.rss = array('Q')
+        self.cpu_time = array('d')
+        self.by_pid = {}
+
+    def add(self, pid: int, name: str, rss: int, cpu_time: float) -> None:
+        self.by_pid[pid] = len(self.pids)
+        self.pids.append(pid)
+        self.names.append(name)
+        self.rss.append(rss)
+        self.cpu_time.append(cpu_time)
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+
+class ProcessMonitor:
+    """Samples running processes in the background and answers queries from the cache.
+
+    Each sample is one psutil.process_iter() pass. Top-k queries use
+    heapq.nlargest over the latest snapshot, and CPU usage is computed from
+    CPU time deltas between snapshots, so it can be ranked over any window
+    covered by the kept history. The idle process (pid 0) is never ranked.
+    """
+
+    def __init__(self, interval: float = PROCESS_SAMPLE_INTERVAL, history_seconds: float = PROCESS_HISTORY_SECONDS):
+        self.interval = interval
+        self.history = deque(maxlen=max(int(history_seconds / interval), 2) + 1)
+        self.total_memory = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def sample(self) -> ProcessSnapshot:
+        """Takes a snapshot of all processes and adds it to the history."""
+        snapshot = ProcessSnapshot(monotonic())
+        for proc in psutil.process_iter(['pid', 'name', 'memory_info', 'cpu_times']):
+            try:
+                info = proc.info
+                memory, cpu = info.get('memory_info'), info.get('cpu_times')
+                snapshot.add(info['pid'], info.get('name') or 'Unknown',
+                             memory.rss if memory else 0, cpu.user + cpu.system if cpu else 0.0)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        if self.total_memory is None:
+            self.total_memory = psutil.virtual_memory().total
+        with self.lock:
+            self.history.append(snapshot)
+        return snapshot
+
+    def start(self) -> None:
+        """Starts background sampling every `interval` seconds."""
+        if self.worker is not None:
+            return
+        self.stopped.clear()
+        self.worker = threading.Thread(target=self._run, name="process-monitor", daemon=True)
+        self.worker.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.worker = None
+
+    def _run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Process sampling failed: {e}")
+            self.stopped.wait(self.interval)
+
+    def trim_history(self, keep: int = 2) -> int:
+        """Keeps only the newest `keep` snapshots; returns how many were dropped."""
+        with self.lock:
+            dropped = max(len(self.history) - keep, 0)
+            for _ in range(dropped):
+                self.history.popleft()
+        return dropped
+
+    def latest(self) -> ProcessSnapshot:
+        """Returns the newest snapshot, sampling now if there is none yet."""
+        with self.lock:
+            if self.history:
+                return self.history[-1]
+        return self.sample()
+
+    def top_memory(self, k: int = 5) -> list:
+        """Returns [(name, rss_bytes, memory_percent)] for the k largest processes."""
+        snap = self.latest()
+        top = heapq.nlargest(k, range(len(snap)), key=snap.rss.__getitem__)
+        total = self.total_memory or 1
+        return [(snap.names[i], snap.rss[i], snap.rss[i] * 100.0 / total) for i in top]
+
+    def cpu_usage(self, window: Optional[float] = None) -> tuple:
+        """Returns (snapshot, {index: cpu_percent}) averaged over roughly `window` seconds."""
+        with self.lock:
+            history = list(self.history)
+        if len(history) < 2:
+            if not history:
+                history.append(self.sample())
+            sleep(0.5)
+            history.append(self.sample())
+        latest = history[-1]
+        window = window or self.interval
+        base = history[0]
+        for snap in reversed(history[:-1]):
+            base = snap
+            if latest.timestamp - snap.timestamp >= window:
+                break
+        elapsed = max(latest.timestamp - base.timestamp, 1e-6)
+        usage = {}
+        for i, pid in enumerate(latest.pids):
+            if pid == 0:
+                continue  # Windows reports idle time as the CPU use of "System Idle Process"
+            j = base.by_pid.get(pid)
+            if j is not None and base.names[j] == latest.names[i]:
+                usage[i] = max(latest.cpu_time[i] - base.cpu_time[j], 0.0) * 100.0 / elapsed
+        return latest, usage
+
+    def top_cpu(self, k: int = 5, window: Optional[float] = None) -> list:
+        """Returns [(name, cpu_percent)] for the k busiest processes over `window` seconds."""
+        snap, usage = self.cpu_usage(window)
+        return [(snap.names[i], usage[i]) for i in heapq.nlargest(k, usage, key=usage.__getitem__)]
+
+    def find(self, name: str) -> list:
+        """Returns [(pid, name, rss_bytes)] for processes whose name contains `name`."""
+        snap = self.latest()
+        key = normalize_name(name)
+        return [(snap.pids[i], snap.names[i], snap.rss[i]) for i in range(len(snap))
+                if key and key in normalize_name(snap.names[i])]
+
+
+_process_monitor = None
+
+
+def get_process_monitor() -> ProcessMonitor:
+    """Returns the shared process monitor, starting background sampling on first use."""
+    global _process_monitor
+    if _process_monitor is None:
+        _process_monitor = ProcessMonitor()
+        _process_monitor.start()
+    return _process_monitor
+
+
+def get_running_processes(by: str = "memory") -> None:
+    """Gets and speaks information about running processes."""
+    monitor = get_process_monitor()
+    if by == "cpu":
+        speak("Here are the top 5 processes by CPU usage:")
+        for proc_name, cpu in monitor.top_cpu(5):
+            info = f"{proc_name}: {cpu:.1f}% CPU"
+            print(info)
+            speak(info)
+        return
+
+    speak("Here are the top 5 processes by memory usage:")
+    for proc_name, _, memory in monitor.top_memory(5):
+        info = f"{proc_name}: {memory:.1f}% memory"
+        print(info)
+        speak(info)
+
+
+def find_process(name: str) -> None:
+    """Says whether a process with the given name is running."""
+    matches = get_process_monitor().find(name)
+    if matches:
+        total = sum(rss for _, _, rss in matches) / (1024 * 1024)
+        info = f"{matches[0][1]} is running with {len(matches)} processes using {total:.0f} megabytes"
+    else:
+        info = f"No process named {name} is running"
+    speak(info)
+    print(info)
+
+
+MUSIC_INDEX_FILE = "music_index.json"
+MUSIC_INDEX_VERSION = 1
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.flac', '.wav', '.ogg', '.oga', '.opus', '.wma', '.aac')
+
+
+def read_track_tags(path: str) -> list:
+    """Returns [title, artist, album] for an audio file.
+
+    Uses mutagen when installed; otherwise, or for untagged files, falls back
+    to "Artist - Title" in the file name and the parent folder as album.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    artist, title = stem.split(" - ", 1) if " - " in stem else ("", stem)
+    album = os.path.basename(os.path.dirname(path))
+    if MUTAGEN_AVAILABLE:
+        try:
+            tags = mutagen.File(path, easy=True)
+            if tags is not None and tags.tags:
+                title = (tags.get("title") or [title])[0]
+                artist = (tags.get("artist") or [artist])[0]
+                album = (tags.get("album") or [album])[0]
+        except Exception:
+            pass
+    return [title.strip(), artist.strip(), album.strip()]
+
+
+class MusicLibrary:
+    """Index of the audio files under a music folder, with their tags.
+
+    The index is stored in MUSIC_INDEX_FILE. refresh() only relists folders
+    whose mtime changed and only reads tags for files in those folders and
+    files it has not seen, so large libraries stay cheap to keep up to date.
+    """
+
+    def __init__(self, root: str, path: Optional[str] = MUSIC_INDEX_FILE):
+        self.root = root
+        self.path = path
+        self.dirs = {}
+        self.tracks = {}
+        self.matcher = None
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.load()
+
+    def load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") == MUSIC_INDEX_VERSION and data.get("root") == self.root:
+                self._swap(data.get("dirs", {}), data.get("tracks", {}))
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"version": MUSIC_INDEX_VERSION, "root": self.root, "dirs": self.dirs,
+                           "tracks": self.tracks}, file, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save music index: {e}")
+
+    def _swap(self, dirs: dict, tracks: dict) -> None:
+        labels = []
+        for track_path, (title, artist, _) in tracks.items():
+            labels.append((title, track_path))
+            if artist:
+                labels.append((f"{artist} {title}", track_path))
+        with self.lock:
+            self.dirs = dirs
+            self.tracks = tracks
+            self.matcher = FuzzyMatcher(labels)
+        if tracks:
+            self.ready.set()
+
+    def refresh(self) -> None:
+        """Rescans changed folders, reads tags for new files and saves the index."""
+        old_dirs, old_tracks = self.dirs, self.tracks
+        dirs = refresh_dir_index(old_dirs, [self.root], AUDIO_EXTENSIONS)
+        changed = {folder for folder, (mtime, _, _) in dirs.items()
+                   if folder not in old_dirs or old_dirs[folder][0] != mtime}
+        paths = [(folder, os.path.join(folder, file)) for folder, (_, _, files) in dirs.items() for file in files]
+        new_paths = [track_path for folder, track_path in paths if folder in changed or not old_tracks.get(track_path)]
+        with ThreadPoolExecutor(max_workers=CRAWL_WORKERS, thread_name_prefix="tags") as pool:
+            new_tags = dict(zip(new_paths, pool.map(read_track_tags, new_paths)))
+        tracks = {track_path: new_tags.get(track_path) or old_tracks[track_path] for _, track_path in paths}
+        self._swap(dirs, tracks)
+        self.ready.set()
+        self.save()
+
+    def start_refresh(self) -> threading.Thread:
+        """Refreshes the index on a background thread."""
+        def worker():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Music index refresh failed: {e}")
+            finally:
+                self.ready.set()
+
+        thread = threading.Thread(target=worker, name="music-index", daemon=True)
+        thread.start()
+        return thread
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """Returns up to `limit` (path, [title, artist, album], score), best first.
+
+        Matches against "title" and "artist title" for every track.
+        """
+        with self.lock:
+            matcher, tracks = self.matcher, self.tracks
+        if matcher is None:
+            return []
+        results = []
+        seen = set()
+        for _, track_path, score in matcher.search(query, limit=limit * 2):
+            if track_path not in seen:
+                seen.add(track_path)
+                results.append((track_path, tracks[track_path], score))
+        return results[:limit]
+
+
+_music_library = None
+
+
+def get_music_library() -> MusicLibrary:
+    """Returns the library for the user's Music folder, refreshing it in the background."""
+    global _music_library
+    if _music_library is None:
+        _music_library = MusicLibrary(os.path.join(os.path.expanduser("~"), "Music"))
+        _music_library.start_refresh()
+    return _music_library
+
+
+def play_music(song_name=None) -> None:
+    """Plays music from the user's Music directory."""
+    library = get_music_library()
+    if not os.path.exists(library.root):
+        speak("Music folder not found on this system.")
+        print(f"Music folder not found: {library.root}")
+        return
+
+    library.ready.wait(timeout=30)
+    if song_name:
+        matches = library.search(song_name)
+        track_path = matches[0][0] if matches else None
+    else:
+        track_path = random.choice(list(library.tracks)) if library.tracks else None
+
+    if track_path:
+        title, artist, _ = library.tracks[track_path]
+        song = f"{title} by {artist}" if artist else title
+        try:
+            os.startfile(track_path)
+            speak(f"Playing {song}.")
+            print(f"Playing {track_path}.")
+        except Exception as e:
+            speak("Couldn't play the song.")
+            print(f"Error playing song: {e}")
+    else:
+        speak("No song found.")
+        print("No song found.")
+
+
+def set_name() -> None:
+    """Sets a new name for the assistant."""
+    speak("What would you like to name me?")
+    name = takecommand()
+    if name:
+        with open("assistant_name.txt", "w") as file:
+            file.write(name)
+        speak(f"Alright, I will be called {name} from now on.")
+    else:
+        speak("Sorry, I couldn't catch that.")
+
+def load_name() -> str:
+    """Loads the assistant's name from a file, or uses a default name."""
+    try:
+        with open("assistant_name.txt", "r") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return "viserys"
+
+
+WAKE_WORD_MODE = os.environ.get("VISERYS_WAKE_WORD", "") not in ("", "0")
+WAKE_WORD_DIR = "wake_word"
+WAKE_WORD_SAMPLERATE = 16000
+WAKE_WORD_THRESHOLD = 20.0
+WAKE_WORD_MARGIN = 1.5
+WAKE_WORD_ENROLL_SAMPLES = 3
+MFCC_COEFFICIENTS = 13
+MFCC_MEL_BANDS = 26
+MFCC_FRAME_MS = 25
+MFCC_HOP_MS = 10
+
+_mfcc_filters = {}
+
+
+def mel_filterbank(samplerate: int, n_fft: int, n_mels: int = MFCC_MEL_BANDS) -> np.ndarray:
+    """Returns a cached (n_mels, n_fft // 2 + 1) triangular mel filterbank."""
+    key = (samplerate, n_fft, n_mels)
+    if key not in _mfcc_filters:
+        high = 2595 * np.log10(1 + (samplerate / 2) / 700)
+        hz = 700 * (10 ** (np.linspace(0, high, n_mels + 2) / 2595) - 1)
+        bins = np.floor((n_fft + 1) * hz / samplerate).astype(int)
+        bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+        for m in range(1, n_mels + 1):
+            left, center, right = bins[m - 1], bins[m], bins[m + 1]
+            if center > left:
+                bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+            if right > center:
+                bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+        _mfcc_filters[key] = bank
+    return _mfcc_filters[key]
+
+
+def log_mel_energies(samples: np.ndarray, samplerate: int = WAKE_WORD_SAMPLERATE,
+                     n_mels: int = MFCC_MEL_BANDS) -> np.ndarray:
+    """Computes log mel band energies, one row per 10 ms frame."""
+    samples = np.asarray(samples, dtype=np.float32)
+    frame_len = int(samplerate * MFCC_FRAME_MS / 1000)
+    hop = int(samplerate * MFCC_HOP_MS / 1000)
+    if len(samples) < frame_len:
+        samples = np.pad(samples, (0, frame_len - len(samples)))
+    emphasized = np.append(samples[0], samples[1:] - 0.97 * samples[:-1])
+    frames = np.lib.stride_tricks.sliding_window_view(emphasized, frame_len)[::hop] * np.hamming(frame_len)
+    n_fft = 1 << (frame_len - 1).bit_length()
+    power = np.abs(np.fft.rfft(frames, n_fft)) ** 2 / n_fft
+    return np.log(power @ mel_filterbank(samplerate, n_fft, n_mels).T + 1e-10)
+
+
+def mfcc(samples: np.ndarray, samplerate: int = WAKE_WORD_SAMPLERATE,
+         n_coefficients: int = MFCC_COEFFICIENTS, dynamic_range: Optional[float] = None) -> np.ndarray:
+    """Computes MFCC features, one row per 10 ms frame.
+
+    The energy coefficient c0 is dropped so loudness does not affect matching.
+    No mean normalization is applied: it would depend on whatever else is in
+    the utterance and break matching the wake word inside a longer phrase.
+    With `dynamic_range` (in nats), log energies further below the loudest
+    one are raised to that floor.
+    """
+    energies = log_mel_energies(samples, samplerate)
+    if dynamic_range is not None:
+        energies = np.maximum(energies, energies.max() - dynamic_range)
+    n_mels = energies.shape[1]
+    dct = np.cos(np.pi / n_mels * (np.arange(n_mels) + 0.5)[None, :] * np.arange(1, n_coefficients + 1)[:, None])
+    return energies @ dct.T
+
+
+def subsequence_dtw(template: np.ndarray, query: np.ndarray) -> float:
+    """Returns the mean per-frame cost of the best alignment of `template` inside `query`.
+
+    The template may start and end anywhere in the query, so a wake word at
+    the start of a longer phrase still matches. Each row of the DTW matrix is
+    computed in one vectorized step using (1,0), (1,1) and (1,2) moves.
+    """
+    cost = np.sqrt(((template[:, None, :] - query[None, :, :]) ** 2).sum(axis=2))
+    acc = cost[0].copy()
+    for i in range(1, len(template)):
+        prev = acc
+        best = prev.copy()
+        best[1:] = np.minimum(best[1:], prev[:-1])
+        best[2:] = np.minimum(best[2:], prev[:-2])
+        acc = cost[i] + best
+    return float(acc.min() / len(template))
+
+
+def audio_samples(audio: sr.AudioData, samplerate: int = WAKE_WORD_SAMPLERATE) -> np.ndarray:
+    """Returns mono int16 samples of `audio` at `samplerate`."""
+    return np.frombuffer(audio.get_raw_data(convert_rate=samplerate, convert_width=2), dtype=np.int16)
+
+
+class WakeWordDetector:
+    """Detects the assistant's name with MFCC features and DTW template matching.
+
+    Templates are WAV recordings of the name stored under WAKE_WORD_DIR. The
+    acceptance threshold is derived from how far the templates are from each
+    other, so it adapts to the speaker and microphone.
+    """
+
+    def __init__(self, name: Optional[str] = None, template_dir: str = WAKE_WORD_DIR,
+                 threshold: Optional[float] = None):
+        self.name = name or load_name()
+        self.template_dir = os.path.join(template_dir, normalize_name(self.name) or "default")
+        self.templates = []
+        self.fixed_threshold = threshold
+        self.threshold = threshold or WAKE_WORD_THRESHOLD
+        self.load_templates()
+
+    def load_templates(self) -> None:
+        self.templates = []
+        if os.path.isdir(self.template_dir):
+            for file in sorted(os.listdir(self.template_dir)):
+                if file.lower().endswith(".wav"):
+                    self.templates.append(mfcc(audio_samples(audio_from_wav(os.path.join(self.template_dir, file)))))
+        self.calibrate()
+
+    def calibrate(self) -> None:
+        """Sets the threshold from the largest distance between templates."""
+        if self.fixed_threshold is not None or len(self.templates) < 2:
+            return
+        distances = [subsequence_dtw(a, b) for a in self.templates for b in self.templates if a is not b]
+        self.threshold = max(distances) * WAKE_WORD_MARGIN
+
+    def add_template(self, audio: sr.AudioData, save: bool = True) -> None:
+        """Adds a recording of the wake word, optionally saving it as WAV."""
+        samples = audio_samples(audio)
+        if save:
+            os.makedirs(self.template_dir, exist_ok=True)
+            path = os.path.join(self.template_dir, f"template_{len(self.templates) + 1}.wav")
+            with wave.open(path, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(WAKE_WORD_SAMPLERATE)
+                wav.writeframes(samples.tobytes())
+        self.templates.append(mfcc(samples))
+        self.calibrate()
+
+    def replace_templates(self, recordings: list) -> None:
+        """Deletes the saved templates and saves `recordings` in their place."""
+        if os.path.isdir(self.template_dir):
+            for file in os.listdir(self.template_dir):
+                if file.lower().endswith(".wav"):
+                    os.remove(os.path.join(self.template_dir, file))
+        self.templates = []
+        self.threshold = self.fixed_threshold or WAKE_WORD_THRESHOLD
+        for audio in recordings:
+            self.add_template(audio)
+
+    def score(self, audio: sr.AudioData) -> float:
+        """Returns the distance to the closest template (lower is more similar)."""
+        if not self.templates:
+            return float("inf")
+        samples = audio_samples(audio)
+        frame = int(WAKE_WORD_SAMPLERATE * VAD_FRAME_MS / 1000)
+        usable = len(samples) // frame * frame
+        if not usable or not vad_frames(samples[:usable].reshape(-1, frame)).any():
+            return float("inf")
+        features = mfcc(samples)
+        return min((subsequence_dtw(template, features) for template in self.templates
+                    if len(features) * 2 >= len(template)), default=float("inf"))
+
+    def detect(self, audio: sr.AudioData) -> bool:
+        return self.score(audio) <= self.threshold
+
+
+_wake_word_detector = None
+
+
+def get_wake_word_detector() -> WakeWordDetector:
+    """Returns the detector for the current assistant name."""
+    global _wake_word_detector
+    name = load_name()
+    if _wake_word_detector is None or _wake_word_detector.name != name:
+        _wake_word_detector = WakeWordDetector(name)
+    return _wake_word_detector
+
+
+def enroll_wake_word() -> None:
+    """Records the assistant's name a few times, replacing any earlier wake word templates.
+
+    The old templates are kept if no new sample is recorded.
+    """
+    detector = get_wake_word_detector()
+    session = get_microphone_session()
+    session.open()
+    recordings = []
+    for n in range(WAKE_WORD_ENROLL_SAMPLES):
+        speak(f"Please say {detector.name}. Sample {n + 1} of {WAKE_WORD_ENROLL_SAMPLES}.")
+        flush_speech()
+        try:
+            with DIALOG_ACTIVE.hold():
+                recordings.append(session.listen(6))
+        except sr.WaitTimeoutError:
+            speak("I didn't hear anything.")
+    if recordings:
+        detector.replace_templates(recordings)
+    speak(f"Recorded {len(recordings)} samples of my name.")
+
+
+def wait_for_wake_word(detector: Optional[WakeWordDetector] = None, source=None) -> float:
+    """Blocks until the wake word is heard and returns its distance score."""
+    detector = detector or get_wake_word_detector()
+    source = source or get_microphone_session()
+    while True:
+        try:
+            audio = source.listen(1)
+        except sr.WaitTimeoutError:
+            continue
+        distance = detector.score(audio)
+        if distance <= detector.threshold:
+            return distance
+
+
+def evaluate_wake_word(detector: WakeWordDetector, positives: list, negatives: list) -> dict:
+    """Measures detection latency and accept/reject rates on WAV fixtures."""
+    latencies = []
+    false_rejects = 0
+    false_accepts = 0
+    for path, expected in [(p, True) for p in positives] + [(p, False) for p in negatives]:
+        audio = audio_from_wav(path)
+        started = perf_counter()
+        detected = detector.detect(audio)
+        latencies.append(perf_counter() - started)
+        if expected and not detected:
+            false_rejects += 1
+        elif detected and not expected:
+            false_accepts += 1
+    latencies.sort()
+    return {
+        "threshold": detector.threshold,
+        "false_reject_rate": false_rejects / len(positives) if positives else 0.0,
+        "false_accept_rate": false_accepts / len(negatives) if negatives else 0.0,
+        "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p95_latency": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+    }
+
+
+WIKI_CACHE_FILE = "wikipedia_cache.json"
+WIKI_CACHE_SIZE = 256
+WIKI_CACHE_TTL = 7 * 24 * 3600
+WIKI_NEGATIVE_TTL = 24 * 3600
+WIKI_PREFETCH_OPTIONS = 3
+WIKI_AUTO_SUGGEST = True
+
+
+def normalize_wiki_query(query: str) -> str:
+    """Normalizes a Wikipedia query so equivalent phrasings share a cache key."""
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+class WikipediaCache:
+    """Size-bounded LRU cache of Wikipedia lookups with per-entry expiry.
+
+    Entries are ("summary", text), ("disambiguation", options) or
+    ("missing", None), keyed by normalized query and persisted to `path`.
+    When a query is ambiguous, the first few options are fetched in the
+    background so the more specific follow-up is answered from the cache.
+    `module` defaults to the wikipedia package and can be any object with
+    summary() and matching exceptions.
+    """
+
+    def __init__(self, path: Optional[str] = WIKI_CACHE_FILE, max_entries: int = WIKI_CACHE_SIZE,
+                 ttl: float = WIKI_CACHE_TTL, negative_ttl: float = WIKI_NEGATIVE_TTL, module=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.wiki = module or wikipedia
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for key, entry in json.load(file):
+                    self.entries[key] = entry
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with self.save_lock:
+            with self.lock:
+                data = list(self.entries.items())
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    json.dump(data, file, separators=(',', ':'))
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Could not save Wikipedia cache: {e}")
+
+    def get(self, query: str) -> Optional[tuple]:
+        """Returns the cached (kind, value) for a query, or None if absent or expired."""
+        key = normalize_wiki_query(query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] < datetime.now().timestamp():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry["kind"], entry["value"]
+
+    def put(self, query: str, kind: str, value) -> None:
+        """Stores a lookup result, evicting the least recently used entries."""
+        ttl = self.negative_ttl if kind == "missing" else self.ttl
+        key = normalize_wiki_query(query)
+        with self.lock:
+            self.entries[key] = {"kind": kind, "value": value, "expires": datetime.now().timestamp() + ttl}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def trim(self, max_entries: int) -> int:
+        """Drops expired entries, then the least recently used beyond `max_entries`.
+
+        Returns how many were dropped.
+        """
+        now = datetime.now().timestamp()
+        with self.lock:
+            before = len(self.entries)
+            for key in [key for key, entry in self.entries.items() if entry["expires"] < now]:
+                del self.entries[key]
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+            return before - len(self.entries)
+
+    def fetch(self, query: str) -> tuple:
+        """Looks a query up on Wikipedia and caches the outcome.
+
+        Network and other unexpected errors are raised and not cached.
+        """
+        try:
+            result = ("summary", self.wiki.summary(query, sentences=2, auto_suggest=WIKI_AUTO_SUGGEST))
+        except self.wiki.exceptions.DisambiguationError as e:
+            result = ("disambiguation", [str(option) for option in e.options])
+        except self.wiki.exceptions.PageError:
+            result = ("missing", None)
+        self.put(query, *result)
+        return result
+
+    def lookup(self, query: str) -> tuple:
+        """Returns (kind, value) for a query from the cache or from Wikipedia."""
+        cached = self.get(query)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        result = self.fetch(query)
+        if result[0] == "disambiguation":
+            self.prefetch(result[1][:WIKI_PREFETCH_OPTIONS])
+        self.save()
+        return result
+
+    def prefetch(self, queries: list) -> threading.Thread:
+        """Fetches uncached queries on a background thread."""
+        def worker():
+            for option in queries:
+                if self.get(option) is None:
+                    try:
+                        self.fetch(option)
+                    except Exception:
+                        pass
+            self.save()
+
+        thread = threading.Thread(target=worker, name="wiki-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+
+_wikipedia_cache = None
+
+
+def get_wikipedia_cache() -> WikipediaCache:
+    """Returns the shared Wikipedia cache, loading it on first use."""
+    global _wikipedia_cache
+    if _wikipedia_cache is None:
+        _wikipedia_cache = WikipediaCache()
+    return _wikipedia_cache
+
+
+def search_wikipedia(query):
+    """Searches Wikipedia and returns a summary."""
+    try:
+        speak("Searching Wikipedia...")
+        kind, result = get_wikipedia_cache().lookup(query)
+        if kind == "summary":
+            speak(result)
+            print(result)
+        elif kind == "disambiguation":
+            speak("Multiple results found. Please be more specific.")
+            print("Did you mean: " + ", ".join(result[:8]))
+        else:
+            speak("I couldn't find anything on Wikipedia.")
+    except Exception:
+        speak("I couldn't find anything on Wikipedia.")
+
+
+class Intent:
+    """A command the assistant understands: its trigger words, patterns and handler.
+
+    `keywords` are the tokens that can trigger the intent; only intents
+    sharing a token with the utterance have their patterns tried. Named
+    groups in `patterns` become slots passed to the handler.
+
+    `exclusive` intents never run alongside other commands in a batch: those
+    that ask the user a question or stop the assistant. It may be a function
+    of the slots for intents that only ask when a slot is missing.
+    """
+
+    def __init__(self, name: str, keywords, patterns, handler, priority: int = 0, exclusive=False):
+        self.name = name
+        self.keywords = set(keywords)
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.handler = handler
+        self.priority = priority
+        self.exclusive = exclusive
+
+
+class IntentMatch:
+    """The intent chosen for an utterance and the slots extracted from it."""
+
+    def __init__(self, intent: Intent, slots: dict, span: int, start: int = 0):
+        self.intent = intent
+        self.slots = slots
+        self.span = span
+        self.start = start
+
+    def run(self):
+        return self.intent.handler(self.slots)
+
+    @property
+    def exclusive(self) -> bool:
+        exclusive = self.intent.exclusive
+        return bool(exclusive(self.slots) if callable(exclusive) else exclusive)
+
+
+class IntentRegistry:
+    """Routes utterances to intents through a keyword index.
+
+    Matching looks up the utterance's tokens to find candidate intents, so
+    its cost depends on the words spoken rather than on how many commands
+    are registered. Among matching patterns, the highest priority wins, then
+    the longest matched span.
+    """
+
+    TOKEN_RE = re.compile(r"[a-z0-9+']+")
+
+    def __init__(self):
+        self.intents = {}
+        self.by_keyword = {}
+        self.words = None
+
+    def register(self, name: str, keywords, patterns, handler, priority: int = 0, exclusive=False) -> Intent:
+        """Adds an intent, replacing any existing intent with the same name."""
+        if name in self.intents:
+            self.unregister(name)
+        intent = Intent(name, keywords, patterns, handler, priority, exclusive)
+        self.intents[name] = intent
+        self.words = None
+        for keyword in intent.keywords:
+            self.by_keyword.setdefault(keyword, []).append(intent)
+        return intent
+
+    def unregister(self, name: str) -> None:
+        intent = self.intents.pop(name)
+        self.words = None
+        for keyword in intent.keywords:
+            self.by_keyword[keyword].remove(intent)
+
+    def intent(self, name: str, keywords, patterns, priority: int = 0, exclusive=False):
+        """Decorator form of register()."""
+        def decorator(handler):
+            self.register(name, keywords, patterns, handler, priority, exclusive)
+            return handler
+        return decorator
+
+    def candidates(self, text: str) -> list:
+        """Returns the intents that share a keyword with `text`."""
+        seen = {}
+        for token in self.TOKEN_RE.findall(text):
+            for intent in self.by_keyword.get(token, ()):
+                seen[intent.name] = intent
+        return list(seen.values())
+
+    def match(self, text: str) -> Optional[IntentMatch]:
+        """Returns the best matching intent for `text`, or None."""
+        text = text.lower().strip()
+        best = None
+        best_key = None
+        for intent in self.candidates(text):
+            for pattern in intent.patterns:
+                m = pattern.search(text)
+                if not m:
+                    continue
+                key = (intent.priority, m.end() - m.start())
+                if best_key is None or key > best_key:
+                    slots = {k: v.strip() for k, v in m.groupdict().items() if v and v.strip()}
+                    best = IntentMatch(intent, slots, key[1], m.start())
+                    best_key = key
+        return best
+
+    def vocabulary(self) -> frozenset:
+        """Returns the keywords and the literal words used in the patterns."""
+        if self.words is None:
+            words = set(self.by_keyword)
+            for intent in self.intents.values():
+                for pattern in intent.patterns:
+                    source = re.sub(r"\(\?P<\w+>|\\[a-zA-Z]", " ", pattern.pattern)
+                    words.update(re.findall(r"[a-z][a-z']+", source))
+            self.words = frozenset(words)
+        return self.words
+
+    def match_partial(self, text: str) -> Optional[IntentMatch]:
+        """Matches a partial hypothesis, returning None unless the result is settled.
+
+        A trailing word fragment is completed when exactly one vocabulary word
+        starts with it ("what is the ti" -> "what is the time"). The match is
+        settled when appending any vocabulary word (or an unknown one) keeps
+        the same intent and slots, matches nothing, or only matches another
+        intent later in the text (a second command rather than a different
+        reading of this one). Open ended slots such as a Wikipedia query
+        therefore never commit early. An extension that turns the whole text
+        into another intent's slot ("... wikipedia") is ignored: any command
+        could be followed by that word.
+        """
+        tokens = self.TOKEN_RE.findall(text.lower())
+        if not tokens:
+            return None
+        words = self.vocabulary()
+        if tokens[-1] not in words:
+            completions = [word for word in words if word.startswith(tokens[-1])]
+            if len(completions) > 1:
+                return None
+            if completions:
+                tokens[-1] = completions[0]
+        text = " ".join(tokens)
+        match = self.match(text)
+        if match is None:
+            return None
+        for word in itertools.chain(words, ("something",)):
+            extended = self.match(f"{text} {word}")
+            if extended is None:
+                continue
+            if extended.intent is match.intent:
+                if extended.slots != match.slots:
+                    return None
+            elif extended.start <= match.start and text not in extended.slots.values():
+                return None
+        return match
+
+
+INTENTS = IntentRegistry()
+
+
+@INTENTS.intent("time", ["time"], [
+    r"\bwhat(?:'s| is)? (?:the )?(?:current )?time\b(?! does)",
+    r"\bwhat time is it\b",
+    r"\b(?:tell me|say) the time\b",
+    r"\b(?:current time|time now)\b",
+    r"^(?:the )?time(?: please)?$",
+])
+def handle_time(slots: dict) -> None:
+    time()
+
+
+@INTENTS.intent("date", ["date", "today's"], [
+    r"\bwhat(?:'s| is)? (?:the |today's )?(?:current )?date\b",
+    r"\b(?:tell me the date|today's date|current date)\b",
+    r"^(?:the )?date(?: please)?$",
+])
+def handle_date(slots: dict) -> None:
+    date()
+
+
+WIKIPEDIA_FILLER_WORDS = frozenset(("wikipedia", "search", "for", "about", "on", "in", "from"))
+
+
+def wikipedia_query(text: str) -> str:
+    """Returns the search terms in `text`.
+
+    Drops "wikipedia" wherever it appears and filler words such as "search",
+    "on" and "from" at either end, so "who is alan turing wikipedia" and
+    "python from wikipedia" keep their query.
+    """
+    words = [word for word in text.split() if word != "wikipedia"]
+    while words and words[0] in WIKIPEDIA_FILLER_WORDS:
+        words.pop(0)
+    while words and words[-1] in WIKIPEDIA_FILLER_WORDS:
+        words.pop()
+    return " ".join(words)
+
+
+@INTENTS.intent("wikipedia", ["wikipedia"], [
+    r"(?:search\s+(?:on\s+)?)?wikipedia(?:\s+(?:for|about))?\s*(?P<query>.*)$",
+    r"^(?P<query>.+?)\s+wikipedia$",
+], exclusive=lambda slots: not wikipedia_query(slots.get("query", "")))
+def handle_wikipedia(slots: dict) -> None:
+    wiki_query = wikipedia_query(slots.get("query", ""))
+    if not wiki_query:
+        wiki_query = takecommand("What would you like to search on Wikipedia?")
+    if wiki_query:
+        search_wikipedia(wiki_query)
+    else:
+        speak("No search query provided for Wikipedia.")
+
+
+@INTENTS.intent("play_music", ["play"], [r"\bplay\s+(?:music|songs?)\b\s*(?P<song>.*)$"],
+                exclusive=lambda slots: "song" not in slots)
+def handle_play_music(slots: dict) -> None:
+    song_name = slots.get("song")
+    if not song_name:
+        song_name = takecommand("Which song would you like to play? Say part of the name.")
+    play_music(song_name)
+
+
+@INTENTS.intent("open_youtube", ["youtube"], [r"\bopen\s+youtube\b"], priority=1)
+def handle_open_youtube(slots: dict) -> None:
+    wb.open("youtube.com")
+
+
+@INTENTS.intent("open_google", ["google"], [r"\bopen\s+google\b"], priority=1)
+def handle_open_google(slots: dict) -> None:
+    wb.open("google.com")
+
+
+@INTENTS.intent("change_name", ["name"], [r"\bchange\s+your\s+name\b"], exclusive=True)
+def handle_change_name(slots: dict) -> None:
+    set_name()
+
+
+@INTENTS.intent("change_microphone", ["microphone", "device"], [
+    r"\b(?:change|select|switch)\s+(?:the\s+)?microphone\b",
+    r"\binput\s+device\b",
+], exclusive=True)
+def handle_change_microphone(slots: dict) -> None:
+    use_input_device(choose_input_device())
+    speak("Input device updated.")
+
+
+@INTENTS.intent("train_wake_word", ["wake"], [r"\b(?:train|record|set up)\s+(?:the\s+)?wake\s+word\b"],
+                exclusive=True)
+def handle_train_wake_word(slots: dict) -> None:
+    enroll_wake_word()
+
+
+@INTENTS.intent("screenshot", ["screenshot", "screenshots", "screen"], [
+    r"\bscreen\s?shot\b",
+    r"\b(?:take\s+)?(?P<count>\d+)\s+screen\s?shots\b(?:\s+every\s+(?P<interval>\d+(?:\.\d+)?)\s+seconds?)?",
+])
+def handle_screenshot(slots: dict) -> None:
+    count = int(slots.get("count", 1))
+    interval = float(slots.get("interval", 1))
+    screenshot(count, interval)
+
+
+@INTENTS.intent("joke", ["joke"], [r"\b(?:tell\s+me\s+a\s+)?joke\b"])
+def handle_joke(slots: dict) -> None:
+    joke = random.choice(JOKES)
+    speak(joke)
+    print(joke)
+
+
+@INTENTS.intent("open_notepad", ["notepad"], [r"\bopen\s+notepad$"], priority=1)
+def handle_open_notepad(slots: dict) -> None:
+    open_notepad()
+
+
+@INTENTS.intent("open_app", ["open"], [r"\bopen\s+(?P<app>.+)$", r"^open$"], exclusive=True)
+def handle_open_app(slots: dict) -> None:
+    app_name = slots.get("app")
+    if not app_name:
+        app_name = takecommand("Which application would you like me to open?")
+    if app_name:
+        open_app(app_name)
+    else:
+        speak("Please specify which application to open.")
+
+
+@INTENTS.intent("system_info", ["system"], [r"\bsystem\s+info(?:rmation)?\b"])
+def handle_system_info(slots: dict) -> None:
+    get_system_info()
+
+
+@INTENTS.intent("battery", ["battery"], [r"\bbattery\b"])
+def handle_battery(slots: dict) -> None:
+    get_battery_status()
+
+
+@INTENTS.intent("trend", ["last", "past"], [
+    r"\b(?P<metric>memory|ram|cpu|processor|disk|battery)\b.*?\b(?:over|in|for|during)\s+the\s+(?:last|past)\s+"
+    r"(?:(?P<amount>\d+|an?|one)\s+)?(?P<unit>seconds?|minutes?|hours?)\b",
+], priority=1)
+def handle_trend(slots: dict) -> None:
+    field = {"memory": "ram", "processor": "cpu"}.get(slots["metric"], slots["metric"])
+    amount = slots.get("amount", "1")
+    amount = int(amount) if amount.isdigit() else 1
+    unit = {"s": 1, "m": 60, "h": 3600}[slots["unit"][0]]
+    report_trend(field, amount * unit)
+
+
+@INTENTS.intent("processes", ["processes"], [
+    r"\b(?:running|top)\s+processes\b(?:.*\b(?P<by>cpu|memory)\b)?",
+])
+def handle_processes(slots: dict) -> None:
+    get_running_processes(slots.get("by", "memory"))
+
+
+@INTENTS.intent("find_process", ["running"], [r"\bis\s+(?P<name>.+?)\s+(?:still\s+)?running\b"])
+def handle_find_process(slots: dict) -> None:
+    find_process(slots["name"])
+
+
+@INTENTS.intent("shutdown", ["shutdown", "shut"], [r"\bshut\s?down\b"], exclusive=True)
+def handle_shutdown(slots: dict) -> bool:
+    speak("Shutting down the system, goodbye!", wait=True)
+    os.system("shutdown /s /f /t 1")
+    return True
+
+
+@INTENTS.intent("restart", ["restart"], [r"\brestart\b"], exclusive=True)
+def handle_restart(slots: dict) -> bool:
+    speak("Restarting the system, please wait!", wait=True)
+    os.system("shutdown /r /f /t 1")
+    return True
+
+
+@INTENTS.intent("exit", ["offline", "exit"], [r"\boffline\b", r"\bexit\b"], exclusive=True)
+def handle_exit(slots: dict) -> bool:
+    speak("Going offline. Have a good day!", wait=True)
+    return True
+
+
+def run_match(match: IntentMatch) -> bool:
+    """Runs a matched command's handler. Returns True when the assistant should stop."""
+    with TRACER.span(f"handler:{match.intent.name}"):
+        return bool(match.run())
+
+
+def run_command(query: str) -> bool:
+    """Dispatches one recognized command. Returns True when the assistant should stop."""
+    with TRACER.span("dispatch"):
+        match = INTENTS.match(query)
+    if match is None:
+        print(f"No command matched: {query}")
+        return False
+    return run_match(match)
+
+
+BATCH_WORKERS = 4
+COMMAND_SEPARATOR_RE = re.compile(r"(\s*[,;]\s*(?:and\s+)?(?:then\s+)?|\s+and\s+then\s+|\s+then\s+|\s+and\s+)")
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor() -> ThreadPoolExecutor:
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+        return _batch_executor
+
+
+def split_commands(text: str) -> list:
+    """Splits a compound utterance such as "take a screenshot and tell me the battery status".
+
+    Text is cut at "and", "then", commas and semicolons, but a piece is only
+    kept apart when both it and the text before it match a command on their
+    own, so "play music simon and garfunkel" stays one command.
+    """
+    parts = COMMAND_SEPARATOR_RE.split(text.strip())
+    commands = []
+    current = parts[0]
+    for separator, piece in zip(parts[1::2], parts[2::2]):
+        if piece.strip() and INTENTS.match(piece) and INTENTS.match(current):
+            commands.append(current)
+            current = piece
+        else:
+            current += separator + piece
+    commands.append(current)
+    return [command.strip() for command in commands if command.strip()]
+
+
+def _run_concurrently(matches: list, turn: Optional[int]) -> bool:
+    """Runs independent commands on the batch pool, replaying their speech in order."""
+    def worker(match):
+        with TRACER.turn(turn), collect_speech() as said:
+            try:
+                stop = run_match(match)
             except Exception as e:
-                speak("Couldn't open WhatsApp automatically. Please open it from the Start menu or provide the path.")
-                print(f"WhatsApp open error: {e}")
-                return
+                print(f"Command failed: {match.intent.name}: {e}")
+                stop = False
+        return stop, said
 
-        if app_name_lower in common_apps:
-            command = common_apps[app_name_lower]
-            if command.endswith('.exe'):
-                os.startfile(command)
-            else:
-                os.system(command)
-            speak(f"Opening {app_name}")
-            print(f"Opening {app_name}")
-            return
+    futures = [get_batch_executor().submit(worker, match) for match in matches]
+    stop = False
+    for future in futures:
+        match_stop, said = future.result()
+        for text in said:
+            speak(text)
+        stop = stop or match_stop
+    return stop
 
-        possible_matches = []
-        search_term = app_name_lower.replace(" ", "").replace(".", "")
 
-        for installed_app, path in INSTALLED_APPS.items():
-            if search_term in installed_app.replace(" ", "").replace(".", ""):
-                possible_matches.append((installed_app, path))
+def run_batch(commands: list) -> bool:
+    """Runs several commands, overlapping consecutive independent ones.
 
-        if len(possible_matches) == 1:
-            app_path = f'"{possible_matches[0][1]}"'
-            os.startfile(possible_matches[0][1])
-            speak(f"Opening {possible_matches[0][0]}")
-            print(f"Opening application: {app_path}")
+    Exclusive commands (see Intent) run on their own, after everything before
+    them has finished. Returns True when a command asks the assistant to stop;
+    later commands are then skipped.
+    """
+    turn = TRACER.current_turn()
+    group = []
+    for command in commands + [None]:
+        match = None
+        if command is not None:
+            with TRACER.span("dispatch"):
+                match = INTENTS.match(command)
+            if match is None:
+                print(f"No command matched: {command}")
+                continue
+            if not match.exclusive:
+                group.append(match)
+                continue
+        if len(group) > 1 and _run_concurrently(group, turn):
+            return True
+        if len(group) == 1:
+            with TRACER.turn(turn):
+                if run_match(group[0]):
+                    return True
+        group = []
+        if match is not None:
+            with TRACER.turn(turn):
+                if run_match(match):
+                    return True
+    return False
 
-        elif len(possible_matches) > 1:
-            speak("I found multiple possible matches. Please choose one of the following options.")
-            print("Multiple matches found:")
-            for i, (app, _) in enumerate(possible_matches[:8], 1):
-                print(f"{i}. {app}")
-                speak(f"Option {i}: {app}")
 
-            choice = takecommand("Please say the number or name of the application you want to open.")
-            if choice:
-                digits = ''.join(filter(str.isdigit, choice))
-                if digits:
-                    idx = int(digits) - 1
-                    if 0 <= idx < len(possible_matches):
-                        os.startfile(possible_matches[idx][1])
-                        speak(f"Opening {possible_matches[idx][0]}")
-                        print(f"Opening application: {possible_matches[idx][1]}")
-                        return
+def has_exclusive_command(query: str) -> bool:
+    """Returns True when any command in a possibly compound utterance is exclusive."""
+    for command in split_commands(query):
+        match = INTENTS.match(command)
+        if match is not None and match.exclusive:
+            return True
+    return False
 
-                choice_name = choice.replace(' ', '').lower()
-                for app, path in possible_matches:
-                    if choice_name in app.replace(' ', '').lower():
-                        os.startfile(path)
-                        speak(f"Opening {app}")
-                        print(f"Opening application: {path}")
-                        return
 
-            speak("Couldn't understand your choice. Aborting open request.")
+def run_commands(query: str) -> bool:
+    """Dispatches a possibly compound utterance. Returns True when the assistant should stop."""
+    commands = split_commands(query)
+    if len(commands) == 1:
+        return run_command(commands[0])
+    return run_batch(commands)
 
-        else:
-            command = f"start {app_name_lower}"
-            os.system(command)
-            speak(f"Attempting to open {app_name}")
-            print(f"Executing command: {command}")
 
-    except Exception as e:
-        speak(f"Sorry, I couldn't open {app_name}")
-        print(f"Error: {e}")
-        print("Try using the exact application name or provide more specific keywords.")
+def run_script(path: str) -> dict:
+    """Runs the commands in a text file (one or more per line, "-" for stdin) without audio input."""
+    with (sys.stdin if path == "-" else open(path, "r", encoding="utf-8")) as f:
+        lines = [line.strip() for line in f]
+    commands = [command for line in lines if line and not line.startswith("#")
+                for command in split_commands(line)]
+    started = perf_counter()
+    stopped = run_batch(commands)
+    flush_speech()
+    elapsed = perf_counter() - started
+    return {"commands": len(commands), "elapsed": elapsed, "stopped": stopped,
+            "commands_per_sec": len(commands) / elapsed if elapsed else 0.0}
 
-def get_system_info() -> None:
-    """Gets and speaks system information."""
-    system = platform.system()
-    processor = platform.processor()
-    memory = psutil.virtual_memory()
-    disk_path = os.path.abspath(os.sep)
-    try:
-        disk = psutil.disk_usage(disk_path)
-    except Exception:
+
+def _run_in_turn(match: IntentMatch, turn: Optional[int]) -> bool:
+    with TRACER.turn(turn):
         try:
-            disk = psutil.disk_usage('C:\\')
-        except Exception:
-            disk = None
+            return run_match(match)
+        except Exception as e:
+            print(f"Command failed: {match.intent.name}: {e}")
+            return False
 
-    info = f"Operating System: {system}\n"
-    info += f"Processor: {processor}\n"
-    info += f"RAM Usage: {memory.percent}%\n"
-    info += f"Disk Usage: {disk.percent}%" if disk else "Disk Usage: N/A"
 
-    speak("Here's your system information:")
-    print(info)
-    speak(info)
+def _same_command(match: Optional[IntentMatch], other: IntentMatch) -> bool:
+    return match is not None and match.intent is other.intent and match.slots == other.slots
 
-def get_battery_status() -> None:
-    """Gets and speaks battery information."""
-    battery = psutil.sensors_battery()
-    if battery:
-        status = "plugged in" if battery.power_plugged else "not plugged in"
-        info = f"Battery percentage is {battery.percent}% and power is {status}"
+
+def stream_command(samplerate: int, timeout: float = 6, device: Optional[int] = None, stream_factory=None,
+                   backend: Optional[RecognizerBackend] = None) -> Optional[dict]:
+    """Captures one command while streaming it to the recognizer, acting on the first settled partial.
+
+    Blocks are preprocessed and fed to the backend's recognition stream as
+    capture_utterance() classifies them. When a partial hypothesis settles on
+    a command (IntentRegistry.match_partial) that is not exclusive, its
+    handler starts on the batch pool while the user is still talking;
+    otherwise the final transcript is dispatched with run_commands(). After
+    an early start, the rest of the final transcript (e.g. "... and tell me
+    a joke") is run too; if the final transcript no longer contains the early
+    command, the correction is spoken and the whole transcript is run.
+
+    Returns None if no speech started, else a dict with the final "text",
+    the "intent" that ran, whether it ran "early" and was "corrected", "stop", and
+    "speech_to_action" / "speech_to_final" in seconds from speech start.
+    """
+    backend = backend or get_recognizer_backend()
+    pre = AudioPreprocessor(samplerate)
+    stream = backend.start_stream(RECOGNITION_SAMPLERATE)
+    turn = TRACER.current_turn()
+    state = {"speech": None, "partial": None, "match": None, "action": None, "future": None}
+
+    def on_block(block, speaking):
+        if speaking and state["speech"] is None:
+            state["speech"] = perf_counter()
+        partial = stream.feed(pre.process(block).copy())
+        if state["match"] is not None or not partial or partial == state["partial"]:
+            return
+        state["partial"] = partial
+        match = INTENTS.match_partial(partial)
+        if match is not None and not match.exclusive:
+            print(f"Acting on partial: {partial}")
+            state["match"], state["action"] = match, perf_counter()
+            state["future"] = get_batch_executor().submit(_run_in_turn, match, turn)
+
+    with TRACER.span("capture", streaming=True):
+        audio = capture_utterance(samplerate, timeout, device, stream_factory, on_block=on_block)
+    if audio is None and state["match"] is None:
+        return None
+    try:
+        stream.feed(pre.flush())
+        text = stream.finish()
+    except sr.UnknownValueError:
+        text = None
+    final = perf_counter()
+    speech = state["speech"] or final
+
+    match = state["match"]
+    corrected = False
+    if match is not None:
+        stop = bool(state["future"].result())
+        action = state["action"]
+        commands = split_commands(text) if text else []
+        covered = next((i for i, command in enumerate(commands) if _same_command(INTENTS.match(command), match)), None)
+        if covered is not None:
+            del commands[covered]
+        elif commands:
+            corrected = True
+            print(f"Final transcript {text!r} differs from the early command {match.intent.name}.")
+            speak(f"Correction, I heard: {text}.")
+        if commands and not stop:
+            stop = run_batch(commands)
     else:
-        info = "Battery information not available"
+        match = INTENTS.match(text) if text else None
+        action = final
+        stop = run_commands(text) if text else False
+    TRACER.record("speech_to_action", speech, action - speech)
+    return {"text": text, "intent": match.intent.name if match else None, "early": state["match"] is not None,
+            "corrected": corrected, "stop": stop, "speech_to_action": action - speech,
+            "speech_to_final": final - speech}
 
-    speak(info)
-    print(info)
 
-def get_running_processes() -> None:
-    """Gets and speaks information about running processes."""
-    processes = []
-    for proc in psutil.process_iter(['name', 'memory_percent']):
-        try:
-            mem = proc.info.get('memory_percent') or 0.0
-            name = proc.info.get('name') or 'Unknown'
-            processes.append((name, mem))
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            pass
+def streaming_available() -> bool:
+    """Returns True when streaming is enabled and the recognizer backend supports it."""
+    if not (STREAMING_RECOGNITION and SD_AVAILABLE):
+        return False
+    try:
+        return get_recognizer_backend().streaming
+    except Exception as e:
+        print(f"Streaming recognition is unavailable: {e}")
+        return False
 
-    processes.sort(key=lambda x: x[1], reverse=True)
-    top_processes = processes[:5]
 
-    speak("Here are the top 5 processes by memory usage:")
-    for proc_name, memory in top_processes:
-        info = f"{proc_name}: {memory:.1f}% memory"
-        print(info)
-        speak(info)
+def streaming_turn(timeout: float = 6) -> bool:
+    """Listens for one command with streaming recognition. Returns True when the assistant should stop."""
+    picked = pick_input_device()
+    if picked is None:
+        speak("No input audio devices detected. Please connect a microphone and ensure it's enabled in Windows settings.")
+        return False
+    dev_index, dev_name, samplerate = picked
+    speak("Listening now.")
+    flush_speech()
+    try:
+        result = stream_command(samplerate, timeout, device=dev_index)
+    except Exception as e:
+        print(f"Streaming capture failed: {e}")
+        return False
+    if result is None:
+        speak("Timeout occurred. Please try again.")
+        return False
+    if result["intent"] is None:
+        speak("Sorry, I did not understand that.")
+    return result["stop"]
 
-def play_music(song_name=None) -> None:
-    """Plays music from the user's Music directory."""
-    song_dir = os.path.expanduser("~\\Music")
-    if not os.path.exists(song_dir):
-        speak("Music folder not found on this system.")
-        print(f"Music folder not found: {song_dir}")
-        return
 
-    songs = [f for f in os.listdir(song_dir) if os.path.isfile(os.path.join(song_dir, f))]
+DISPATCH_CORPUS = [
+    "what is the time",
+    "what time does youtube open",
+    "what's the date today",
+    "search wikipedia python programming",
+    "play music coldplay yellow",
+    "open youtube",
+    "open vs code",
+    "open notepad",
+    "update my notepad",
+    "take a screenshot",
+    "tell me a joke",
+    "battery status",
+    "show me the top processes",
+    "system information please",
+]
 
-    if song_name:
-        songs = [song for song in songs if song_name.lower() in song.lower()]
 
-    if songs:
-        song = random.choice(songs)
+def benchmark_dispatch(corpus: Optional[list] = None, repeat: int = 1000) -> dict:
+    """Measures intent matching cost over a corpus of utterances (without running handlers)."""
+    corpus = corpus or DISPATCH_CORPUS
+    started = perf_counter()
+    for _ in range(repeat):
+        for utterance in corpus:
+            INTENTS.match(utterance)
+    elapsed = perf_counter() - started
+    matches = {}
+    for utterance in corpus:
+        match = INTENTS.match(utterance)
+        matches[utterance] = match.intent.name if match else None
+    return {"intents": len(INTENTS.intents), "utterances": len(corpus) * repeat,
+            "mean_us": elapsed / (len(corpus) * repeat) * 1e6, "matches": matches}
+
+
+PIPELINE_MODE = os.environ.get("VISERYS_PIPELINE", "") not in ("", "0")
+PIPELINE_LISTEN_TIMEOUT = 0.5
+PIPELINE_AUDIO_QUEUE_SIZE = 4
+PIPELINE_RECOGNITION_WORKERS = 2
+PIPELINE_HANDLER_WORKERS = 4
+
+
+class StageStats:
+    """Keeps recent durations per stage and summarizes them."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.samples = {}
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            self.counts[stage] += 1
+
+    def summary(self) -> dict:
+        """Returns {stage: {count, mean, p50, p95, max}} with times in seconds."""
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+            counts = dict(self.counts)
+        result = {}
+        for stage, values in samples.items():
+            result[stage] = {
+                "count": counts[stage],
+                "mean": sum(values) / len(values),
+                "p50": values[int(0.5 * (len(values) - 1))],
+                "p95": values[int(0.95 * (len(values) - 1))],
+                "max": values[-1],
+            }
+        return result
+
+
+class CommandPipeline:
+    """Runs capture, recognition and command handling as concurrent stages.
+
+    A capture thread keeps pulling phrases from `source` (anything with a
+    listen(timeout) method, normally the MicrophoneSession) into a bounded
+    queue; recognition workers turn them into text, and handlers run on a
+    thread pool, so a slow Wikipedia lookup never stops the next command
+    from being heard. When the audio queue is full the oldest phrase is
+    dropped. Handlers that ask a follow-up question through takecommand()
+    pause the capture thread while they listen.
+
+    Turns keep the order they were heard in: recognized text is released in
+    capture order, and a dispatcher thread starts the handlers in that order
+    and replays their speech in order, as run_batch() does. Exclusive
+    commands run on their own once every earlier handler has finished.
+    """
+
+    def __init__(self, source=None, backend: Optional[RecognizerBackend] = None, dispatch=None,
+                 recognition_workers: int = PIPELINE_RECOGNITION_WORKERS,
+                 handler_workers: int = PIPELINE_HANDLER_WORKERS):
+        self.source = source
+        self.backend = backend
+        self.dispatch = dispatch or run_commands
+        self.audio_queue = queue.Queue(maxsize=PIPELINE_AUDIO_QUEUE_SIZE)
+        self.commands = queue.Queue()
+        self.recognized = {}
+        self.sequence = 0
+        self.delivered = 0
+        self.running = deque()
+        self.recognition_workers = recognition_workers
+        self.handlers = ThreadPoolExecutor(max_workers=handler_workers, thread_name_prefix="handler")
+        self.stats = StageStats()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.started = None
+        self.completed = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts the capture and recognition threads."""
+        if self.source is None:
+            self.source = get_microphone_session()
+        if self.backend is None:
+            self.backend = get_recognizer_backend()
+        self.started = perf_counter()
+        self.threads = [threading.Thread(target=self._capture_loop, name="pipeline-capture", daemon=True),
+                        threading.Thread(target=self._dispatch_loop, name="pipeline-dispatch", daemon=True)]
+        for n in range(self.recognition_workers):
+            self.threads.append(threading.Thread(target=self._recognition_loop, name=f"pipeline-recognize-{n}",
+                                                 daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until a handler asks to stop. Returns False on timeout."""
+        return self.stopped.wait(timeout)
+
+    def close(self) -> None:
+        """Stops the stages and waits for running handlers to finish."""
+        self.stop()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.handlers.shutdown(wait=True)
+
+    def submit_audio(self, audio, captured_at: Optional[float] = None, turn: Optional[int] = None) -> None:
+        """Queues captured audio for recognition, dropping the oldest if full."""
+        with self.lock:
+            sequence = self.sequence
+            self.sequence += 1
+        if self.audio_queue.full():
+            try:
+                dropped = self.audio_queue.get_nowait()
+                with self.lock:
+                    self.dropped += 1
+                self._deliver(dropped[3], None)
+            except queue.Empty:
+                pass
+        self.audio_queue.put((captured_at or perf_counter(), audio, turn or TRACER.new_turn(), sequence))
+
+    def submit_text(self, text: str, captured_at: Optional[float] = None, turn: Optional[int] = None) -> None:
+        """Queues a recognized command for the dispatcher, after every command already released."""
+        self.commands.put((text.lower().strip(), captured_at or perf_counter(), turn or TRACER.new_turn()))
+
+    def _deliver(self, sequence: int, item: Optional[tuple]) -> None:
+        """Records the outcome of phrase `sequence` (None if it produced no text) and
+        releases every consecutive recognized command to the dispatcher."""
+        with self.lock:
+            self.recognized[sequence] = item
+            while self.delivered in self.recognized:
+                item = self.recognized.pop(self.delivered)
+                self.delivered += 1
+                if item is not None:
+                    self.commands.put(item)
+
+    def _capture_loop(self) -> None:
+        while not self.stopped.is_set():
+            if DIALOG_ACTIVE.is_set():
+                sleep(0.05)
+                continue
+            started = perf_counter()
+            try:
+                audio = self.source.listen(PIPELINE_LISTEN_TIMEOUT)
+            except sr.WaitTimeoutError:
+                continue
+            except Exception as e:
+                print(f"Capture error: {e}")
+                sleep(1)
+                continue
+            if DIALOG_ACTIVE.is_set():
+                # A handler started asking a follow-up while we were listening: the phrase is its answer.
+                unread = getattr(self.source, "unread", None)
+                if unread is not None:
+                    unread(audio)
+                continue
+            turn = TRACER.new_turn()
+            self.stats.record("capture", perf_counter() - started)
+            TRACER.record("capture", started, perf_counter() - started, turn)
+            self.submit_audio(audio, turn=turn)
+
+    def _recognition_loop(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                captured_at, audio, turn, sequence = self.audio_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            started = perf_counter()
+            self.stats.record("queue_wait", started - captured_at)
+            text = None
+            try:
+                with TRACER.turn(turn):
+                    text = self.backend.recognize(audio)
+            except sr.UnknownValueError:
+                self.stats.record("recognize", perf_counter() - started)
+            except sr.RequestError:
+                speak("Speech recognition service is unavailable.")
+            except Exception as e:
+                print(f"Recognition error: {e}")
+            else:
+                self.stats.record("recognize", perf_counter() - started)
+                print(f"Heard: {text}")
+            self._deliver(sequence, (text.lower().strip(), captured_at, turn) if text else None)
+
+    def _dispatch_loop(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                text, captured_at, turn = self.commands.get(timeout=0.05)
+            except queue.Empty:
+                self._replay(wait=False)
+                continue
+            if has_exclusive_command(text):
+                self._replay(wait=True)
+                if self.stopped.is_set():
+                    break
+                self._execute(text, captured_at, turn)
+            else:
+                self.running.append(self.handlers.submit(self._execute_collected, text, captured_at, turn))
+                self._replay(wait=False)
+        self._replay(wait=True)
+
+    def _replay(self, wait: bool) -> None:
+        """Speaks the replies of finished handlers in the order they were started.
+
+        With `wait`, blocks until every running handler has finished.
+        """
+        while self.running and (wait or self.running[0].done()):
+            for text in self.running.popleft().result():
+                speak(text)
+
+    def _execute_collected(self, text: str, captured_at: float, turn: Optional[int] = None) -> list:
+        with collect_speech() as said:
+            self._execute(text, captured_at, turn)
+        return said
+
+    def _execute(self, text: str, captured_at: float, turn: Optional[int] = None) -> bool:
+        started = perf_counter()
         try:
-            os.startfile(os.path.join(song_dir, song))
-            speak(f"Playing {song}.")
-            print(f"Playing {song}.")
+            with TRACER.turn(turn):
+                stop = self.dispatch(text)
         except Exception as e:
-            speak("Couldn't play the song.")
-            print(f"Error playing song: {e}")
-    else:
-        speak("No song found.")
-        print("No song found.")
+            print(f"Command failed: {e}")
+            stop = False
+        finished = perf_counter()
+        self.stats.record("handler", finished - started)
+        self.stats.record("end_to_end", finished - captured_at)
+        with self.lock:
+            self.completed += 1
+        if stop:
+            self.stop()
+        return bool(stop)
 
-def set_name() -> None:
-    """Sets a new name for the assistant."""
-    speak("What would you like to name me?")
-    name = takecommand()
-    if name:
-        with open("assistant_name.txt", "w") as file:
-            file.write(name)
-        speak(f"Alright, I will be called {name} from now on.")
-    else:
-        speak("Sorry, I couldn't catch that.")
+    def report(self) -> dict:
+        """Returns throughput, queue depth and per-stage latency statistics."""
+        elapsed = perf_counter() - self.started if self.started else 0.0
+        return {
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "commands_per_sec": self.completed / elapsed if elapsed else 0.0,
+            "audio_queue": self.audio_queue.qsize(),
+            "stages": self.stats.summary(),
+        }
 
-def load_name() -> str:
-    """Loads the assistant's name from a file, or uses a default name."""
+
+def run_pipeline() -> dict:
+    """Runs the assistant in pipelined mode until a command stops it."""
+    pipeline = CommandPipeline()
+    pipeline.start()
+    speak("Listening for your commands.")
     try:
-        with open("assistant_name.txt", "r") as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        return "viserys"
+        pipeline.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.close()
+    return pipeline.report()
 
 
-def search_wikipedia(query):
-    """Searches Wikipedia and returns a summary."""
+BENCHMARK_CORPUS = [
+    "what is the time",
+    "what's the date today",
+    "tell me a joke",
+    "battery status",
+    "system information please",
+    "show me the top processes",
+    "is python running",
+    "make me a sandwich",
+]
+
+
+def synthetic_utterance(text: str, samplerate: int = 16000) -> np.ndarray:
+    """Returns a deterministic voiced-sounding signal for `text`.
+
+    Each letter is a 70 ms vowel-like segment with three formants derived
+    from the letter, gliding into the next one, so words differ in spectral
+    shape the way speech does. Pitch depends only on the word's position.
+    Used as the audio of corpus entries that have no recording; the stub
+    recognizer supplies the transcript.
+    """
+    segment = int(samplerate * 0.07)
+    widths = np.array([80.0, 120.0, 160.0])
+    weights = 1.0 / np.arange(1, 4)
+    parts = []
+    for position, word in enumerate(text.split()):
+        f0 = 125 + 20 * np.sin(position)
+        digests = [hashlib.sha1(letter.encode("utf-8")).digest() for letter in word]
+        formants = np.array([[250 + d[0] / 255 * 600, 800 + d[1] / 255 * 1600, 2200 + d[2] / 255 * 1000]
+                             for d in digests])
+        n = segment * len(word)
+        centers = (np.arange(len(word)) + 0.5) * segment
+        track = np.stack([np.interp(np.arange(n), centers, formants[:, i]) for i in range(3)], axis=1)
+        harmonics = f0 * np.arange(1, int(4000 / f0))
+        amplitude = (np.exp(-0.5 * ((harmonics[None, :, None] - track[:, None, :]) / widths) ** 2)
+                     * weights).sum(axis=2) + 0.02
+        t = np.arange(n) / samplerate
+        tone = (amplitude * np.sin(2 * np.pi * np.outer(t, harmonics))).sum(axis=1)
+        envelope = np.minimum(1.0, np.minimum(t, t[-1] - t) / 0.02)
+        parts += [3000 * tone / max(1e-9, np.sqrt(np.mean(tone ** 2))) * envelope, np.zeros(int(0.06 * samplerate))]
+    return np.concatenate(parts).astype(np.float32)
+
+
+def load_benchmark_corpus(path: str) -> list:
+    """Reads a corpus file: one utterance per line, either text or `file.wav<TAB>text`."""
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            wav_path, _, text = line.partition("\t")
+            corpus.append((wav_path, text) if text else line.strip())
+    return corpus
+
+
+def _corpus_audio(entry, samplerate: int) -> tuple:
+    """Returns (samples, transcript) for a corpus entry at `samplerate`."""
+    if isinstance(entry, str):
+        return synthetic_utterance(entry, samplerate), entry
+    wav_path, text = entry
+    audio = audio_from_wav(wav_path)
+    rate = audio.sample_rate
+    samples = np.frombuffer(audio.get_raw_data(), dtype=np.int16).astype(np.float32)
+    if rate != samplerate:
+        resampler = PolyphaseResampler(rate, samplerate)
+        samples = np.concatenate([resampler.process(samples), resampler.flush()])
+    return samples, text
+
+
+def _memory_usage() -> Optional[int]:
     try:
-        speak("Searching Wikipedia...")
-        result = wikipedia.summary(query, sentences=2)
-        speak(result)
-        print(result)
-    except wikipedia.exceptions.DisambiguationError:
-        speak("Multiple results found. Please be more specific.")
+        return psutil.Process().memory_info().rss
     except Exception:
-        speak("I couldn't find anything on Wikipedia.")
+        return None
 
 
-if __name__ == "__main__":
-    wishme()
+@contextmanager
+def headless_session(source: str = "microphone", backend: Optional[RecognizerBackend] = None):
+    """Swaps the audio input, recognizer and speech output for in-process fakes.
 
-    while True:
-        query = takecommand("Listening for your command.")
-        if not query:
-            continue
+    Yields (input, backend): a ScriptedMicrophone feeding a MicrophoneSession
+    when `source` is "microphone", or a FakeSoundDevice for "sounddevice".
+    Speech goes to a null sink. Everything is restored on exit.
+    """
+    global VOICE_INPUT_AVAILABLE, SD_AVAILABLE, sd, _microphone_session, _speech_queue, _recognizer_backend
+    saved = (VOICE_INPUT_AVAILABLE, SD_AVAILABLE, sd, _microphone_session, _speech_queue, _recognizer_backend)
+    backend = backend or StubRecognizerBackend()
+    if source == "microphone":
+        fake = ScriptedMicrophone(gate=DIALOG_ACTIVE)
+        VOICE_INPUT_AVAILABLE = True
+        _microphone_session = MicrophoneSession(microphone_factory=lambda device_index=None: fake)
+    elif source == "sounddevice":
+        fake = FakeSoundDevice()
+        VOICE_INPUT_AVAILABLE, SD_AVAILABLE, sd = False, True, fake
+        _microphone_session = None
+    else:
+        raise ValueError(f"unknown benchmark source {source!r}")
+    _speech_queue = SpeechQueue(sink=lambda text: None)
+    _recognizer_backend = backend
+    try:
+        yield fake, backend
+    finally:
+        if _microphone_session is not None and source == "microphone":
+            _microphone_session.close()
+        VOICE_INPUT_AVAILABLE, SD_AVAILABLE, sd, _microphone_session, _speech_queue, _recognizer_backend = saved
 
-        if "time" in query:
-            time()
 
-        elif "date" in query:
-            date()
+def benchmark_session(corpus: Optional[list] = None, source: str = "microphone", repeat: int = 3,
+                      warmup: int = 1, quiet: bool = True) -> dict:
+    """Drives takecommand() and run_command() headlessly over a scripted corpus.
 
-        elif "wikipedia" in query:
-            wiki_query = query.replace("wikipedia", "").strip()
-            if not wiki_query:
-                wiki_query = takecommand("What would you like to search on Wikipedia?")
-            if wiki_query:
-                search_wikipedia(wiki_query)
-            else:
-                speak("No search query provided for Wikipedia.")
+    Each entry is a transcript (played as synthetic_utterance() audio) or a
+    (wav_path, transcript) pair. Audio goes through the fake `source`, real
+    capture and preprocessing, a stub recognizer and the intent handlers,
+    with speech sent to a null sink. Reports commands/sec, per-intent
+    turn latency, per-stage spans and memory use. Needs no network, audio
+    hardware or TTS engine; avoid handlers with side effects in the corpus.
+    """
+    corpus = corpus or BENCHMARK_CORPUS
+    samplerate = 16000
+    if source == "sounddevice":
+        samplerate = 44100
+    utterances = [_corpus_audio(entry, samplerate) for entry in corpus]
+    intents = {}
+    for _, text in utterances:
+        match = INTENTS.match(text)
+        intents[text] = match.intent.name if match else "unmatched"
+
+    turns = StageStats(window=max(len(utterances) * repeat, 1))
+    failures = 0
+    rss_start = _memory_usage()
+    sink = io.StringIO()
+    with headless_session(source) as (fake, backend), redirect_stdout(sink if quiet else sys.stdout):
+        if source == "sounddevice":
+            fake.samplerate = samplerate
+
+        def run_turn(samples, text) -> Optional[float]:
+            fake.queue_audio(samples)
+            backend.expect(text)
+            started = perf_counter()
+            with TRACER.turn():
+                query = takecommand("Listening for your command.")
+                if query:
+                    run_commands(query)
+            flush_speech()
+            sink.seek(0)
+            sink.truncate()
+            return perf_counter() - started if query == text.lower() else None
+
+        for _ in range(warmup):
+            for samples, text in utterances:
+                run_turn(samples, text)
+        TRACER.clear()
+        tracemalloc.start()
+        started = perf_counter()
+        for _ in range(repeat):
+            for samples, text in utterances:
+                latency = run_turn(samples, text)
+                if latency is None:
+                    failures += 1
+                else:
+                    turns.record(intents[text], latency)
+        elapsed = perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    commands = len(utterances) * repeat
+    return {
+        "source": source,
+        "commands": commands,
+        "failed": failures,
+        "elapsed": elapsed,
+        "commands_per_sec": commands / elapsed if elapsed else 0.0,
+        "intents": turns.summary(),
+        "stages": TRACER.summary(),
+        "memory": {"rss_start": rss_start, "rss_end": _memory_usage(),
+                   "traced_current": current, "traced_peak": peak},
+    }
 
-        elif "play music" in query:
-            song_name = query.replace("play music", "").strip()
-            if not song_name:
-                song_name = takecommand("Which song would you like to play? Say part of the name.")
-            play_music(song_name)
 
-        elif "open youtube" in query:
-            wb.open("youtube.com")
+def benchmark_streaming(corpus: Optional[list] = None, quiet: bool = True) -> dict:
+    """Measures time from speech start to action with early intent commit.
 
-        elif "open google" in query:
-            wb.open("google.com")
+    Each corpus entry is played at real-time speed through a FakeSoundDevice
+    into stream_command() with the stub streaming recognizer and a null
+    speech sink. "speech_to_final" is when the final transcript is ready,
+    i.e. the earliest a non-streaming turn could act.
+    """
+    corpus = corpus or BENCHMARK_CORPUS
+    samplerate = 16000
+    results = []
+    with headless_session("sounddevice") as (fake, backend), redirect_stdout(io.StringIO() if quiet else sys.stdout):
+        fake.realtime = True
+        for entry in corpus:
+            samples, text = _corpus_audio(entry, samplerate)
+            fake.queue_audio(samples)
+            backend.expect(text)
+            result = stream_command(samplerate, timeout=5, stream_factory=fake.InputStream, backend=backend)
+            flush_speech()
+            if result is not None:
+                results.append(result)
+    early = [r for r in results if r["early"] and not r["corrected"]]
+    action = sorted(r["speech_to_action"] for r in results)
+    final = sorted(r["speech_to_final"] for r in results)
+    return {
+        "utterances": len(corpus),
+        "recognized": len(results),
+        "early_commits": len(early),
+        "corrections": sum(r["corrected"] for r in results),
+        "mean_saved": sum(r["speech_to_final"] - r["speech_to_action"] for r in early) / len(early) if early else 0.0,
+        "p50_speech_to_action": action[len(action) // 2] if action else None,
+        "p50_speech_to_final": final[len(final) // 2] if final else None,
+        "results": results,
+    }
+
+
+RECOGNITION_CACHE_REPEATS = [
+    "what is the time",
+    "tell me a joke",
+    "battery status",
+    "open notepad",
+]
+RECOGNITION_CACHE_MINIMAL_PAIRS = [
+    ("what is the time", "what is the date"),
+    ("volume up", "volume down"),
+    ("play music", "pause music"),
+    ("open notepad", "open youtube"),
+    ("tell me a joke", "tell me a story"),
+]
+
+
+def check_recognition_cache(noise: tuple = ((1, 100, 1.0), (2, 300, 1.0), (3, 200, 0.6), (4, 300, 1.5))) -> dict:
+    """Checks that the recognition cache hits repeats and misses minimal pairs.
+
+    Every phrase is stored once from a quiet synthetic_utterance(). Each
+    repeat is then looked up again under every (seed, noise level, gain) in
+    `noise` and must return its own transcript, with both halves of every
+    minimal pair in the cache. Each half of a minimal pair is also looked up
+    with only the other half stored and must miss. Returns the distances
+    and a list of failures.
+    """
+    samplerate = 16000
+
+    def features(text: str, seed: int, level: float, gain: float) -> tuple:
+        rng = np.random.default_rng(seed)
+        pad = np.zeros(int(0.3 * samplerate))
+        samples = np.concatenate([pad, gain * synthetic_utterance(text, samplerate), pad])
+        samples = np.clip(samples + rng.normal(0, level, len(samples)), -32768, 32767).astype(np.int16)
+        return audio_fingerprint(sr.AudioData(samples.tobytes(), samplerate, 2))
+
+    phrases = list(dict.fromkeys(RECOGNITION_CACHE_REPEATS + [p for pair in RECOGNITION_CACHE_MINIMAL_PAIRS for p in pair]))
+    cache = RecognitionCache()
+    for text in phrases:
+        cache.store(*features(text, 0, 10, 1.0), text)
+    failures = []
+    repeats = []
+    for text in RECOGNITION_CACHE_REPEATS:
+        for seed, level, gain in noise:
+            hit = cache.lookup(*features(text, seed, level, gain))
+            repeats.append({"text": text, "seed": seed, "level": level, "gain": gain,
+                            "heard": hit and hit[0], "distance": hit and hit[1]})
+            if hit is None or hit[0] != text:
+                failures.append(f"repeat of {text!r} (seed {seed}, noise {level}, gain {gain}) heard {hit and hit[0]!r}")
+    pairs = []
+    for first, second in RECOGNITION_CACHE_MINIMAL_PAIRS:
+        for stored, spoken in ((first, second), (second, first)):
+            stored_features, duration = features(stored, 0, 10, 1.0)
+            spoken_features, _ = features(spoken, 1, 100, 1.0)
+            single = RecognitionCache()
+            single.store(stored_features, duration, stored)
+            hit = single.lookup(spoken_features, duration)
+            pairs.append({"stored": stored, "spoken": spoken,
+                          "distance": utterance_distance(stored_features, spoken_features)})
+            if hit is not None:
+                failures.append(f"{spoken!r} was answered with cached {stored!r}")
+    return {"max_distance": cache.max_distance, "repeats": repeats, "minimal_pairs": pairs, "failures": failures}
+
+
+DAEMON_MODE = os.environ.get("VISERYS_DAEMON", "") not in ("", "0")
+MEMORY_BUDGET_MB = float(os.environ.get("VISERYS_MEMORY_BUDGET_MB", "256"))
+CPU_BUDGET_PERCENT = float(os.environ.get("VISERYS_CPU_BUDGET", "15"))
+RESOURCE_CHECK_INTERVAL = 30.0
+RESOURCE_REPORT_INTERVAL = float(os.environ.get("VISERYS_RESOURCE_REPORT_INTERVAL", "900"))
+RESOURCE_TRACE_WINDOW = 120.0
+RESOURCE_REPORT_FILE = "resource_report.jsonl"
+RESOURCE_THROTTLE_FACTOR = 4
+RESOURCE_SHED_MARGIN = 0.1
+ALLOCATION_SITES = 10
+
+
+def cache_sizes() -> dict:
+    """Returns the number of items held by each in-memory cache that has been created."""
+    sizes = {"trace_spans": len(TRACER.spans), "installed_apps": len(INSTALLED_APPS)}
+    if isinstance(_recognizer_backend, CachingRecognizerBackend):
+        sizes["recognition_cache"] = len(_recognizer_backend.cache.entries)
+    if _wikipedia_cache is not None:
+        sizes["wikipedia_cache"] = len(_wikipedia_cache.entries)
+    if _speech_queue is not None and _speech_queue.cache is not None:
+        sizes["speech_clips"] = len(_speech_queue.cache.clips)
+    if _process_monitor is not None:
+        sizes["process_snapshots"] = len(_process_monitor.history)
+    if _music_library is not None:
+        sizes["music_tracks"] = len(_music_library.tracks)
+    return sizes
+
+
+def shed_caches() -> dict:
+    """Drops in-memory state that can be rebuilt, returning how many items each cache released.
+
+    Recognition results, decoded speech clips, trace spans and old process
+    snapshots are dropped; the Wikipedia cache keeps its most recently used
+    half. Indexes the assistant needs to answer (apps, music) and phrases the
+    user has spoken but not yet been answered for are kept.
+    """
+    released = {"trace_spans": len(TRACER.spans)}
+    TRACER.clear()
+    if isinstance(_recognizer_backend, CachingRecognizerBackend):
+        released["recognition_cache"] = len(_recognizer_backend.cache.entries)
+        _recognizer_backend.cache.clear()
+    if _wikipedia_cache is not None:
+        released["wikipedia_cache"] = _wikipedia_cache.trim(len(_wikipedia_cache.entries) // 2)
+        _wikipedia_cache.save()
+    if _speech_queue is not None and _speech_queue.cache is not None:
+        released["speech_clips"] = _speech_queue.cache.release_clips()
+    if _process_monitor is not None:
+        released["process_snapshots"] = _process_monitor.trim_history()
+    released["gc_objects"] = gc.collect()
+    return released
+
+
+class ResourceGovernor:
+    """Keeps a long-running session within a memory and a CPU budget.
+
+    Every `interval` seconds it reads the process RSS and CPU usage (percent
+    of one core since the previous check). Above `memory_budget_mb` it sheds
+    caches, and sheds again only once RSS has grown by a tenth of the budget
+    since, so a baseline above the budget does not empty the caches on every
+    check. Above `cpu_budget` it sets BACKGROUND_THROTTLED and slows the
+    telemetry and process samplers until usage falls below half the budget.
+
+    Every `report_interval` seconds it appends a JSON report line to
+    `report_path` with RSS, CPU, cache sizes and the top allocation sites.
+    tracemalloc only runs for the `trace_window` seconds before each report,
+    so the sites show what was allocated in that window and is still alive,
+    without paying the tracing overhead for the rest of the session.
+    """
+
+    def __init__(self, memory_budget_mb: float = MEMORY_BUDGET_MB, cpu_budget: float = CPU_BUDGET_PERCENT,
+                 interval: float = RESOURCE_CHECK_INTERVAL, report_interval: float = RESOURCE_REPORT_INTERVAL,
+                 trace_window: float = RESOURCE_TRACE_WINDOW, report_path: Optional[str] = RESOURCE_REPORT_FILE):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.cpu_budget = cpu_budget
+        self.interval = interval
+        self.report_interval = report_interval
+        self.trace_window = min(trace_window, report_interval)
+        self.report_path = report_path
+        self.process = None
+        self.last = {}
+        self.peak_rss = 0
+        self.sheds = []
+        self.shed_floor = 0
+        self.throttled_intervals = {}
+        self.tracing = False
+        self.next_report = None
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def sample(self) -> dict:
+        """Reads RSS in bytes and CPU percent since the previous sample."""
+        if self.process is None:
+            self.process = psutil.Process()
+            self.process.cpu_percent(interval=None)
+        rss = self.process.memory_info().rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.last = {"rss": rss, "cpu": self.process.cpu_percent(interval=None)}
+        return self.last
+
+    def check(self) -> dict:
+        """Samples usage and sheds caches or throttles background work when over budget."""
+        usage = self.sample()
+        if usage["rss"] > max(self.memory_budget, self.shed_floor):
+            released = shed_caches()
+            after = self.process.memory_info().rss
+            self.shed_floor = after + self.memory_budget * RESOURCE_SHED_MARGIN
+            self.sheds.append({"time": datetime.now().isoformat(timespec="seconds"),
+                               "rss_before": usage["rss"], "rss_after": after, "released": released})
+            del self.sheds[:-10]
+            print(f"Memory {usage['rss'] / 2**20:.0f} MB over the {self.memory_budget / 2**20:.0f} MB budget; "
+                  f"shed caches, now {after / 2**20:.0f} MB")
+        if usage["cpu"] > self.cpu_budget:
+            self.throttle(True)
+        elif usage["cpu"] < self.cpu_budget / 2 and BACKGROUND_THROTTLED.is_set():
+            self.throttle(False)
+        return usage
+
+    def throttle(self, enabled: bool) -> None:
+        """Slows or restores background sampling and idle speech rendering."""
+        samplers = [sampler for sampler in (_telemetry, _process_monitor) if sampler is not None]
+        if enabled:
+            BACKGROUND_THROTTLED.set()
+            for sampler in samplers:
+                if sampler not in self.throttled_intervals:
+                    self.throttled_intervals[sampler] = sampler.interval
+                    sampler.interval *= RESOURCE_THROTTLE_FACTOR
+        else:
+            BACKGROUND_THROTTLED.clear()
+            for sampler, interval in self.throttled_intervals.items():
+                sampler.interval = interval
+            self.throttled_intervals = {}
+
+    def start_tracing(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+            self.tracing = True
+
+    def allocation_sites(self, limit: int = ALLOCATION_SITES) -> list:
+        """Returns the top live allocation sites by size, or [] when tracemalloc is off."""
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        return [{"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 "kb": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:limit]]
 
-        elif "change your name" in query:
-            set_name()
+    def report(self) -> dict:
+        """Builds a report, appends it to `report_path` and returns it."""
+        usage = self.last or self.sample()
+        report = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "rss_mb": round(usage["rss"] / 2**20, 1),
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1),
+            "cpu_percent": usage["cpu"],
+            "throttled": BACKGROUND_THROTTLED.is_set(),
+            "sheds": len(self.sheds),
+            "caches": cache_sizes(),
+            "allocations": self.allocation_sites(),
+        }
+        if self.report_path:
+            try:
+                with open(self.report_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(report, separators=(',', ':')) + "\n")
+            except OSError as e:
+                print(f"Could not write resource report: {e}")
+        return report
+
+    def start(self) -> None:
+        """Starts checking usage on a background thread."""
+        if self.worker is not None:
+            return
+        self.stopped.clear()
+        self.next_report = monotonic() + self.report_interval
+        self.worker = threading.Thread(target=self._run, name="resource-governor", daemon=True)
+        self.worker.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.worker = None
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        if BACKGROUND_THROTTLED.is_set():
+            self.throttle(False)
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                usage = self.check()
+                now = monotonic()
+                if not self.tracing and now >= self.next_report - self.trace_window:
+                    self.start_tracing()
+                if now >= self.next_report:
+                    report = self.report()
+                    self.next_report = now + self.report_interval
+                    print(f"Resources: {report['rss_mb']} MB RSS, {usage['cpu']:.0f}% CPU, "
+                          f"{report['sheds']} sheds")
+            except Exception as e:
+                print(f"Resource check failed: {e}")
+
+
+_resource_governor = None
+
+
+def start_resource_governor(memory_budget_mb: float = MEMORY_BUDGET_MB,
+                            cpu_budget: float = CPU_BUDGET_PERCENT) -> ResourceGovernor:
+    """Starts the shared resource governor with the given budgets, once."""
+    global _resource_governor
+    if _resource_governor is None:
+        _resource_governor = ResourceGovernor(memory_budget_mb, cpu_budget)
+        _resource_governor.start()
+    return _resource_governor
+
+
+def prewarm() -> threading.Thread:
+    """Loads heavy modules, audio backends and indexes on a background thread."""
+    def worker():
+        with startup_timer("prewarm"):
+            for module in (sr, np, psutil, wikipedia, ImageGrab):
+                try:
+                    module.load()
+                except Exception as e:
+                    print(f"Could not load {module._name}: {e}")
+            check_audio_backends()
+            ensure_app_index()
+            get_wikipedia_cache()
+            get_telemetry()
+
+    thread = threading.Thread(target=worker, name="prewarm", daemon=True)
+    thread.start()
+    return thread
 
-        elif "screenshot" in query:
-            screenshot()
-            speak("I've taken screenshot, please check it")
 
-        elif "tell me a joke" in query:
-            joke = random.choice(JOKES)
-            speak(joke)
-            print(joke)
+STARTUP_TIMINGS.append(("import viserys", perf_counter() - _IMPORT_STARTED))
 
-        elif "open notepad" in query:
-            open_notepad()
 
-        elif "open" in query:
-            app_name = query.replace("open", "").strip()
-            if not app_name:
-                app_name = takecommand("Which application would you like me to open?")
-            if app_name:
-                open_app(app_name)
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Viserys voice assistant.")
+    parser.add_argument("--profile", action="store_true",
+                        help="print p50/p95 latency per stage on exit")
+    parser.add_argument("--trace", metavar="PATH", default=TRACE_FILE,
+                        help="write recorded spans on exit (.json: Chrome trace format, otherwise JSON lines)")
+    parser.add_argument("--benchmark", choices=("microphone", "sounddevice", "streaming", "recognition-cache"),
+                        help="run the command loop headlessly over a scripted corpus and print a report")
+    parser.add_argument("--corpus", metavar="PATH",
+                        help="benchmark corpus: one utterance per line, text or file.wav<TAB>text")
+    parser.add_argument("--repeat", type=int, default=3, help="benchmark passes over the corpus")
+    parser.add_argument("--script", metavar="PATH",
+                        help="run the commands in a file (one or more per line, - for stdin) and exit")
+    parser.add_argument("--mute", action="store_true", help="print what would be spoken instead of speaking")
+    parser.add_argument("--daemon", action="store_true", default=DAEMON_MODE,
+                        help="keep memory and CPU within budget and write periodic resource reports")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help="daemon mode: shed caches when RSS goes above this")
+    parser.add_argument("--cpu-budget", type=float, default=CPU_BUDGET_PERCENT, metavar="PERCENT",
+                        help="daemon mode: throttle background work above this share of one core")
+    return parser.parse_args(argv)
+
+
+def finish_session(args: argparse.Namespace) -> None:
+    """Exports the trace and prints the profile requested on the command line."""
+    if args.trace:
+        try:
+            TRACER.export(args.trace)
+            print(f"Trace written to {args.trace}")
+        except OSError as e:
+            print(f"Could not write trace: {e}")
+    if args.profile:
+        print(TRACER.profile_report())
+    if _resource_governor is not None:
+        report = _resource_governor.report()
+        _resource_governor.stop()
+        print(f"Resources: {report['rss_mb']} MB RSS, peak {report['peak_rss_mb']} MB, {report['sheds']} sheds")
+
+
+def main(argv: Optional[list] = None) -> None:
+    args = parse_args(argv)
+    if args.mute:
+        set_speech_sink(print)
+    try:
+        if args.script:
+            print(json.dumps(run_script(args.script), indent=2))
+            return
+
+        if args.benchmark:
+            corpus = load_benchmark_corpus(args.corpus) if args.corpus else None
+            if args.benchmark == "streaming":
+                report = benchmark_streaming(corpus)
+            elif args.benchmark == "recognition-cache":
+                report = check_recognition_cache()
             else:
-                speak("Please specify which application to open.")
+                report = benchmark_session(corpus, source=args.benchmark, repeat=args.repeat)
+            print(json.dumps(report, indent=2))
+            return
 
-        elif "system info" in query or "system information" in query:
-            get_system_info()
+        if args.daemon:
+            start_resource_governor(args.memory_budget, args.cpu_budget)
+        wishme()
+        prewarm()
 
-        elif "battery" in query or "battery status" in query:
-            get_battery_status()
+        if PIPELINE_MODE and VOICE_INPUT_AVAILABLE:
+            print(json.dumps(run_pipeline(), indent=2))
+            return
 
-        elif "running processes" in query or "top processes" in query:
-            get_running_processes()
+        wake_word = WAKE_WORD_MODE and VOICE_INPUT_AVAILABLE
+        if wake_word and not get_wake_word_detector().templates:
+            enroll_wake_word()
 
-        elif "shutdown" in query:
-            speak("Shutting down the system, goodbye!")
-            os.system("shutdown /s /f /t 1")
-            break
+        streaming = streaming_available()
+        while True:
+            if wake_word:
+                wait_for_wake_word()
+            with TRACER.turn():
+                if streaming:
+                    if streaming_turn():
+                        break
+                    continue
+                query = takecommand("Listening for your command.")
+                if not query:
+                    continue
 
-        elif "restart" in query:
-            speak("Restarting the system, please wait!")
-            os.system("shutdown /r /f /t 1")
-            break
+                if run_commands(query):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        finish_session(args)
 
-        elif "offline" in query or "exit" in query:
-            speak("Going offline. Have a good day!")
-            break
+
+if __name__ == "__main__":
+    main()